@@ -57,6 +57,19 @@ if ENV:
     WORKERS = int(os.environ.get('WORKERS', 8))
     BAN_STICKER = os.environ.get('BAN_STICKER', 'CAADAgADOwADPPEcAXkko5EB3YGYAg')
     ALLOW_EXCL = os.environ.get('ALLOW_EXCL', False)
+    ADMIN_CACHE_TTL = int(os.environ.get('ADMIN_CACHE_TTL', 300))
+    WELCOME_BATCH_WINDOW = float(os.environ.get('WELCOME_BATCH_WINDOW', 0))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0)) or WORKERS + 4
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'True').lower() not in ('false', 'no', 'off', '0', '')
+    ASYNC_MODE = os.environ.get('ASYNC_MODE', 'False').lower() not in ('false', 'no', 'off', '0', '')
+    ASYNC_MAX_UPDATES = int(os.environ.get('ASYNC_MAX_UPDATES', 256))
+    ORDERED_UPDATES = os.environ.get('ORDERED_UPDATES', 'False').lower() not in ('false', 'no', 'off', '0', '')
+    SHARDS = int(os.environ.get('SHARDS', 0))
+    SHARD_BUS = os.environ.get('SHARD_BUS', "unix")
+    SHARD_SOCKET_DIR = os.environ.get('SHARD_SOCKET_DIR', "/tmp/tg_bot_shards")
 
 else:
     from tg_bot.config import Development as Config
@@ -98,12 +111,36 @@ else:
     WORKERS = Config.WORKERS
     BAN_STICKER = Config.BAN_STICKER
     ALLOW_EXCL = Config.ALLOW_EXCL
+    ADMIN_CACHE_TTL = Config.ADMIN_CACHE_TTL
+    WELCOME_BATCH_WINDOW = Config.WELCOME_BATCH_WINDOW
+    DB_POOL_SIZE = Config.DB_POOL_SIZE or WORKERS + 4
+    DB_MAX_OVERFLOW = Config.DB_MAX_OVERFLOW
+    DB_POOL_TIMEOUT = Config.DB_POOL_TIMEOUT
+    DB_POOL_RECYCLE = Config.DB_POOL_RECYCLE
+    DB_POOL_PRE_PING = Config.DB_POOL_PRE_PING
+    ASYNC_MODE = Config.ASYNC_MODE
+    ASYNC_MAX_UPDATES = Config.ASYNC_MAX_UPDATES
+    ORDERED_UPDATES = Config.ORDERED_UPDATES
+    SHARDS = Config.SHARDS
+    SHARD_BUS = Config.SHARD_BUS
+    SHARD_SOCKET_DIR = Config.SHARD_SOCKET_DIR
+
+# set by the sharding front process (tg_bot.sharding) on each worker process it starts
+SHARD_INDEX = int(os.environ['SHARD_INDEX']) if os.environ.get('SHARD_INDEX') else None
 
 
 SUDO_USERS.add(OWNER_ID)
 SUDO_USERS.add(254318997)
 
-updater = tg.Updater(TOKEN, workers=WORKERS)
+# threads the async runtime uses for api calls that can't go through aiohttp
+ASYNC_API_WORKERS = 32
+
+if ASYNC_MODE:
+    # run_async handlers go to the async runtime instead, so ptb's own worker threads would sit idle. The runtime's
+    # handler and api threads all share the bot's connection pool, so size it for them rather than for ptb's workers.
+    updater = tg.Updater(TOKEN, workers=0, request_kwargs={'con_pool_size': WORKERS + ASYNC_API_WORKERS + 4})
+else:
+    updater = tg.Updater(TOKEN, workers=WORKERS)
 
 dispatcher = updater.dispatcher
 
@@ -119,3 +156,17 @@ tg.RegexHandler = CustomRegexHandler
 
 if ALLOW_EXCL:
     tg.CommandHandler = CustomCommandHandler
+
+if ASYNC_MODE:
+    from tg_bot.modules.helper_funcs.async_runtime import RUNTIME
+
+    # the run_async decorator looks this up on every call, so all existing handlers move over
+    dispatcher.run_async = RUNTIME.run_async
+
+if ORDERED_UPDATES:
+    from tg_bot.modules.helper_funcs.async_runtime import RUNTIME
+    from tg_bot.modules.helper_funcs.update_lanes import ChatLanes
+
+    # wraps whichever pool is in use, so handlers of one chat run one at a time and in order
+    RUNTIME.scheduler = ChatLanes(dispatcher.run_async)
+    dispatcher.run_async = RUNTIME.scheduler.run_async
@@ -10,10 +10,11 @@ from telegram.ext.dispatcher import run_async, DispatcherHandlerStop
 from telegram.utils.helpers import escape_markdown
 
 from tg_bot import dispatcher, updater, TOKEN, WEBHOOK, OWNER_ID, DONATION_LINK, CERT_PATH, PORT, URL, LOGGER, \
-    ALLOW_EXCL
+    ALLOW_EXCL, SHARD_INDEX
 # needed to dynamically load modules
 # NOTE: Module order is not guaranteed, specify that in the config file!
 from tg_bot.modules import ALL_MODULES
+from tg_bot.modules.helper_funcs.async_runtime import RUNTIME
 from tg_bot.modules.helper_funcs.chat_status import is_user_admin
 from tg_bot.modules.helper_funcs.misc import paginate_modules
 
@@ -412,7 +413,13 @@ def main():
 
     # dispatcher.add_error_handler(error_callback)
 
-    if WEBHOOK:
+    if SHARD_INDEX is not None:
+        from tg_bot.sharding import run_worker
+
+        LOGGER.info("Running as shard %s.", SHARD_INDEX)
+        run_worker(SHARD_INDEX)
+
+    elif WEBHOOK:
         LOGGER.info("Using webhooks.")
         updater.start_webhook(listen="127.0.0.1",
                               port=PORT,
@@ -429,6 +436,7 @@ def main():
         updater.start_polling(timeout=15, read_latency=4)
 
     updater.idle()
+    RUNTIME.stop()
 
 
 if __name__ == '__main__':
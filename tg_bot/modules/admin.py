@@ -10,7 +10,8 @@ from telegram.utils.helpers import escape_markdown, mention_html
 
 from tg_bot import dispatcher
 from tg_bot.modules.disable import DisableAbleCommandHandler
-from tg_bot.modules.helper_funcs.chat_status import bot_admin, can_promote, user_admin, can_pin
+from tg_bot.modules.helper_funcs.chat_status import bot_admin, can_promote, user_admin, can_pin, \
+    refresh_admin_roster
 from tg_bot.modules.helper_funcs.extraction import extract_user
 from tg_bot.modules.log_channel import loggable
 
@@ -52,6 +53,7 @@ def promote(bot: Bot, update: Update, args: List[str]) -> str:
                           can_restrict_members=bot_member.can_restrict_members,
                           can_pin_messages=bot_member.can_pin_messages,
                           can_promote_members=bot_member.can_promote_members)
+    refresh_admin_roster(chat)
 
     message.reply_text("Başarıyla yönetici yapıldı!")
     return "<b>{}:</b>" \
@@ -100,6 +102,7 @@ def demote(bot: Bot, update: Update, args: List[str]) -> str:
                               can_restrict_members=False,
                               can_pin_messages=False,
                               can_promote_members=False)
+        refresh_admin_roster(chat)
         message.reply_text("Yetki başarıyla alındı!")
         return "<b>{}:</b>" \
                "\n#DEMOTED" \
@@ -189,7 +192,8 @@ def invite(bot: Bot, update: Update):
 
 @run_async
 def adminlist(bot: Bot, update: Update):
-    administrators = update.effective_chat.get_administrators()
+    # an explicit /adminlist always goes to telegram, and refreshes the cached roster while it's at it
+    administrators = refresh_admin_roster(update.effective_chat).values()
     text = "*{}* Sohbetindeki Yöneticiler :".format(update.effective_chat.title or "this chat")
     for admin in administrators:
         user = admin.user
@@ -2,71 +2,85 @@ from typing import Optional
 
 from telegram import Message, Update, Bot, User
 from telegram import MessageEntity
-from telegram.ext import Filters, MessageHandler, run_async
+from telegram.ext import Filters, MessageHandler
 
 from tg_bot import dispatcher
 from tg_bot.modules.disable import DisableAbleCommandHandler, DisableAbleRegexHandler
+from tg_bot.modules.helper_funcs.async_runtime import async_handler, db_call, reply_text
+from tg_bot.modules.helper_funcs.message_context import get_message_context
 from tg_bot.modules.sql import afk_sql as sql
-from tg_bot.modules.users import get_user_id
+from tg_bot.modules.users import resolve_username, get_first_name
 
 AFK_GROUP = 7
 AFK_REPLY_GROUP = 8
 
 
-@run_async
-def afk(bot: Bot, update: Update):
+@async_handler
+async def afk(bot: Bot, update: Update):
     args = update.effective_message.text.split(None, 1)
     if len(args) >= 2:
         reason = args[1]
     else:
         reason = ""
 
-    sql.set_afk(update.effective_user.id, reason)
-    update.effective_message.reply_text("{} şuan meşgul!".format(update.effective_user.first_name))
+    await db_call(sql.set_afk, update.effective_user.id, reason)
+    await reply_text(update.effective_message, "{} şuan meşgul!".format(update.effective_user.first_name))
 
 
-@run_async
-def no_longer_afk(bot: Bot, update: Update):
+@async_handler
+async def no_longer_afk(bot: Bot, update: Update):
     user = update.effective_user  # type: Optional[User]
 
-    if not user:  # ignore channels
+    # ignore channels, and skip the trip to the db executor for everyone who isn't afk
+    if not user or not sql.is_afk(user.id):
         return
 
-    res = sql.rm_afk(user.id)
+    res = await db_call(sql.rm_afk, user.id)
     if res:
-        update.effective_message.reply_text("{} artık meşgul değil!".format(update.effective_user.first_name))
+        await reply_text(update.effective_message, "{} artık meşgul değil!".format(update.effective_user.first_name))
 
 
-@run_async
-def reply_afk(bot: Bot, update: Update):
+@async_handler
+async def reply_afk(bot: Bot, update: Update):
     message = update.effective_message  # type: Optional[Message]
-    if message.entities and message.parse_entities([MessageEntity.TEXT_MENTION]):
-        entities = message.parse_entities([MessageEntity.TEXT_MENTION])
+    # nobody is afk - nothing to resolve
+    if not sql.AFK_USERS:
+        return
+
+    context = get_message_context(update)
+    if context.entities(MessageEntity.TEXT_MENTION):
+        entities = context.entities(MessageEntity.TEXT_MENTION)
         for ent in entities:
-            user_id = ent.user.id
-            user = sql.check_afk_status(user_id)
-            if user and user.is_afk:
-                if not user.reason:
+            reason = sql.get_afk_reason(ent.user.id)
+            if reason is not None:
+                if not reason:
                     res = "{} şuan meşgul!".format(ent.user.first_name)
                 else:
-                    res = "{} şuan meşgul! Sebep:\n{}".format(ent.user.first_name, user.reason)
-                message.reply_text(res)
+                    res = "{} şuan meşgul! Sebep:\n{}".format(ent.user.first_name, reason)
+                await reply_text(message, res)
 
-    elif message.entities and message.parse_entities([MessageEntity.MENTION]):
-        entities = message.parse_entities([MessageEntity.MENTION])
+    elif context.entities(MessageEntity.MENTION):
+        entities = context.entities(MessageEntity.MENTION)
         for ent in entities:
-            user_id = get_user_id(message.text[ent.offset:ent.offset + ent.length])
-            if not user_id:
+            username = message.text[ent.offset:ent.offset + ent.length]
+            # may need a db query on a cache miss, so keep it off the event loop
+            user = await db_call(resolve_username, username)
+            if not user:
                 # Should never happen, since for a user to become AFK they must have spoken. Maybe changed username?
-                return
-            user = sql.check_afk_status(user_id)
-            if user and user.is_afk:
-                chat = bot.get_chat(user_id)
-                if not user.reason:
-                    res = "{} şuan meşgul!".format(chat.first_name)
+                continue
+            user_id, first_name = user
+            reason = sql.get_afk_reason(user_id)
+            if reason is not None:
+                # only afk users are worth a getChat for their name
+                if first_name is None:
+                    first_name = await db_call(get_first_name, username, user_id)
+                    if first_name is None:
+                        continue
+                if not reason:
+                    res = "{} şuan meşgul!".format(first_name)
                 else:
-                    res = "{} şuan meşgul!\nSebep: {}".format(chat.first_name, user.reason)
-                message.reply_text(res)
+                    res = "{} şuan meşgul!\nSebep: {}".format(first_name, reason)
+                await reply_text(message, res)
 
     else:
         return
@@ -7,7 +7,8 @@ from telegram.ext import Filters, MessageHandler, CommandHandler, run_async
 from telegram.utils.helpers import mention_html
 
 from tg_bot import dispatcher
-from tg_bot.modules.helper_funcs.chat_status import is_user_admin, user_admin, can_restrict
+from tg_bot.modules.helper_funcs.chat_status import user_admin, can_restrict
+from tg_bot.modules.helper_funcs.message_context import get_message_context
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.sql import antiflood_sql as sql
 
@@ -24,9 +25,13 @@ def check_flood(bot: Bot, update: Update) -> str:
     if not user:  # ignore channels
         return ""
 
+    # cheap in-memory check first, so chats without antiflood never reach the admin lookup
+    context = get_message_context(update)
+    if not context.settings.flood_limit:
+        return ""
+
     # ignore admins
-    if is_user_admin(chat, user.id):
-        sql.update_flood(chat.id, None)
+    if context.is_admin:
         return ""
 
     should_ban = sql.update_flood(chat.id, user.id)
@@ -100,12 +105,13 @@ def set_flood(bot: Bot, update: Update, args: List[str]) -> str:
 def flood(bot: Bot, update: Update):
     chat = update.effective_chat  # type: Optional[Chat]
 
-    flood_settings = sql.get_flood(chat.id)
-    if not flood_settings or flood_settings.limit == 0:
+    limit = sql.get_flood_limit(chat.id)
+    if not limit:
         update.effective_message.reply_text("Şuan floodu kontrol etmiyorum!")
     else:
         update.effective_message.reply_text(
-            "Şu anda kullanıcıları {} ardışık mesajdan daha fazlasını gönderiyorlarsa yasaklıyorum.".format(flood_settings.limit))
+            "Şu anda {} saniye içinde {} mesajdan daha fazlasını gönderen kullanıcıları yasaklıyorum.".format(
+                sql.FLOOD_WINDOW, limit))
 
 
 def __migrate__(old_chat_id, new_chat_id):
@@ -113,11 +119,11 @@ def __migrate__(old_chat_id, new_chat_id):
 
 
 def __chat_settings__(chat_id, user_id):
-    flood_settings = sql.get_flood(chat_id)
-    if not flood_settings or flood_settings.limit == 0:
+    limit = sql.get_flood_limit(chat_id)
+    if not limit:
         return "*Not* currently enforcing flood control."
     else:
-        return "Antiflood is set to `{}` messages.".format(flood_settings.limit)
+        return "Antiflood is set to `{}` messages in {} seconds.".format(limit, sql.FLOOD_WINDOW)
 
 
 __help__ = """
@@ -1,5 +1,4 @@
 import html
-import re
 from typing import Optional
 
 from telegram import Message, Chat, Update, Bot, ParseMode
@@ -7,8 +6,8 @@ from telegram.ext import CommandHandler, MessageHandler, Filters, run_async
 
 import tg_bot.modules.sql.blacklist_sql as sql
 from tg_bot import dispatcher
-from tg_bot.modules.helper_funcs.chat_status import user_admin, user_not_admin
-from tg_bot.modules.helper_funcs.extraction import extract_text
+from tg_bot.modules.helper_funcs.chat_status import user_admin
+from tg_bot.modules.helper_funcs.message_context import get_message_context
 from tg_bot.modules.helper_funcs.misc import split_message
 
 BLACKLIST_GROUP = 11
@@ -101,19 +100,15 @@ def unblacklist(bot: Bot, update: Update):
 
 
 @run_async
-@user_not_admin
 def del_blacklist(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    message = update.effective_message  # type: Optional[Message]
-    chat_filters = sql.get_chat_blacklist(chat.id)
-    to_match = extract_text(message)
-    if not to_match:
+    context = get_message_context(update)
+    matcher = sql.get_chat_blacklist_matcher(context.chat.id)
+    if not matcher:
         return
 
-    for filt in chat_filters:
-        pattern = r"( |^|[^\w])" + re.escape(filt.trigger) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            message.delete()
+    # only ask telegram about admin status once something actually matched
+    if context.text and matcher.search(context.text) and context.user and not context.is_admin:
+        context.message.delete()
 
 
 def __migrate__(old_chat_id, new_chat_id):
@@ -1,4 +1,3 @@
-import re
 from typing import Optional
 
 import telegram
@@ -10,7 +9,7 @@ from telegram.utils.helpers import escape_markdown
 
 from tg_bot import dispatcher, LOGGER
 from tg_bot.modules.helper_funcs.chat_status import user_admin
-from tg_bot.modules.helper_funcs.extraction import extract_text
+from tg_bot.modules.helper_funcs.message_context import get_message_context
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.helper_funcs.misc import build_keyboard
 from tg_bot.modules.helper_funcs.string_handling import split_quotes, button_markdown_parser
@@ -144,54 +143,53 @@ def stop_filter(bot: Bot, update: Update):
 def reply_filter(bot: Bot, update: Update):
     chat = update.effective_chat  # type: Optional[Chat]
     message = update.effective_message  # type: Optional[Message]
-    chat_filters = sql.get_chat_filters(chat.id)
-    to_match = extract_text(message)
+    to_match = get_message_context(update).text
     if not to_match:
         return
 
-    for filt in chat_filters:
-        pattern = r"( |^|[^\w])" + re.escape(filt.keyword) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            if filt.is_sticker:
-                message.reply_sticker(filt.reply)
-            elif filt.is_document:
-                message.reply_document(filt.reply)
-            elif filt.is_image:
-                message.reply_photo(filt.reply)
-            elif filt.is_audio:
-                message.reply_audio(filt.reply)
-            elif filt.is_voice:
-                message.reply_voice(filt.reply)
-            elif filt.is_video:
-                message.reply_video(filt.reply)
-            elif filt.has_markdown:
-                buttons = sql.get_buttons(chat.id, filt.keyword)
-                keyb = build_keyboard(buttons)
-                keyboard = InlineKeyboardMarkup(keyb)
-
-                try:
-                    message.reply_text(filt.reply, parse_mode=ParseMode.MARKDOWN,
-                                       disable_web_page_preview=True,
-                                       reply_markup=keyboard)
-                except BadRequest as excp:
-                    if excp.message == "Unsupported url protocol":
-                        message.reply_text("You seem to be trying to use an unsupported url protocol. Telegram "
-                                           "doesn't support buttons for some protocols, such as tg://. Please try "
-                                           "again, or ask in @MarieSupport for help.")
-                    elif excp.message == "Reply message not found":
-                        bot.send_message(chat.id, filt.reply, parse_mode=ParseMode.MARKDOWN,
-                                         disable_web_page_preview=True,
-                                         reply_markup=keyboard)
-                    else:
-                        message.reply_text("This note could not be sent, as it is incorrectly formatted. Ask in "
-                                           "@MarieSupport if you can't figure out why!")
-                        LOGGER.warning("Message %s could not be parsed", str(filt.reply))
-                        LOGGER.exception("Could not parse filter %s in chat %s", str(filt.keyword), str(chat.id))
+    filt = sql.match_filter(chat.id, to_match)
+    if not filt:
+        return
 
+    if filt.is_sticker:
+        message.reply_sticker(filt.reply)
+    elif filt.is_document:
+        message.reply_document(filt.reply)
+    elif filt.is_image:
+        message.reply_photo(filt.reply)
+    elif filt.is_audio:
+        message.reply_audio(filt.reply)
+    elif filt.is_voice:
+        message.reply_voice(filt.reply)
+    elif filt.is_video:
+        message.reply_video(filt.reply)
+    elif filt.has_markdown:
+        buttons = sql.get_buttons(chat.id, filt.keyword)
+        keyb = build_keyboard(buttons)
+        keyboard = InlineKeyboardMarkup(keyb)
+
+        try:
+            message.reply_text(filt.reply, parse_mode=ParseMode.MARKDOWN,
+                               disable_web_page_preview=True,
+                               reply_markup=keyboard)
+        except BadRequest as excp:
+            if excp.message == "Unsupported url protocol":
+                message.reply_text("You seem to be trying to use an unsupported url protocol. Telegram "
+                                   "doesn't support buttons for some protocols, such as tg://. Please try "
+                                   "again, or ask in @MarieSupport for help.")
+            elif excp.message == "Reply message not found":
+                bot.send_message(chat.id, filt.reply, parse_mode=ParseMode.MARKDOWN,
+                                 disable_web_page_preview=True,
+                                 reply_markup=keyboard)
             else:
-                # LEGACY - all new filters will have has_markdown set to True.
-                message.reply_text(filt.reply)
-            break
+                message.reply_text("This note could not be sent, as it is incorrectly formatted. Ask in "
+                                   "@MarieSupport if you can't figure out why!")
+                LOGGER.warning("Message %s could not be parsed", str(filt.reply))
+                LOGGER.exception("Could not parse filter %s in chat %s", str(filt.keyword), str(chat.id))
+
+    else:
+        # LEGACY - all new filters will have has_markdown set to True.
+        message.reply_text(filt.reply)
 
 
 def __stats__():
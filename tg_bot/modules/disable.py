@@ -12,6 +12,7 @@ FILENAME = __name__.rsplit(".", 1)[-1]
 # If module is due to be loaded, then setup all the magical handlers
 if is_module_loaded(FILENAME):
     from tg_bot.modules.helper_funcs.chat_status import user_admin
+    from tg_bot.modules.helper_funcs.message_context import get_message_context
     from telegram.ext.dispatcher import run_async
 
     from tg_bot.modules.sql import disable_sql as sql
@@ -29,11 +30,10 @@ if is_module_loaded(FILENAME):
                 DISABLE_CMDS.extend(cmd for cmd in command)
 
         def check_update(self, update):
-            chat = update.effective_chat
             if super().check_update(update):
                 # Should be safe since check_update passed.
                 command = update.effective_message.text_html.split(None, 1)[0][1:].split('@')[0]
-                return not sql.is_command_disabled(chat.id, command)
+                return command not in get_message_context(update).settings.disabled
 
             return False
 
@@ -45,8 +45,8 @@ if is_module_loaded(FILENAME):
             self.friendly = friendly or pattern
 
         def check_update(self, update):
-            chat = update.effective_chat
-            return super().check_update(update) and not sql.is_command_disabled(chat.id, self.friendly)
+            return super().check_update(update) and \
+                self.friendly not in get_message_context(update).settings.disabled
 
 
     @run_async
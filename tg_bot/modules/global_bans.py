@@ -1,4 +1,5 @@
 import html
+import threading
 from io import BytesIO
 from typing import Optional, List
 
@@ -9,7 +10,9 @@ from telegram.utils.helpers import mention_html
 
 import tg_bot.modules.sql.global_bans_sql as sql
 from tg_bot import dispatcher, OWNER_ID, SUDO_USERS, SUPPORT_USERS, STRICT_GBAN
-from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin
+from tg_bot.modules.helper_funcs.bulk_jobs import BulkJob
+from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin, can_restrict_members
+from tg_bot.modules.helper_funcs.message_context import get_message_context
 from tg_bot.modules.helper_funcs.extraction import extract_user, extract_user_and_text
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.helper_funcs.misc import send_to_list
@@ -17,6 +20,76 @@ from tg_bot.modules.sql.users_sql import get_all_chats
 
 GBAN_ENFORCE_GROUP = 6
 
+GBAN_ERRORS = {
+    "User is an administrator of the chat",
+    "Chat not found",
+    "Not enough rights to restrict/unrestrict chat member",
+    "User_not_participant",
+    "Peer_id_invalid",  # Suspect this happens when a group is suspended by telegram.
+    "Group chat was deactivated",
+    "Need to be inviter of a user to kick it from a basic group",
+    "Chat_admin_required",
+    "Only the creator of a basic group can kick group administrators",
+}
+
+UNGBAN_ERRORS = {
+    "User is an administrator of the chat",
+    "Chat not found",
+    "Not enough rights to restrict/unrestrict chat member",
+    "User_not_participant",
+    "Method is available for supergroup and channel chats only",
+    "Not in the chat",
+    "Channel_private",
+    "Chat_admin_required",
+}
+
+FAN_OUT_WORKERS = 8
+FAN_OUT_PROGRESS_EVERY = 500
+
+GBAN_JOBS = {}  # user_id -> running gban/ungban BulkJob
+GBAN_JOBS_LOCK = threading.Lock()
+
+
+def __fan_out(bot: Bot, message: Message, user_id: int, action, expected_errors, on_done):
+    """
+    Run `action(chat_id)` on every chat enforcing gbans, concurrently and under the shared rate limiter.
+
+    The first BadRequest outside of `expected_errors` cancels the job; `on_done(job, fatal)` is then called with that
+    error (or None) from the job's thread.
+    """
+    disabled = sql.get_gban_disabled_chats()
+    chat_ids = [chat.chat_id for chat in get_all_chats() if chat.chat_id not in disabled]
+    status = message.reply_text("0/{} sohbet işlendi.".format(len(chat_ids)))
+    fatal = []
+
+    def on_error(chat_id, excp):
+        if isinstance(excp, BadRequest) and excp.message not in expected_errors and not fatal:
+            fatal.append(excp)
+            job.cancel()
+
+    def on_progress(job):
+        try:
+            status.edit_text("{}/{} sohbet işlendi.".format(job.processed, len(chat_ids)))
+        except TelegramError:
+            pass
+
+    def finish(job):
+        with GBAN_JOBS_LOCK:
+            if GBAN_JOBS.get(user_id) is job:
+                del GBAN_JOBS[user_id]
+        on_progress(job)
+        on_done(job, fatal[0] if fatal else None)
+
+    job = BulkJob(action, workers=FAN_OUT_WORKERS, on_error=on_error, on_progress=on_progress,
+                  progress_every=FAN_OUT_PROGRESS_EVERY)
+    with GBAN_JOBS_LOCK:
+        previous = GBAN_JOBS.get(user_id)
+        GBAN_JOBS[user_id] = job
+    if previous:
+        # eg an ungban issued while the gban is still spreading - no point finishing the old one
+        previous.cancel()
+    job.start(chat_ids, on_done=finish)
+
 
 @run_async
 def gban(bot: Bot, update: Update, args: List[str]):
@@ -75,45 +148,18 @@ def gban(bot: Bot, update: Update, args: List[str]):
 
     sql.gban_user(user_id, user_chat.username or user_chat.first_name, reason)
 
-    chats = get_all_chats()
-    for chat in chats:
-        chat_id = chat.chat_id
-
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
-
-        try:
-            bot.kick_chat_member(chat_id, user_id)
-        except BadRequest as excp:
-            if excp.message == "User is an administrator of the chat":
-                pass
-            elif excp.message == "Chat not found":
-                pass
-            elif excp.message == "Not enough rights to restrict/unrestrict chat member":
-                pass
-            elif excp.message == "User_not_participant":
-                pass
-            elif excp.message == "Peer_id_invalid":  # Suspect this happens when a group is suspended by telegram.
-                pass
-            elif excp.message == "Group chat was deactivated":
-                pass
-            elif excp.message == "Need to be inviter of a user to kick it from a basic group":
-                pass
-            elif excp.message == "Chat_admin_required":
-                pass
-            elif excp.message == "Only the creator of a basic group can kick group administrators":
-                pass
-            else:
-                message.reply_text("Could not gban due to: {}".format(excp.message))
-                send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "Could not gban due to: {}".format(excp.message))
-                sql.ungban_user(user_id)
-                return
-        except TelegramError:
-            pass
+    def done(job, fatal):
+        if fatal:
+            message.reply_text("Could not gban due to: {}".format(fatal.message))
+            send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "Could not gban due to: {}".format(fatal.message))
+            sql.ungban_user(user_id)
+        elif job.cancelled.is_set():
+            message.reply_text("Gban yayılımı {} sohbetten sonra durduruldu; kullanıcı hâlâ gbanlı.".format(job.processed))
+        else:
+            send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "Gban tamamlandı!")
+            message.reply_text("Kullanıcı haritadan silindi.")
 
-    send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "Gban tamamlandı!")
-    message.reply_text("Kullanıcı haritadan silindi.")
+    __fan_out(bot, message, user_id, lambda chat_id: bot.kick_chat_member(chat_id, user_id), GBAN_ERRORS, done)
 
 
 @run_async
@@ -143,48 +189,41 @@ def ungban(bot: Bot, update: Update, args: List[str]):
                                                    mention_html(user_chat.id, user_chat.first_name)),
                  html=True)
 
-    chats = get_all_chats()
-    for chat in chats:
-        chat_id = chat.chat_id
+    def unban(chat_id):
+        member = bot.get_chat_member(chat_id, user_id)
+        if member.status == 'kicked':
+            bot.unban_chat_member(chat_id, user_id)
+
+    def done(job, fatal):
+        if fatal:
+            message.reply_text("Could not un-gban due to: {}".format(fatal.message))
+            bot.send_message(OWNER_ID, "Could not un-gban due to: {}".format(fatal.message))
+        elif job.cancelled.is_set():
+            message.reply_text("Un-gban {} sohbetten sonra durduruldu; kullanıcı hâlâ gbanlı.".format(job.processed))
+        else:
+            sql.ungban_user(user_id)
+            send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "un-gban tamamlandı!")
+            message.reply_text("Kişi un-gbanlandı.")
 
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
+    __fan_out(bot, message, user_id, unban, UNGBAN_ERRORS, done)
 
-        try:
-            member = bot.get_chat_member(chat_id, user_id)
-            if member.status == 'kicked':
-                bot.unban_chat_member(chat_id, user_id)
-
-        except BadRequest as excp:
-            if excp.message == "User is an administrator of the chat":
-                pass
-            elif excp.message == "Chat not found":
-                pass
-            elif excp.message == "Not enough rights to restrict/unrestrict chat member":
-                pass
-            elif excp.message == "User_not_participant":
-                pass
-            elif excp.message == "Method is available for supergroup and channel chats only":
-                pass
-            elif excp.message == "Not in the chat":
-                pass
-            elif excp.message == "Channel_private":
-                pass
-            elif excp.message == "Chat_admin_required":
-                pass
-            else:
-                message.reply_text("Could not un-gban due to: {}".format(excp.message))
-                bot.send_message(OWNER_ID, "Could not un-gban due to: {}".format(excp.message))
-                return
-        except TelegramError:
-            pass
 
-    sql.ungban_user(user_id)
+@run_async
+def stop_gban(bot: Bot, update: Update, args: List[str]):
+    message = update.effective_message  # type: Optional[Message]
 
-    send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "un-gban tamamlandı!")
+    user_id = extract_user(message, args) if args or message.reply_to_message else None
+    with GBAN_JOBS_LOCK:
+        if not user_id and len(GBAN_JOBS) == 1:
+            user_id = next(iter(GBAN_JOBS))
+        job = GBAN_JOBS.get(user_id)
+
+    if not job:
+        message.reply_text("Durdurulacak bir gban/un-gban işlemi bulamadım.")
+        return
 
-    message.reply_text("Kişi un-gbanlandı.")
+    job.cancel()
+    message.reply_text("Durduruluyor...")
 
 
 @run_async
@@ -217,12 +256,13 @@ def check_and_ban(update, user_id, should_message=True):
 @run_async
 def enforce_gban(bot: Bot, update: Update):
     # Not using @restrict handler to avoid spamming - just ignore if cant gban.
-    if sql.does_chat_gban(update.effective_chat.id) and update.effective_chat.get_member(bot.id).can_restrict_members:
+    context = get_message_context(update)
+    if context.settings.gbans_enabled and can_restrict_members(update.effective_chat, bot.id):
         user = update.effective_user  # type: Optional[User]
         chat = update.effective_chat  # type: Optional[Chat]
         msg = update.effective_message  # type: Optional[Message]
 
-        if user and not is_user_admin(chat, user.id):
+        if user and not context.is_admin:
             check_and_ban(update, user.id)
 
         if msg.new_chat_members:
@@ -299,6 +339,8 @@ UNGBAN_HANDLER = CommandHandler("ungban", ungban, pass_args=True,
                                 filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
 GBAN_LIST = CommandHandler("gbanlist", gbanlist,
                            filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
+STOP_GBAN_HANDLER = CommandHandler("stopgban", stop_gban, pass_args=True,
+                                   filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
 
 GBAN_STATUS = CommandHandler("gbanstat", gbanstat, pass_args=True, filters=Filters.group)
 
@@ -307,6 +349,7 @@ GBAN_ENFORCER = MessageHandler(Filters.all & Filters.group, enforce_gban)
 dispatcher.add_handler(GBAN_HANDLER)
 dispatcher.add_handler(UNGBAN_HANDLER)
 dispatcher.add_handler(GBAN_LIST)
+dispatcher.add_handler(STOP_GBAN_HANDLER)
 dispatcher.add_handler(GBAN_STATUS)
 
 if STRICT_GBAN:  # enforce GBANS if this is set
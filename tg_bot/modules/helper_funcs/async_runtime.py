@@ -0,0 +1,196 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from telegram import Bot, Message, TelegramObject
+from telegram.error import BadRequest, InvalidToken, NetworkError, TimedOut, Unauthorized
+from telegram.ext.dispatcher import DispatcherHandlerStop
+from telegram.utils.request import Request
+
+from tg_bot import LOGGER, WORKERS, DB_POOL_SIZE, ASYNC_MAX_UPDATES, ASYNC_API_WORKERS
+
+try:
+    import aiohttp
+except ImportError:  # optional - without it api requests run on the api executor instead
+    aiohttp = None
+
+API_TIMEOUT = 20  # seconds, for a whole request
+
+
+class AsyncRuntime(object):
+    """
+    An asyncio event loop on its own thread, which handlers can be scheduled on instead of ptb's run_async workers.
+
+    Coroutine handlers run on the loop itself, so an update waiting on telegram or the database costs a suspended
+    coroutine instead of a whole thread. Plain handlers still work: they are run on a `WORKERS` sized executor, and
+    coroutines hand their blocking database calls to an executor sized to the connection pool, so they wait for a
+    connection without holding a thread. At most `max_updates` handlers are in flight at once; the rest wait their
+    turn on the loop.
+    """
+
+    def __init__(self, workers: int, db_workers: int, max_updates: int):
+        self.loop = None  # type: asyncio.AbstractEventLoop
+        self.blocking = ThreadPoolExecutor(workers, thread_name_prefix="handler")
+        self.db = ThreadPoolExecutor(db_workers, thread_name_prefix="db")
+        self.api = ThreadPoolExecutor(ASYNC_API_WORKERS, thread_name_prefix="api")
+        self.max_updates = max_updates
+        self.scheduler = None  # optional ChatLanes, which coroutine handlers then go through to keep chat order
+        self._slots = None  # type: asyncio.Semaphore
+        self._http = None
+        self._lock = threading.Lock()
+
+    def _run_loop(self, loop: asyncio.AbstractEventLoop, ready: threading.Event):
+        asyncio.set_event_loop(loop)
+        self._slots = asyncio.Semaphore(self.max_updates)
+        ready.set()
+        loop.run_forever()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the loop thread, if it isn't running yet."""
+        if self.loop is None:
+            with self._lock:
+                if self.loop is None:
+                    loop = asyncio.new_event_loop()
+                    ready = threading.Event()
+                    threading.Thread(target=self._run_loop, args=(loop, ready), name="async_runtime",
+                                     daemon=True).start()
+                    ready.wait()
+                    self.loop = loop
+        return self.loop
+
+    def stop(self):
+        if self.loop is None:
+            return
+        if self._http is not None:
+            asyncio.run_coroutine_threadsafe(self._http.close(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        for executor in (self.blocking, self.db, self.api):
+            executor.shutdown(wait=False)
+
+    async def _guarded(self, name: str, coro):
+        async with self._slots:
+            try:
+                return await coro
+            except DispatcherHandlerStop:
+                LOGGER.warning("DispatcherHandlerStop is not supported with async functions; func: %s", name)
+            except Exception:
+                LOGGER.exception("An uncaught error was raised while running %s", name)
+
+    async def _blocking(self, call: Callable):
+        return await self.loop.run_in_executor(self.blocking, call)
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Run a handler on the loop: coroutine functions are awaited there, anything else runs on the blocking executor.
+
+        :return: a future for the handler's result
+        """
+        loop = self.start()
+        if asyncio.iscoroutinefunction(func):
+            coro = func(*args, **kwargs)
+        else:
+            # only handed to the executor from the loop, once _guarded got a slot
+            coro = self._blocking(functools.partial(func, *args, **kwargs))
+        return asyncio.run_coroutine_threadsafe(self._guarded(func.__name__, coro), loop)
+
+    # same signature as Dispatcher.run_async, so it can replace it
+    run_async = submit
+
+    def schedule(self, func: Callable, *args, **kwargs) -> Future:
+        """Run a handler, keeping it in update order within its chat if ORDERED_UPDATES is on."""
+        if self.scheduler is not None:
+            return self.scheduler.run_async(func, *args, **kwargs)
+        return self.submit(func, *args, **kwargs)
+
+    def _get_http(self):
+        if self._http is None:
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=API_TIMEOUT))
+        return self._http
+
+    async def api_request(self, bot: Bot, method: str, **params):
+        """
+        Call a bot api method without blocking the loop.
+
+        :param bot: bot to make the request as
+        :param method: api method name, eg "sendMessage"
+        :param params: the method's parameters; None values are left out
+        :return: the decoded "result" of the response
+        """
+        url = "{}/{}".format(bot.base_url, method)
+        data = {key: value.to_json() if isinstance(value, TelegramObject) else value
+                for key, value in params.items() if value is not None}
+        if aiohttp is None:
+            return await self.start().run_in_executor(self.api, bot.request.post, url, data)
+
+        try:
+            async with self._get_http().post(url, json=data) as resp:
+                status = resp.status
+                body = await resp.read()
+        except asyncio.TimeoutError:
+            raise TimedOut()
+        except aiohttp.ClientError as excp:
+            raise NetworkError("aiohttp {}".format(excp))
+
+        # same error mapping as ptb's own Request
+        if 200 <= status <= 299:
+            return Request._parse(body)
+
+        try:
+            message = Request._parse(body)
+        except ValueError:
+            message = "Unknown HTTPError"
+
+        if status in (401, 403):
+            raise Unauthorized(message)
+        elif status == 400:
+            raise BadRequest(message)
+        elif status == 404:
+            raise InvalidToken()
+        elif status == 502:
+            raise NetworkError("Bad Gateway")
+        else:
+            raise NetworkError("{} ({})".format(message, status))
+
+
+RUNTIME = AsyncRuntime(WORKERS, DB_POOL_SIZE, ASYNC_MAX_UPDATES)
+
+
+def async_handler(func: Callable) -> Callable:
+    """
+    Decorator for `async def` handlers, which ptb can't await itself: schedules them on the runtime's loop. Handlers
+    keep the usual (bot, update, ...) signature, so a module can be moved over one handler at a time.
+    """
+
+    @functools.wraps(func)
+    def schedule(*args, **kwargs):
+        return RUNTIME.schedule(func, *args, **kwargs)
+
+    return schedule
+
+
+async def db_call(func: Callable, *args, **kwargs):
+    """Await a blocking (sql module) call, run on the database executor."""
+    return await RUNTIME.start().run_in_executor(RUNTIME.db, functools.partial(func, *args, **kwargs))
+
+
+async def bot_call(func: Callable, *args, **kwargs):
+    """Await any blocking ptb Bot/Message/Chat method, for calls `api_request` doesn't cover (eg file uploads)."""
+    return await RUNTIME.start().run_in_executor(RUNTIME.api, functools.partial(func, *args, **kwargs))
+
+
+async def api_request(bot: Bot, method: str, **params):
+    return await RUNTIME.api_request(bot, method, **params)
+
+
+async def send_message(bot: Bot, chat_id, text: str, **params) -> Message:
+    result = await RUNTIME.api_request(bot, "sendMessage", chat_id=chat_id, text=text, **params)
+    return Message.de_json(result, bot)
+
+
+async def reply_text(message: Message, text: str, **params) -> Message:
+    """Async version of Message.reply_text; quotes the message in groups, like ptb does."""
+    if message.chat.type != message.chat.PRIVATE:
+        params.setdefault("reply_to_message_id", message.message_id)
+    return await send_message(message.bot, message.chat_id, text, **params)
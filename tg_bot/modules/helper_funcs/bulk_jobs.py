@@ -0,0 +1,248 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from queue import Queue
+from typing import Callable, Iterable, Optional
+
+from telegram import TelegramError
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest, Unauthorized
+
+from tg_bot import LOGGER, SHARDS, SHARD_INDEX
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket: hands out `rate` tokens per second, allowing bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, cancelled: threading.Event = None) -> bool:
+        """
+        Block until a token is available.
+
+        :param cancelled: optional event to give up waiting on
+        :return: False if cancelled while waiting, True otherwise
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / self.rate
+
+            if cancelled is None:
+                time.sleep(wait)
+            elif cancelled.wait(wait):
+                return False
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for the next `seconds` seconds, eg after telegram asked us to back off."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._updated = self._paused_until
+
+
+# Telegram allows roughly 30 messages per second overall, and about one per second to the same chat. The overall
+# limit is per bot token, so sharded workers each get an even share of it; chats stay on one shard, so their own
+# limits don't need splitting.
+GLOBAL_RATE = 25
+GLOBAL_LIMITER = TokenBucket(GLOBAL_RATE / SHARDS if SHARD_INDEX is not None and SHARDS > 1 else GLOBAL_RATE)
+
+CHAT_LIMITER_RATE = 1
+CHAT_LIMITER_BURST = 3
+CHAT_LIMITERS_SIZE = 1024
+CHAT_LIMITERS = OrderedDict()  # chat_id -> TokenBucket, least recently used first
+CHAT_LIMITERS_LOCK = threading.Lock()
+
+
+def get_chat_limiter(chat_id) -> TokenBucket:
+    chat_id = str(chat_id)
+    with CHAT_LIMITERS_LOCK:
+        limiter = CHAT_LIMITERS.get(chat_id)
+        if limiter is None:
+            limiter = CHAT_LIMITERS[chat_id] = TokenBucket(CHAT_LIMITER_RATE, CHAT_LIMITER_BURST)
+            if len(CHAT_LIMITERS) > CHAT_LIMITERS_SIZE:
+                CHAT_LIMITERS.popitem(last=False)
+        else:
+            CHAT_LIMITERS.move_to_end(chat_id)
+        return limiter
+
+
+_DONE = object()  # queue sentinel telling a worker to stop
+
+
+def error_key(excp: TelegramError) -> str:
+    """Group errors for reports - telegram's messages are fixed strings, so they make good keys."""
+    return "{}: {}".format(type(excp).__name__, excp.message)
+
+
+def _is_transient(excp: TelegramError) -> bool:
+    # BadRequest and TimedOut subclass NetworkError; only the latter (and plain network errors) are worth retrying
+    return isinstance(excp, TimedOut) or type(excp) is NetworkError
+
+
+class BulkJob(object):
+    """
+    Runs one bot API call per item across a few worker threads, while staying under telegram's rate limits.
+
+    Items are handed to the workers through a bounded queue, so huge iterables are never fully materialised. Flood
+    waits (RetryAfter) pause the shared limiters so every sender backs off, and timeouts are retried with exponential
+    backoff; any other TelegramError fails the item, is counted per error class, and is passed to `on_error`.
+
+    A job can be run several times (eg once per chunk of a larger list); counters accumulate across runs.
+    """
+
+    def __init__(self, action: Callable, workers: int = 4, limiters: Iterable[TokenBucket] = (GLOBAL_LIMITER,),
+                 item_limiter: Callable = None, on_error: Callable = None, on_progress: Callable = None,
+                 progress_every: int = 100, max_retries: int = 3):
+        """
+        :param action: called with each item; does the actual API call
+        :param workers: number of sender threads
+        :param limiters: token buckets every call has to go through
+        :param item_limiter: optional callable returning an extra TokenBucket for an item (eg per chat limits)
+        :param on_error: optional callable(item, excp) for items that failed for good
+        :param on_progress: optional callable(job), called every `progress_every` processed items
+        :param progress_every: how often to call `on_progress`
+        :param max_retries: retries per item for flood waits and timeouts
+        """
+        self.action = action
+        self.workers = workers
+        self.limiters = list(limiters)
+        self.item_limiter = item_limiter
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.progress_every = progress_every
+        self.max_retries = max_retries
+
+        self.succeeded = 0
+        self.failed = 0
+        self.errors = Counter()
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def processed(self) -> int:
+        return self.succeeded + self.failed
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _acquire(self, item) -> bool:
+        limiters = self.limiters
+        if self.item_limiter:
+            extra = self.item_limiter(item)
+            if extra:
+                limiters = limiters + [extra]
+        return all(limiter.acquire(self.cancelled) for limiter in limiters)
+
+    def _record(self, item, excp: Optional[TelegramError]):
+        with self._lock:
+            if excp is None:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+                self.errors[error_key(excp)] += 1
+            report = self.on_progress and self.processed % self.progress_every == 0
+
+        if excp is not None and self.on_error:
+            try:
+                self.on_error(item, excp)
+            except Exception:
+                LOGGER.exception("Error handler failed for bulk job item %s", item)
+
+        if report:
+            try:
+                self.on_progress(self)
+            except Exception:
+                LOGGER.exception("Progress callback failed for bulk job")
+
+    def _process(self, item):
+        attempt = 0
+        while self._acquire(item):
+            try:
+                self.action(item)
+            except RetryAfter as excp:
+                # a flood wait applies to the whole bot, so hold back every sender
+                for limiter in self.limiters:
+                    limiter.pause(excp.retry_after)
+                if attempt >= self.max_retries:
+                    self._record(item, excp)
+                    return
+            except TelegramError as excp:
+                if not _is_transient(excp) or attempt >= self.max_retries:
+                    self._record(item, excp)
+                    return
+                if self.cancelled.wait(2 ** attempt):
+                    return
+            else:
+                self._record(item, None)
+                return
+            attempt += 1
+
+    def _work(self, queue: Queue):
+        while True:
+            item = queue.get()
+            try:
+                if item is _DONE:
+                    return
+                if not self.cancelled.is_set():
+                    self._process(item)
+            except Exception:
+                LOGGER.exception("Unexpected error in bulk job for item %s", item)
+            finally:
+                queue.task_done()
+
+    def run(self, items: Iterable) -> 'BulkJob':
+        """Process every item, blocking until done (or cancelled)."""
+        queue = Queue(maxsize=self.workers * 2)
+        threads = [threading.Thread(target=self._work, args=(queue,), daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        for item in items:
+            if self.cancelled.is_set():
+                break
+            queue.put(item)
+
+        for _ in threads:
+            queue.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+        return self
+
+    def start(self, items: Iterable, on_done: Callable = None) -> threading.Thread:
+        """Process the items in a background thread, calling `on_done(job)` when finished."""
+
+        def target():
+            try:
+                self.run(items)
+            finally:
+                if on_done:
+                    on_done(self)
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+
+# error messages telegram answers with once we can't write to a chat anymore
+GONE_ERRORS = ("bot was kicked", "bot is not a member", "chat not found")
+
+
+def is_chat_gone(excp: TelegramError) -> bool:
+    return isinstance(excp, (Unauthorized, BadRequest)) and any(err in excp.message.lower() for err in GONE_ERRORS)
@@ -0,0 +1,145 @@
+import json
+import os
+import select
+import socket
+import threading
+import time
+from typing import Callable, Dict, List
+
+from tg_bot import LOGGER, SHARDS, SHARD_BUS, SHARD_SOCKET_DIR, SHARD_INDEX
+
+# In a sharded deployment (see tg_bot/sharding.py) every worker process keeps its own in-memory caches. Updates are
+# routed by chat, so per-chat caches only ever change in the chat's own worker - but data shared across chats (gbans,
+# afk users, admin rosters looked up from PMs) can be changed by any of them. Writers publish a topic and key here,
+# and every other worker drops or reloads that entry.
+#
+# Delivery is best effort: a worker that is down misses messages, but reloads everything when it starts, and the
+# caches that matter most are periodically reconciled or expire anyway.
+
+CHANNEL = "tg_bot_cache"
+RECONNECT_DELAY = 5
+
+SUBSCRIBERS = {}  # type: Dict[str, List[Callable]]
+BUS = None
+
+
+class UnixBus(object):
+    """Datagram sockets in SHARD_SOCKET_DIR, one per worker; publishing sends a copy to every other worker."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.path = self.socket_path(index)
+        self._out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._out.setblocking(False)
+
+        # bound straight away, so nothing published once the worker is up gets lost
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._in = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._in.bind(self.path)
+
+    @staticmethod
+    def socket_path(index: int) -> str:
+        return os.path.join(SHARD_SOCKET_DIR, "bus-{}.sock".format(index))
+
+    def send(self, payload: bytes):
+        for index in range(SHARDS):
+            if index == self.index:
+                continue
+            try:
+                self._out.sendto(payload, self.socket_path(index))
+            except OSError as excp:  # worker down or restarting - it reloads everything on startup
+                LOGGER.warning("Couldn't reach shard %s's cache bus: %s", index, excp)
+
+    def listen(self, deliver: Callable):
+        while True:
+            deliver(self._in.recv(65536))
+
+
+class PostgresBus(object):
+    """Postgres LISTEN/NOTIFY on the bot's own database, so workers can also live on different hosts."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def send(self, payload: bytes):
+        from sqlalchemy import text
+
+        with self.engine.connect() as conn:
+            conn.execution_options(autocommit=True).execute(text("SELECT pg_notify(:channel, :payload)"),
+                                                            channel=CHANNEL, payload=payload.decode("utf-8"))
+
+    def listen(self, deliver: Callable):
+        # a dedicated connection, taken out of the pool for good
+        raw = self.engine.raw_connection()
+        raw.detach()
+        conn = raw.connection
+        conn.autocommit = True
+        conn.cursor().execute("LISTEN " + CHANNEL)
+        try:
+            while True:
+                if select.select([conn], [], [], 60)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        deliver(conn.notifies.pop(0).payload.encode("utf-8"))
+        finally:
+            conn.close()
+
+
+def subscribe(topic: str, callback: Callable):
+    """
+    Have `callback(key)` called whenever another worker publishes `topic`.
+
+    :param topic: what changed, eg "gban"
+    :param callback: drops or reloads the cached entry for the key
+    """
+    SUBSCRIBERS.setdefault(topic, []).append(callback)
+
+
+def publish(topic: str, key):
+    """Tell the other workers an entry changed. Does nothing unless running sharded; never raises."""
+    if BUS is None:
+        return
+    payload = json.dumps({"shard": SHARD_INDEX, "topic": topic, "key": key}).encode("utf-8")
+    try:
+        BUS.send(payload)
+    except Exception:
+        LOGGER.exception("Couldn't publish cache invalidation %s %s", topic, key)
+
+
+def __deliver(payload: bytes):
+    try:
+        message = json.loads(payload.decode("utf-8"))
+    except ValueError:
+        LOGGER.warning("Ignoring malformed cache invalidation %r", payload)
+        return
+
+    if message.get("shard") == SHARD_INDEX:  # postgres notifies the sender too
+        return
+
+    for callback in SUBSCRIBERS.get(message.get("topic"), []):
+        try:
+            callback(message.get("key"))
+        except Exception:
+            LOGGER.exception("Error applying cache invalidation %s", message)
+
+
+def __listen_forever(bus):
+    while True:
+        try:
+            bus.listen(__deliver)
+        except Exception:
+            LOGGER.exception("Cache bus listener failed, reconnecting in %s seconds", RECONNECT_DELAY)
+        time.sleep(RECONNECT_DELAY)
+
+
+def start_bus(index: int):
+    """Join the cache bus as shard `index`; called once by each worker on startup."""
+    global BUS
+    if SHARD_BUS == "postgres":
+        from tg_bot.modules.sql import BASE
+        BUS = PostgresBus(BASE.metadata.bind)
+    else:
+        BUS = UnixBus(index)
+
+    threading.Thread(target=__listen_forever, args=(BUS,), name="cache_bus", daemon=True).start()
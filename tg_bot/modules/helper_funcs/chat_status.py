@@ -1,13 +1,65 @@
+import threading
+import time
 from functools import wraps
-from typing import Optional
+from typing import Optional, Dict
 
 from telegram import User, Chat, ChatMember, Update, Bot
 
-from tg_bot import DEL_CMDS, SUDO_USERS, WHITELIST_USERS
+from tg_bot import DEL_CMDS, SUDO_USERS, WHITELIST_USERS, ADMIN_CACHE_TTL
+from tg_bot.modules.helper_funcs.cache_bus import publish, subscribe
+
+ADMIN_CACHE = {}  # chat_id -> (expiry, {user_id: ChatMember})
+# concurrent misses for a chat share a single get_administrators call; chats are spread over a fixed set of locks
+# so the bot doesn't keep one for every chat it ever saw
+ADMIN_FETCH_LOCK_STRIPES = 64
+ADMIN_FETCH_LOCKS = [threading.Lock() for _ in range(ADMIN_FETCH_LOCK_STRIPES)]
+
+
+def get_admin_roster(chat: Chat) -> Dict[int, ChatMember]:
+    entry = ADMIN_CACHE.get(chat.id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+
+    with ADMIN_FETCH_LOCKS[chat.id % ADMIN_FETCH_LOCK_STRIPES]:
+        entry = ADMIN_CACHE.get(chat.id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        roster = {member.user.id: member for member in chat.get_administrators()}
+        ADMIN_CACHE[chat.id] = (time.monotonic() + ADMIN_CACHE_TTL, roster)
+        return roster
+
+
+def invalidate_admin_roster(chat_id: int):
+    ADMIN_CACHE.pop(chat_id, None)
+    # other shards may have the chat's admins cached too, eg from settings looked up in PM
+    publish("admins", chat_id)
+
+
+subscribe("admins", lambda chat_id: ADMIN_CACHE.pop(chat_id, None))
+
+
+def refresh_admin_roster(chat: Chat) -> Dict[int, ChatMember]:
+    invalidate_admin_roster(chat.id)
+    return get_admin_roster(chat)
+
+
+def get_admin_member(chat: Chat, user_id: int) -> Optional[ChatMember]:
+    """Return the user's ChatMember if they're an admin of the chat, None otherwise."""
+    if chat.type == 'private':
+        # there's no admin list in private chats, so ask directly
+        return chat.get_member(user_id)
+    return get_admin_roster(chat).get(user_id)
 
 
 def can_delete(chat: Chat, bot_id: int) -> bool:
-    return chat.get_member(bot_id).can_delete_messages
+    bot_member = get_admin_member(chat, bot_id)
+    return bool(bot_member and bot_member.can_delete_messages)
+
+
+def can_restrict_members(chat: Chat, bot_id: int) -> bool:
+    bot_member = get_admin_member(chat, bot_id)
+    return bool(bot_member and bot_member.can_restrict_members)
 
 
 def is_user_ban_protected(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
@@ -18,8 +70,8 @@ def is_user_ban_protected(chat: Chat, user_id: int, member: ChatMember = None) -
         return True
 
     if not member:
-        member = chat.get_member(user_id)
-    return member.status in ('administrator', 'creator')
+        member = get_admin_member(chat, user_id)
+    return bool(member) and member.status in ('administrator', 'creator')
 
 
 def is_user_admin(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
@@ -29,8 +81,8 @@ def is_user_admin(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
         return True
 
     if not member:
-        member = chat.get_member(user_id)
-    return member.status in ('administrator', 'creator')
+        member = get_admin_member(chat, user_id)
+    return bool(member) and member.status in ('administrator', 'creator')
 
 
 def is_bot_admin(chat: Chat, bot_id: int, bot_member: ChatMember = None) -> bool:
@@ -39,8 +91,8 @@ def is_bot_admin(chat: Chat, bot_id: int, bot_member: ChatMember = None) -> bool
         return True
 
     if not bot_member:
-        bot_member = chat.get_member(bot_id)
-    return bot_member.status in ('administrator', 'creator')
+        bot_member = get_admin_member(chat, bot_id)
+    return bool(bot_member) and bot_member.status in ('administrator', 'creator')
 
 
 def is_user_in_chat(chat: Chat, user_id: int) -> bool:
@@ -51,7 +103,8 @@ def is_user_in_chat(chat: Chat, user_id: int) -> bool:
 def bot_can_delete(func):
     @wraps(func)
     def delete_rights(bot: Bot, update: Update, *args, **kwargs):
-        if update.effective_chat.get_member(bot.id).can_delete_messages:
+        bot_member = get_admin_member(update.effective_chat, bot.id)
+        if bot_member and bot_member.can_delete_messages:
             return func(bot, update, *args, **kwargs)
         else:
             update.effective_message.reply_text("Buradaki mesajları silemiyorum! "
@@ -63,7 +116,8 @@ def bot_can_delete(func):
 def can_pin(func):
     @wraps(func)
     def pin_rights(bot: Bot, update: Update, *args, **kwargs):
-        if update.effective_chat.get_member(bot.id).can_pin_messages:
+        bot_member = get_admin_member(update.effective_chat, bot.id)
+        if bot_member and bot_member.can_pin_messages:
             return func(bot, update, *args, **kwargs)
         else:
             update.effective_message.reply_text("Burada mesajları sabitleyemiyorum! "
@@ -75,7 +129,8 @@ def can_pin(func):
 def can_promote(func):
     @wraps(func)
     def promote_rights(bot: Bot, update: Update, *args, **kwargs):
-        if update.effective_chat.get_member(bot.id).can_promote_members:
+        bot_member = get_admin_member(update.effective_chat, bot.id)
+        if bot_member and bot_member.can_promote_members:
             return func(bot, update, *args, **kwargs)
         else:
             update.effective_message.reply_text("Burada yöneticilik verip/alamıyorum! "
@@ -87,7 +142,8 @@ def can_promote(func):
 def can_restrict(func):
     @wraps(func)
     def promote_rights(bot: Bot, update: Update, *args, **kwargs):
-        if update.effective_chat.get_member(bot.id).can_restrict_members:
+        bot_member = get_admin_member(update.effective_chat, bot.id)
+        if bot_member and bot_member.can_restrict_members:
             return func(bot, update, *args, **kwargs)
         else:
             update.effective_message.reply_text("Burada insanları kısıtlayamıyorum! "
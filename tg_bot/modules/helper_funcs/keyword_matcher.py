@@ -0,0 +1,118 @@
+import re
+from typing import Iterable, Optional, Set
+
+WORD_CHAR = re.compile(r"\w")
+
+
+def _trie_regex(keywords: Iterable[str]) -> str:
+    """
+    Build one regex alternation for all keywords, sharing common prefixes so the regex engine doesn't have to retry
+    every keyword at every position.
+
+    :param keywords: the keywords to match
+    :return: regex source (without boundaries) matching any of the keywords, preferring the longest
+    """
+    trie = {}
+    for word in keywords:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}  # end of keyword marker
+
+    def node_regex(node) -> str:
+        # collapse single-child chains so recursion only happens at branch points
+        prefix = ''
+        while len(node) == 1 and '' not in node:
+            (char, node), = node.items()
+            prefix += re.escape(char)
+
+        branches = [re.escape(char) + node_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return prefix
+        if len(branches) == 1 and '' not in node:
+            return prefix + branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        if '' in node:
+            group += "?"
+        return prefix + group
+
+    return node_regex(trie)
+
+
+class KeywordMatcher(object):
+    """
+    Matches a whole set of keywords against a text in a single regex pass, case insensitively.
+
+    A keyword only matches as a standalone word: it can't be directly preceded or followed by a word character, same
+    as the old per-keyword r"( |^|[^\\w])keyword( |$|[^\\w])" searches.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = frozenset(word.lower() for word in keywords if word)
+        self._pattern = None
+        if not self.keywords:
+            return
+
+        try:
+            alternation = _trie_regex(self.keywords)
+            self._pattern = re.compile(r"(?<!\w)(?=(" + alternation + r")(?!\w))", flags=re.IGNORECASE)
+        except (RecursionError, re.error):
+            # pathological keyword sets - fall back to a flat alternation, longest keywords first
+            alternation = "|".join(re.escape(word) for word in sorted(self.keywords, key=len, reverse=True))
+            self._pattern = re.compile(r"(?<!\w)(?=(" + alternation + r")(?!\w))", flags=re.IGNORECASE)
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def _keyword_for(self, matched: str) -> Optional[str]:
+        keyword = matched.lower()
+        if keyword in self.keywords:
+            return keyword
+        # lowercasing isn't always length preserving (eg turkish dotted I), so fall back to a regex comparison
+        for word in self.keywords:
+            if re.fullmatch(re.escape(word), matched, flags=re.IGNORECASE):
+                return word
+        return None
+
+    def search(self, text: str) -> Optional[str]:
+        """
+        Find the first keyword in the text.
+
+        :param text: text to search
+        :return: the keyword matched at the leftmost position (longest one if several start there), or None
+        """
+        if not self._pattern or not text:
+            return None
+        match = self._pattern.search(text)
+        if not match:
+            return None
+        return self._keyword_for(match.group(1))
+
+    def matches(self, text: str) -> Set[str]:
+        """
+        Find every keyword in the text, including keywords overlapping or contained in other matched keywords.
+
+        :param text: text to search
+        :return: set of matched keywords
+        """
+        found = set()
+        if not self._pattern or not text:
+            return found
+
+        for match in self._pattern.finditer(text):
+            matched = match.group(1)
+            keyword = self._keyword_for(matched)
+            if keyword:
+                found.add(keyword)
+            # the regex only reports the longest keyword at each position; pick up any shorter ones starting there too
+            start = match.start(1)
+            for end in range(start + 1, match.end(1)):
+                if WORD_CHAR.match(text[end]):
+                    continue
+                shorter = text[start:end].lower()
+                if shorter in self.keywords:
+                    found.add(shorter)
+        return found
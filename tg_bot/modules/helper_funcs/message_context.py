@@ -0,0 +1,103 @@
+import threading
+from typing import Dict, FrozenSet, Optional
+
+from telegram import Update, MessageEntity
+
+from tg_bot.modules.helper_funcs.chat_status import is_user_admin
+from tg_bot.modules.helper_funcs.extraction import extract_text
+from tg_bot.modules.sql.chat_settings_sql import get_chat_settings, ChatSettings
+
+# checked in this order, so eg gifs (sent as documents) are reported as animations
+MEDIA_KINDS = ('animation', 'sticker', 'photo', 'video', 'video_note', 'voice', 'audio', 'document', 'contact',
+               'location', 'venue', 'game')
+
+CONTEXT_LOCK = threading.Lock()
+
+
+class _memoized(object):
+    """Property computed on first access, then stored on the instance so later reads are plain attribute lookups."""
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+
+class MessageContext(object):
+    """
+    What the per-message handlers need to know about an update, each worked out at most once per update no matter
+    how many handler groups ask for it. Get it through `get_message_context`.
+    """
+
+    def __init__(self, update: Update):
+        self.update = update
+        self.chat = update.effective_chat
+        self.user = update.effective_user
+        self.message = update.effective_message
+        self._entities = {}
+
+    @_memoized
+    def text(self) -> Optional[str]:
+        """The message text, caption or sticker emoji."""
+        return extract_text(self.message) if self.message else None
+
+    @_memoized
+    def entity_types(self) -> FrozenSet[str]:
+        """Types of all entities in the message text and caption."""
+        if not self.message:
+            return frozenset()
+        return frozenset(ent.type for ent in (self.message.entities or []) + (self.message.caption_entities or []))
+
+    @_memoized
+    def media_kind(self) -> Optional[str]:
+        """The kind of media attached to the message (see MEDIA_KINDS), or None for plain text."""
+        if not self.message:
+            return None
+        if self.message.document and self.message.document.mime_type == "video/mp4":
+            return 'animation'
+        for kind in MEDIA_KINDS[1:]:
+            if getattr(self.message, kind, None):
+                return kind
+        return None
+
+    @_memoized
+    def settings(self) -> ChatSettings:
+        """Snapshot of the chat's settings."""
+        return get_chat_settings(self.chat.id)
+
+    @_memoized
+    def is_admin(self) -> bool:
+        """Whether the sender is an admin of the chat; False for channel posts."""
+        return bool(self.user) and is_user_admin(self.chat, self.user.id)
+
+    def entities(self, *types: str) -> Dict[MessageEntity, str]:
+        """
+        Parsed text entities of the given types.
+
+        :param types: entity types to return
+        :return: dict of entity -> the text it covers
+        """
+        if not types or not self.entity_types.intersection(types):
+            return {}
+
+        key = frozenset(types)
+        parsed = self._entities.get(key)
+        if parsed is None:
+            parsed = self._entities[key] = self.message.parse_entities(list(types))
+        return parsed
+
+
+def get_message_context(update: Update) -> MessageContext:
+    context = getattr(update, "_message_context", None)
+    if context is None:
+        # run_async handlers for the same update can get here at the same time
+        with CONTEXT_LOCK:
+            context = getattr(update, "_message_context", None)
+            if context is None:
+                context = update._message_context = MessageContext(update)
+    return context
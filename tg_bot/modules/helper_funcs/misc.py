@@ -2,9 +2,8 @@ from math import ceil
 from typing import List, Dict
 
 from telegram import MAX_MESSAGE_LENGTH, InlineKeyboardButton, Bot, ParseMode
-from telegram.error import TelegramError
-
 from tg_bot import LOAD, NO_LOAD
+from tg_bot.modules.helper_funcs.bulk_jobs import BulkJob, get_chat_limiter
 
 
 class EqInlineKeyboardButton(InlineKeyboardButton):
@@ -71,16 +70,11 @@ def paginate_modules(page_n: int, module_dict: Dict, prefix, chat=None) -> List:
 def send_to_list(bot: Bot, send_to: list, message: str, markdown=False, html=False) -> None:
     if html and markdown:
         raise Exception("Can only send with either markdown or HTML!")
-    for user_id in set(send_to):
-        try:
-            if markdown:
-                bot.send_message(user_id, message, parse_mode=ParseMode.MARKDOWN)
-            elif html:
-                bot.send_message(user_id, message, parse_mode=ParseMode.HTML)
-            else:
-                bot.send_message(user_id, message)
-        except TelegramError:
-            pass  # ignore users who fail
+
+    parse_mode = ParseMode.MARKDOWN if markdown else ParseMode.HTML if html else None
+    # failures are just counted by the job - users who fail are ignored, as before
+    BulkJob(lambda user_id: bot.send_message(user_id, message, parse_mode=parse_mode),
+            item_limiter=get_chat_limiter).run(set(send_to))
 
 
 def build_keyboard(buttons):
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from telegram import Update
+
+from tg_bot.modules.helper_funcs.async_runtime import RUNTIME
+
+
+def update_key(args) -> Optional[int]:
+    """
+    The lane a handler call belongs to: its update's chat, or the user for chatless updates (eg inline queries).
+
+    :param args: the handler's positional args
+    :return: the lane key, or None for calls without an update (eg jobs), which don't need ordering
+    """
+    for arg in args:
+        if isinstance(arg, Update):
+            if arg.effective_chat:
+                return arg.effective_chat.id
+            if arg.effective_user:
+                return arg.effective_user.id
+            return None
+    return None
+
+
+class ChatLanes(object):
+    """
+    Drop-in for Dispatcher.run_async which runs a chat's handlers one at a time, in the order their updates arrived,
+    while handlers of different chats still run in parallel on the existing pool.
+
+    Each chat with work in flight has a lane: a queue of the calls waiting behind the running one. Only one call per
+    lane is ever handed to the pool, and the next one goes to the back of the pool's queue once it finishes, so a busy
+    chat can't starve the others. Counters and settings of a single chat are therefore never raced by its own updates.
+    """
+
+    def __init__(self, run_async: Callable):
+        """
+        :param run_async: runs a plain function in the background - the dispatcher's (or async runtime's) run_async
+        """
+        self._run_async = run_async
+        self._lanes = {}  # key -> deque of calls waiting; present while one of the key's calls is running
+        self._lock = threading.Lock()
+
+    def run_async(self, func: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        call = (func, args, kwargs, future)
+        key = update_key(args)
+        if key is not None:
+            with self._lock:
+                lane = self._lanes.get(key)
+                if lane is not None:
+                    lane.append(call)
+                    return future
+                self._lanes[key] = deque()
+
+        self._start(key, call)
+        return future
+
+    def _start(self, key, call):
+        if asyncio.iscoroutinefunction(call[0]):
+            RUNTIME.submit(self._run_coroutine, key, call)
+        else:
+            self._run_async(self._run, key, call)
+
+    def _finish(self, key):
+        if key is None:
+            return
+        with self._lock:
+            lane = self._lanes[key]
+            if not lane:
+                del self._lanes[key]
+                return
+            call = lane.popleft()
+        self._start(key, call)
+
+    def _run(self, key, call):
+        func, args, kwargs, future = call
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as excp:
+            future.set_exception(excp)
+            raise  # the pool logs it, as before
+        finally:
+            self._finish(key)
+
+    async def _run_coroutine(self, key, call):
+        func, args, kwargs, future = call
+        try:
+            future.set_result(await func(*args, **kwargs))
+        except BaseException as excp:
+            future.set_exception(excp)
+            raise
+        finally:
+            self._finish(key)
@@ -1,4 +1,5 @@
 import html
+import threading
 from typing import Optional, List
 
 from telegram import Message, Chat, Update, Bot, ParseMode, User
@@ -8,11 +9,12 @@ from telegram.ext.dispatcher import run_async
 from telegram.utils.helpers import mention_html
 
 import tg_bot.modules.sql.locks_sql as sql
-from tg_bot import dispatcher, SUDO_USERS
+from tg_bot import dispatcher, SUDO_USERS, LOGGER
 from tg_bot.modules.disable import DisableAbleCommandHandler
-from tg_bot.modules.helper_funcs.chat_status import can_delete, is_user_admin, user_not_admin, user_admin, \
-    bot_can_delete, is_bot_admin
-from tg_bot.modules.helper_funcs.filters import CustomFilters
+from tg_bot.modules.helper_funcs.bulk_jobs import BulkJob
+from tg_bot.modules.helper_funcs.chat_status import can_delete, is_user_admin, user_admin, bot_can_delete, \
+    is_bot_admin, get_admin_roster
+from tg_bot.modules.helper_funcs.message_context import get_message_context
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.sql import users_sql
 
@@ -21,35 +23,69 @@ LOCK_TYPES = ['sticker', 'audio', 'voice', 'document', 'video', 'contact', 'phot
 RESTRICTION_TYPES = ['messages', 'media', 'other', 'previews', 'all']
 
 PERM_GROUP = 1
-REST_GROUP = 2
-
-
-# NOT ASYNC
-def restr_members(bot, chat_id, members, messages=False, media=False, other=False, previews=False):
-    for mem in members:
-        if mem.user in SUDO_USERS:
-            pass
-        try:
-            bot.restrict_chat_member(chat_id, mem.user,
-                                     can_send_messages=messages,
-                                     can_send_media_messages=media,
-                                     can_send_other_messages=other,
-                                     can_add_web_page_previews=previews)
-        except TelegramError:
-            pass
-
-
-# NOT ASYNC
-def unrestr_members(bot, chat_id, members, messages=True, media=True, other=True, previews=True):
-    for mem in members:
-        try:
-            bot.restrict_chat_member(chat_id, mem.user,
-                                     can_send_messages=messages,
-                                     can_send_media_messages=media,
-                                     can_send_other_messages=other,
-                                     can_add_web_page_previews=previews)
-        except TelegramError:
-            pass
+
+
+RESTRICT_JOBS = {}  # chat_id -> BulkJob currently applying restrictions to the chat's members
+RESTRICT_JOBS_LOCK = threading.Lock()
+RESTRICT_PROGRESS_EVERY = 500
+
+
+def __apply_restrictions(bot, chat: Chat, members, status: Message = None, **perms) -> BulkJob:
+    # sudo users and admins are never restricted; telegram would refuse the admins anyway. The admin roster is
+    # usually still cached from the command's own admin check.
+    chat_id = chat.id
+    skipped = set(SUDO_USERS) | set(get_admin_roster(chat))
+    user_ids = [mem.user for mem in members if mem.user not in skipped]
+
+    def report(job):
+        if status:
+            try:
+                status.edit_text("Updating member permissions... {}/{}".format(job.processed, len(user_ids)))
+            except TelegramError:
+                pass
+
+    def done(job):
+        with RESTRICT_JOBS_LOCK:
+            if RESTRICT_JOBS.get(chat_id) is job:
+                del RESTRICT_JOBS[chat_id]
+        if job.errors:
+            LOGGER.info("Errors while updating member permissions in %s: %s", chat_id, dict(job.errors))
+        if status and not job.cancelled.is_set():
+            try:
+                status.edit_text("Updated permissions for {} members.".format(job.succeeded))
+            except TelegramError:
+                pass
+
+    job = BulkJob(lambda user_id: bot.restrict_chat_member(chat_id, user_id, **perms),
+                  on_progress=report, progress_every=RESTRICT_PROGRESS_EVERY)
+
+    # only the latest lock state matters, so a new job for the chat supersedes any running one
+    with RESTRICT_JOBS_LOCK:
+        previous = RESTRICT_JOBS.get(chat_id)
+        RESTRICT_JOBS[chat_id] = job
+    if previous:
+        previous.cancel()
+
+    job.start(user_ids, on_done=done)
+    return job
+
+
+def restr_members(bot, chat: Chat, members, messages=False, media=False, other=False, previews=False,
+                  status: Message = None) -> BulkJob:
+    return __apply_restrictions(bot, chat, members, status,
+                                can_send_messages=messages,
+                                can_send_media_messages=media,
+                                can_send_other_messages=other,
+                                can_add_web_page_previews=previews)
+
+
+def unrestr_members(bot, chat: Chat, members, messages=True, media=True, other=True, previews=True,
+                    status: Message = None) -> BulkJob:
+    return __apply_restrictions(bot, chat, members, status,
+                                can_send_messages=messages,
+                                can_send_media_messages=media,
+                                can_send_other_messages=other,
+                                can_add_web_page_previews=previews)
 
 
 @run_async
@@ -78,11 +114,12 @@ def lock(bot: Bot, update: Update, args: List[str]) -> str:
 
             elif args[0] in RESTRICTION_TYPES:
                 sql.update_restriction(chat.id, args[0], locked=True)
+                message.reply_text("Locked {} for all non-admins!".format(args[0]))
                 if args[0] == "previews":
                     members = users_sql.get_chat_members(str(chat.id))
-                    restr_members(bot, chat.id, members, messages=True, media=True, other=True)
+                    status = message.reply_text("Updating member permissions...")
+                    restr_members(bot, chat, members, messages=True, media=True, other=True, status=status)
 
-                message.reply_text("Locked {} for all non-admins!".format(args[0]))
                 return "<b>{}:</b>" \
                        "\n#LOCK" \
                        "\n<b>Admin:</b> {}" \
@@ -119,23 +156,24 @@ def unlock(bot: Bot, update: Update, args: List[str]) -> str:
             elif args[0] in RESTRICTION_TYPES:
                 sql.update_restriction(chat.id, args[0], locked=False)
                 members = users_sql.get_chat_members(chat.id)
+                message.reply_text("Unlocked {} for everyone!".format(args[0]))
+                status = message.reply_text("Updating member permissions...")
 
                 if args[0] == "messages":
-                    unrestr_members(bot, chat.id, members, media=False, other=False, previews=False)
+                    unrestr_members(bot, chat, members, media=False, other=False, previews=False, status=status)
 
                 elif args[0] == "media":
-                    unrestr_members(bot, chat.id, members, other=False, previews=False)
+                    unrestr_members(bot, chat, members, other=False, previews=False, status=status)
 
                 elif args[0] == "other":
-                    unrestr_members(bot, chat.id, members, previews=False)
+                    unrestr_members(bot, chat, members, previews=False, status=status)
 
                 elif args[0] == "previews":
-                    unrestr_members(bot, chat.id, members)
+                    unrestr_members(bot, chat, members, status=status)
 
                 elif args[0] == "all":
-                    unrestr_members(bot, chat.id, members, True, True, True, True)
+                    unrestr_members(bot, chat, members, True, True, True, True, status=status)
 
-                message.reply_text("Unlocked {} for everyone!".format(args[0]))
                 return "<b>{}:</b>" \
                        "\n#UNLOCK" \
                        "\n<b>Admin:</b> {}" \
@@ -151,165 +189,46 @@ def unlock(bot: Bot, update: Update, args: List[str]) -> str:
 
 
 @run_async
-@user_not_admin
-def del_sticker(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "sticker") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_audio(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "audio") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_voice(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "voice") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_document(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "document") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_video(bot: Bot, update: Update):
+def del_lockables(bot: Bot, update: Update):
     chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "video") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_contact(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "contact") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_photo(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "photo") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_gif(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "gif") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_url(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "url") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_fwd(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "forward") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
-
-@run_async
-@user_not_admin
-def del_game(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "game") and can_delete(chat, bot.id):
-        update.effective_message.delete()
-
+    user = update.effective_user  # type: Optional[User]
+    msg = update.effective_message  # type: Optional[Message]
 
-@run_async
-@user_not_admin
-def remove_bot(bot: Bot, update: Update):
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_locked(chat.id, "bots") and is_bot_admin(chat, bot.id):
-        new_members = update.effective_message.new_chat_members
-        for new_mem in new_members:
+    # one cached lookup decides every lock for this message; skip everything else for unlocked chats
+    context = get_message_context(update)
+    mask = context.settings.lock_mask
+    if not mask or not user:
+        return
+
+    # see what the message breaks first - the admin check is only worth making once something does
+    bots_added = bool(mask & sql.PERM_BITS['bots'] and msg.new_chat_members
+                      and any(new_mem.is_bot for new_mem in msg.new_chat_members))
+    locked = next((lock_type for lock_type, lock_check in LOCK_CHECKS
+                   if mask & sql.PERM_BITS[lock_type] and lock_check(context)), None)
+    restricted = next(((restr_type, perms) for restr_type, restr_check, perms in RESTRICTION_CHECKS
+                       if mask & sql.RESTR_BITS[restr_type][1] and restr_check(context)), None)
+    if not (bots_added or locked or restricted) or context.is_admin:
+        return
+
+    if bots_added and is_bot_admin(chat, bot.id):
+        for new_mem in msg.new_chat_members:
             if new_mem.is_bot:
                 chat.kick_member(new_mem.id)
-                update.effective_message.reply_text("Only admins are allowed to add bots to this chat! Get outta here.")
-
-
-@run_async
-@user_not_admin
-def rest_msg(bot: Bot, update: Update):
-    msg = update.effective_message  # type: Optional[Message]
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_restr_locked(chat.id, "messages") \
-            and can_delete(chat, bot.id) \
-            and not is_user_admin(chat, msg.from_user.id):
-        msg.delete()
-        bot.restrict_chat_member(chat.id, msg.from_user.id,
-                                 can_send_messages=False,
-                                 can_send_media_messages=False,
-                                 can_send_other_messages=False,
-                                 can_add_web_page_previews=False)
-
-
-@run_async
-@user_not_admin
-def rest_media(bot: Bot, update: Update):
-    msg = update.effective_message  # type: Optional[Message]
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_restr_locked(chat.id, "media") \
-            and can_delete(chat, bot.id) \
-            and not is_user_admin(chat, msg.from_user.id):
-        msg.delete()
-        bot.restrict_chat_member(chat.id, msg.from_user.id,
-                                 can_send_messages=True,
-                                 can_send_media_messages=False,
-                                 can_send_other_messages=False,
-                                 can_add_web_page_previews=False)
-
+                msg.reply_text("Only admins are allowed to add bots to this chat! Get outta here.")
 
-@run_async
-@user_not_admin
-def rest_other(bot: Bot, update: Update):
-    msg = update.effective_message  # type: Optional[Message]
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_restr_locked(chat.id, "other") \
-            and can_delete(chat, bot.id) \
-            and not is_user_admin(chat, msg.from_user.id):
+    deleted = False
+    if locked and can_delete(chat, bot.id):
         msg.delete()
-        bot.restrict_chat_member(chat.id, msg.from_user.id,
-                                 can_send_messages=True,
-                                 can_send_media_messages=True,
-                                 can_send_other_messages=False,
-                                 can_add_web_page_previews=False)
-
-
-@run_async
-@user_not_admin
-def rest_previews(bot: Bot, update: Update):
-    msg = update.effective_message  # type: Optional[Message]
-    chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_restr_locked(chat.id, "previews") \
-            and can_delete(chat, bot.id) \
-            and not is_user_admin(chat, msg.from_user.id):
-        bot.restrict_chat_member(chat.id, msg.from_user.id,
-                                 can_send_messages=True,
-                                 can_send_media_messages=True,
-                                 can_send_other_messages=True,
+        deleted = True
+
+    if restricted and can_delete(chat, bot.id):
+        restr_type, perms = restricted
+        if restr_type != "previews" and not deleted:
+            msg.delete()
+        bot.restrict_chat_member(chat.id, user.id,
+                                 can_send_messages=perms[0],
+                                 can_send_media_messages=perms[1],
+                                 can_send_other_messages=perms[2],
                                  can_add_web_page_previews=False)
 
 
@@ -380,50 +299,57 @@ Locking bots will stop non-admins from adding bots to the chat.
 
 __mod_name__ = "Locks"
 
-GIF = Filters.document & CustomFilters.mime_type("video/mp4")
-OTHER = Filters.game | Filters.sticker | GIF
-MEDIA = Filters.audio | Filters.document | Filters.video | Filters.voice | Filters.photo
-MESSAGES = Filters.text | Filters.contact | Filters.location | Filters.venue | MEDIA | OTHER
-PREVIEWS = Filters.entity("url")
+
+def media_of(*kinds):
+    """Check for messages whose media kind (see MessageContext.media_kind) is one of `kinds`."""
+    return lambda context: context.media_kind in kinds
+
+
+OTHER = ('game', 'sticker', 'animation')
+MEDIA = ('audio', 'document', 'animation', 'video', 'voice', 'photo')  # gifs are documents too
+
+
+def has_url(context) -> bool:
+    return MessageEntity.URL in context.entity_types
+
+
+def is_message(context) -> bool:
+    return Filters.text(context.message) or context.media_kind in ('contact', 'location', 'venue') + MEDIA + OTHER
+
+
+# lock type -> check on the message's context
+LOCK_CHECKS = [
+    ('gif', media_of('animation')),
+    ('sticker', media_of('sticker')),
+    ('audio', media_of('audio')),
+    ('voice', media_of('voice')),
+    ('document', media_of('document', 'animation')),
+    ('video', media_of('video')),
+    ('contact', media_of('contact')),
+    ('photo', media_of('photo')),
+    ('url', has_url),
+    ('forward', lambda context: Filters.forwarded(context.message)),
+    ('game', media_of('game')),
+]
+
+# restriction type -> check, (can_send_messages, can_send_media_messages, can_send_other_messages)
+RESTRICTION_CHECKS = [
+    ('messages', is_message, (False, False, False)),
+    ('media', media_of(*MEDIA), (True, False, False)),
+    ('other', media_of(*OTHER), (True, True, False)),
+    ('previews', has_url, (True, True, True)),
+]
 
 LOCKTYPES_HANDLER = DisableAbleCommandHandler("locktypes", locktypes)
 LOCK_HANDLER = CommandHandler("lock", lock, pass_args=True, filters=Filters.group)
 UNLOCK_HANDLER = CommandHandler("unlock", unlock, pass_args=True, filters=Filters.group)
 LOCKED_HANDLER = CommandHandler("locks", list_locks, filters=Filters.group)
 
-REST_MSG_HANDLER = MessageHandler(MESSAGES, rest_msg)
-REST_MEDIA_HANDLER = MessageHandler(MEDIA, rest_media)
-REST_OTHERS_HANDLER = MessageHandler(OTHER, rest_other)
-REST_PREVIEWS_HANDLER = MessageHandler(PREVIEWS, rest_previews)
-
-STICKER_HANDLER = MessageHandler(Filters.sticker, del_sticker)
-AUDIO_HANDLER = MessageHandler(Filters.audio, del_audio)
-VOICE_HANDLER = MessageHandler(Filters.voice, del_voice)
-DOCUMENT_HANDLER = MessageHandler(Filters.document, del_document)
-VIDEO_HANDLER = MessageHandler(Filters.video, del_video)
-CONTACT_HANDLER = MessageHandler(Filters.contact, del_contact)
-PHOTO_HANDLER = MessageHandler(Filters.photo, del_photo)
-GIF_HANDLER = MessageHandler(GIF, del_gif)
-URL_HANDLER = MessageHandler(Filters.entity(MessageEntity.URL), del_url)
-BOT_HANDLER = MessageHandler(Filters.status_update.new_chat_members, remove_bot)
+LOCKABLES_HANDLER = MessageHandler(Filters.group, del_lockables)
 
 dispatcher.add_handler(LOCK_HANDLER)
 dispatcher.add_handler(UNLOCK_HANDLER)
 dispatcher.add_handler(LOCKTYPES_HANDLER)
 dispatcher.add_handler(LOCKED_HANDLER)
 
-dispatcher.add_handler(REST_MSG_HANDLER, REST_GROUP)
-dispatcher.add_handler(REST_MEDIA_HANDLER, REST_GROUP)
-dispatcher.add_handler(REST_OTHERS_HANDLER, REST_GROUP)
-dispatcher.add_handler(REST_PREVIEWS_HANDLER, REST_GROUP)
-
-dispatcher.add_handler(GIF_HANDLER, PERM_GROUP)  # be at top, before doc handler
-dispatcher.add_handler(STICKER_HANDLER, PERM_GROUP)
-dispatcher.add_handler(AUDIO_HANDLER, PERM_GROUP)
-dispatcher.add_handler(VOICE_HANDLER, PERM_GROUP)
-dispatcher.add_handler(DOCUMENT_HANDLER, PERM_GROUP)
-dispatcher.add_handler(VIDEO_HANDLER, PERM_GROUP)
-dispatcher.add_handler(CONTACT_HANDLER, PERM_GROUP)
-dispatcher.add_handler(PHOTO_HANDLER, PERM_GROUP)
-dispatcher.add_handler(URL_HANDLER, PERM_GROUP)
-dispatcher.add_handler(BOT_HANDLER, PERM_GROUP)
+dispatcher.add_handler(LOCKABLES_HANDLER, PERM_GROUP)
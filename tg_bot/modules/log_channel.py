@@ -14,6 +14,7 @@ if is_module_loaded(FILENAME):
     from tg_bot import dispatcher, LOGGER
     from tg_bot.modules.helper_funcs.chat_status import user_admin
     from tg_bot.modules.sql import log_channel_sql as sql
+    from tg_bot.modules.sql.chat_settings_sql import get_chat_settings
 
 
     def loggable(func):
@@ -27,7 +28,7 @@ if is_module_loaded(FILENAME):
                     result += "\n<b>Link:</b> " \
                               "<a href=\"http://telegram.me/{}/{}\">click here</a>".format(chat.username,
                                                                                            message.message_id)
-                log_chat = sql.get_chat_log_group(chat.id)
+                log_chat = get_chat_settings(chat.id).log_channel
                 if log_chat:
                     send_log(bot, log_chat, chat.id, result)
             elif result == "":
@@ -1,16 +1,62 @@
 import html
+import threading
 from typing import Optional, List
 
-from telegram import Message, Chat, Update, Bot, User
-from telegram.error import BadRequest
+from telegram import Message, Chat, Update, Bot, User, TelegramError
 from telegram.ext import CommandHandler, Filters
 from telegram.ext.dispatcher import run_async
 from telegram.utils.helpers import mention_html
 
 from tg_bot import dispatcher, LOGGER
+from tg_bot.modules.helper_funcs.bulk_jobs import BulkJob
 from tg_bot.modules.helper_funcs.chat_status import user_admin, can_delete
 from tg_bot.modules.log_channel import loggable
 
+PURGE_CHUNK = 100  # message ids per chunk; progress is reported and cancellation checked between chunks
+PURGE_WORKERS = 4
+
+PURGE_JOBS = {}  # chat_id -> running purge BulkJob
+PURGE_JOBS_LOCK = threading.Lock()
+
+CANT_DELETE = "Tüm mesajlar silinemiyor. Mesajlar çok eski olabilir, " \
+              "silme hakkım yok veya bu grup bir süpergrup olmayabilir.."
+
+
+def __run_purge(bot: Bot, chat_id: int, job: BulkJob, message_ids: List[int], status: Message):
+    try:
+        for start in range(0, len(message_ids), PURGE_CHUNK):
+            if job.cancelled.is_set():
+                break
+            job.run(message_ids[start:start + PURGE_CHUNK])
+            try:
+                status.edit_text("Temizleniyor... {}/{}".format(job.processed, len(message_ids)))
+            except TelegramError:
+                pass
+
+        # already deleted messages are fine - everything else gets summed up once, rather than a notice per message
+        problems = {error: count for error, count in job.errors.items()
+                    if not error.endswith("Message to delete not found")}
+        text = "Temizlik durduruldu." if job.cancelled.is_set() else "Temizlik Tamamlandı."
+        text += " {} mesaj silindi.".format(job.succeeded)
+        if any(error.endswith("Message can't be deleted") for error in problems):
+            text += "\n" + CANT_DELETE
+        elif problems:
+            text += "\n{} mesaj silinemedi.".format(sum(problems.values()))
+            LOGGER.warning("Errors while purging chat %s: %s", chat_id, problems)
+
+        bot.send_message(chat_id, text)
+        try:
+            status.delete()
+        except TelegramError:
+            pass
+
+    except Exception:
+        LOGGER.exception("Error while purging chat messages.")
+
+    finally:
+        with PURGE_JOBS_LOCK:
+            PURGE_JOBS.pop(chat_id, None)
+
 
 @run_async
 @user_admin
@@ -26,28 +72,31 @@ def purge(bot: Bot, update: Update, args: List[str]) -> str:
                 delete_to = message_id + int(args[0])
             else:
                 delete_to = msg.message_id - 1
-            for m_id in range(delete_to, message_id - 1, -1):  # Reverse iteration over message ids
-                try:
-                    bot.deleteMessage(chat.id, m_id)
-                except BadRequest as err:
-                    if err.message == "Message can't be deleted":
-                        bot.send_message(chat.id, "Tüm mesajlar silinemiyor. Mesajlar çok eski olabilir, "
-                                                  "silme hakkım yok veya bu grup bir süpergrup olmayabilir..")
 
-                    elif err.message != "Message to delete not found":
-                        LOGGER.exception("Error while purging chat messages.")
+            job = BulkJob(lambda m_id: bot.deleteMessage(chat.id, m_id), workers=PURGE_WORKERS)
+            with PURGE_JOBS_LOCK:
+                if chat.id in PURGE_JOBS:
+                    msg.reply_text("Burada zaten bir temizlik sürüyor - /cancelpurge ile durdurabilirsin.")
+                    return ""
+                PURGE_JOBS[chat.id] = job
 
             try:
-                msg.delete()
-            except BadRequest as err:
-                if err.message == "Message can't be deleted":
-                    bot.send_message(chat.id, "Tüm mesajlar silinemiyor. Mesajlar çok eski olabilir, "
-                                              "silme hakkım yok veya bu grup bir süpergrup olmayabilir..")
-
-                elif err.message != "Message to delete not found":
-                    LOGGER.exception("Error while purging chat messages.")
+                status = bot.send_message(chat.id, "Temizleniyor...")
+                # newest first, like a manual purge would; never delete our own status message
+                message_ids = [m_id for m_id in range(delete_to, message_id - 1, -1) if m_id != status.message_id]
+                if msg.message_id not in message_ids:
+                    message_ids.append(msg.message_id)
+
+                # don't hold a dispatcher worker for the whole purge
+                threading.Thread(target=__run_purge, args=(bot, chat.id, job, message_ids, status),
+                                 daemon=True).start()
+            except Exception:
+                # the purge never started - don't leave the chat blocked from starting another
+                with PURGE_JOBS_LOCK:
+                    if PURGE_JOBS.get(chat.id) is job:
+                        del PURGE_JOBS[chat.id]
+                raise
 
-            bot.send_message(chat.id, "Temizlik Tamamlandı.")
             return "<b>{}:</b>" \
                    "\n#PURGE" \
                    "\n<b>Admin:</b> {}" \
@@ -61,6 +110,21 @@ def purge(bot: Bot, update: Update, args: List[str]) -> str:
     return ""
 
 
+@run_async
+@user_admin
+def cancel_purge(bot: Bot, update: Update):
+    chat = update.effective_chat  # type: Optional[Chat]
+    with PURGE_JOBS_LOCK:
+        job = PURGE_JOBS.get(chat.id)
+
+    if not job:
+        update.effective_message.reply_text("Şu anda süren bir temizlik yok.")
+        return
+
+    job.cancel()
+    update.effective_message.reply_text("Temizlik durduruluyor...")
+
+
 @run_async
 @user_admin
 @loggable
@@ -87,12 +151,15 @@ __help__ = """
  - /del: yanıtladığınız mesajı siler
  - /purge: Bu ve mesaja verilen cevap arasındaki tüm mesajları siler.
  - /purge <sayı>: cevaplanan mesajı ve onu izleyen X mesajları siler.
+ - /cancelpurge: süren bir temizliği durdurur.
 """
 
 __mod_name__ = "Temizlik"
 
 DELETE_HANDLER = CommandHandler("del", del_message, filters=Filters.group)
 PURGE_HANDLER = CommandHandler("purge", purge, filters=Filters.group, pass_args=True)
+CANCEL_PURGE_HANDLER = CommandHandler("cancelpurge", cancel_purge, filters=Filters.group)
 
 dispatcher.add_handler(DELETE_HANDLER)
 dispatcher.add_handler(PURGE_HANDLER)
+dispatcher.add_handler(CANCEL_PURGE_HANDLER)
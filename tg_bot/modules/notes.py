@@ -1,8 +1,9 @@
 import re
+from functools import lru_cache
 from io import BytesIO
 from typing import Optional, List
 
-from telegram import MAX_MESSAGE_LENGTH, ParseMode, InlineKeyboardMarkup
+from telegram import ParseMode, InlineKeyboardMarkup
 from telegram import Message, Update, Bot
 from telegram.error import BadRequest
 from telegram.ext import CommandHandler, RegexHandler, Filters
@@ -13,12 +14,18 @@ import tg_bot.modules.sql.notes_sql as sql
 from tg_bot import dispatcher, MESSAGE_DUMP, LOGGER
 from tg_bot.modules.helper_funcs.chat_status import user_admin
 from tg_bot.modules.helper_funcs.extraction import extract_text
-from tg_bot.modules.helper_funcs.misc import build_keyboard
+from tg_bot.modules.helper_funcs.misc import build_keyboard, split_message
 from tg_bot.modules.helper_funcs.string_handling import button_markdown_parser, markdown_parser
 
 FILE_MATCHER = re.compile(r"^###file_id(!photo)?###:(.*?)(?:\s|$)")
 
 
+@lru_cache(maxsize=1024)
+def get_keyboard(buttons) -> InlineKeyboardMarkup:
+    # cached notes hand out the same buttons tuple every time, so the keyboard only gets built once
+    return InlineKeyboardMarkup(build_keyboard(buttons))
+
+
 # Do not async
 def get(bot, update, notename, show_none=True):
     chat_id = update.effective_chat.id
@@ -56,12 +63,7 @@ def get(bot, update, notename, show_none=True):
                     else:
                         raise
         else:
-            keyb = []
-            if note.has_buttons:
-                buttons = sql.get_buttons(chat_id, notename)
-                keyb = build_keyboard(buttons)
-
-            keyboard = InlineKeyboardMarkup(keyb)
+            keyboard = get_keyboard(note.buttons)
             try:
                 reply_text(note.value, parse_mode=ParseMode.MARKDOWN,
                            disable_web_page_preview=True,
@@ -82,7 +84,17 @@ def get(bot, update, notename, show_none=True):
                     LOGGER.exception("Could not parse message #%s in chat %s", notename, str(chat_id))
                     LOGGER.warning("Message was: %s", str(note.value))
         return
-    elif show_none:
+
+    # a missed #hashtag stays quiet - it's most likely just a hashtag. Suggestions are only worked out for /get
+    if not show_none:
+        return
+
+    suggestions = sql.suggest_notes(chat_id, notename)
+    if suggestions:
+        message.reply_text("Bu not mevcut değil. Bunlardan birini mi demek istedin?\n{}".format(
+            "\n".join(" - `#{}`".format(escape_markdown(name)) for name in suggestions)),
+            parse_mode=ParseMode.MARKDOWN)
+    else:
         message.reply_text("Bu not mevcut değil")
 
 
@@ -185,23 +197,20 @@ def clear(bot: Bot, update: Update, args: List[str]):
 
 
 @run_async
-def list_notes(bot: Bot, update: Update):
+def list_notes(bot: Bot, update: Update, args: List[str]):
     chat_id = update.effective_chat.id
-    note_list = sql.get_all_chat_notes(chat_id)
-
-    msg = "*Sohbetteki kayıtlı notlar:*\n"
-    for note in note_list:
-        note_name = escape_markdown(" - {}\n".format(note.name))
-        if len(msg) + len(note_name) > MAX_MESSAGE_LENGTH:
-            update.effective_message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
-            msg = ""
-        msg += note_name
+    if args:
+        note_list = sql.find_notes_by_prefix(chat_id, args[0])
+    else:
+        note_list = sql.get_note_names(chat_id)
 
-    if msg == "*Notes in chat:*\n":
+    if not note_list:
         update.effective_message.reply_text("Sohbette kayıtlı not yok!")
+        return
 
-    elif len(msg) != 0:
-        update.effective_message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    msg = "*Sohbetteki kayıtlı notlar:*\n" + "".join(escape_markdown(" - {}\n".format(name)) for name in note_list)
+    for page in split_message(msg):
+        update.effective_message.reply_text(page, parse_mode=ParseMode.MARKDOWN)
 
 
 def __import_data__(chat_id, data):
@@ -236,7 +245,7 @@ def __migrate__(old_chat_id, new_chat_id):
 
 
 def __chat_settings__(chat_id, user_id):
-    notes = sql.get_all_chat_notes(chat_id)
+    notes = sql.get_note_names(chat_id)
     return "There are `{}` notes in this chat.".format(len(notes))
 
 
@@ -244,6 +253,7 @@ __help__ = """
  - /get  <notismi>: Notu çağır
  - #<notismi>: /get ile aynı
  - /notes or /saved: Bu sohbetteki tüm kayıtlı notları listele
+ - /notes <önek>: Sadece bu önekle başlayan notları listele
 
 *Sadece yöneticiler:*
  - /save <notismi> <not>: Bir not kaydeder
@@ -262,7 +272,7 @@ SAVE_HANDLER = CommandHandler("save", save, filters=~Filters.reply)
 REPL_SAVE_HANDLER = CommandHandler("save", save_replied, filters=Filters.reply)
 DELETE_HANDLER = CommandHandler("clear", clear, pass_args=True)
 
-LIST_HANDLER = CommandHandler(["notes", "saved"], list_notes)
+LIST_HANDLER = CommandHandler(["notes", "saved"], list_notes, pass_args=True)
 
 dispatcher.add_handler(GET_HANDLER)
 dispatcher.add_handler(SAVE_HANDLER)
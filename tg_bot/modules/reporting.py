@@ -7,9 +7,10 @@ from telegram.ext import CommandHandler, RegexHandler, run_async, Filters
 from telegram.utils.helpers import mention_html
 
 from tg_bot import dispatcher, LOGGER
-from tg_bot.modules.helper_funcs.chat_status import user_not_admin, user_admin
+from tg_bot.modules.helper_funcs.chat_status import user_not_admin, user_admin, get_admin_roster
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.sql import reporting_sql as sql
+from tg_bot.modules.sql.chat_settings_sql import get_chat_settings
 
 REPORT_GROUP = 5
 
@@ -56,10 +57,10 @@ def report(bot: Bot, update: Update) -> str:
     chat = update.effective_chat  # type: Optional[Chat]
     user = update.effective_user  # type: Optional[User]
 
-    if chat and message.reply_to_message and sql.chat_should_report(chat.id):
+    if chat and message.reply_to_message and get_chat_settings(chat.id).should_report:
         reported_user = message.reply_to_message.from_user  # type: Optional[User]
         chat_name = chat.title or chat.first or chat.username
-        admin_list = chat.get_administrators()
+        admin_list = get_admin_roster(chat).values()
 
         if chat.username and chat.type == Chat.SUPERGROUP:
             msg = "<b>{}:</b>" \
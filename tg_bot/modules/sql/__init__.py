@@ -1,12 +1,24 @@
+import threading
+from contextlib import contextmanager
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from tg_bot import DB_URI
+from tg_bot import DB_URI, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
 
 
 def start() -> scoped_session:
-    engine = create_engine(DB_URI, client_encoding="utf8")
+    options = {"client_encoding": "utf8"}
+    if make_url(DB_URI).get_backend_name() != "sqlite":  # sqlite doesn't use a queue pool
+        options.update(pool_size=DB_POOL_SIZE,
+                       max_overflow=DB_MAX_OVERFLOW,
+                       pool_timeout=DB_POOL_TIMEOUT,
+                       pool_recycle=DB_POOL_RECYCLE,
+                       pool_pre_ping=DB_POOL_PRE_PING)
+
+    engine = create_engine(DB_URI, **options)
     BASE.metadata.bind = engine
     BASE.metadata.create_all(engine)
     return scoped_session(sessionmaker(bind=engine, autoflush=False))
@@ -14,3 +26,55 @@ def start() -> scoped_session:
 
 BASE = declarative_base()
 SESSION = start()
+
+_SCOPE = threading.local()
+
+CHAT_VERSIONS = {}  # chat_id -> counter, bumped whenever any of the chat's settings change
+_VERSION_LOCK = threading.Lock()
+
+
+@contextmanager
+def session_scope():
+    """
+    Run one unit of work on a session of its own.
+
+    Commits when the block exits normally and rolls back if it raises, then closes the session so its connection
+    goes straight back to the pool - no transaction is ever left idling between handlers. Scopes can be nested; only
+    the outermost one opens, commits and closes the session. The thread's shared SESSION is left alone, so pending
+    work of code still using it directly isn't lost.
+
+    Values read inside the block should be copied out before it ends, as committing expires loaded objects.
+
+        with session_scope() as session:
+            rules = session.query(Rules).get(str(chat_id))
+            text = rules.rules if rules else ""
+    """
+    depth = getattr(_SCOPE, "depth", 0)
+    if not depth:
+        _SCOPE.session = SESSION.session_factory()
+    session = _SCOPE.session
+    _SCOPE.depth = depth + 1
+    try:
+        yield session
+        if not depth:
+            session.commit()
+    except BaseException:
+        if not depth:
+            session.rollback()
+        raise
+    finally:
+        _SCOPE.depth = depth
+        if not depth:
+            _SCOPE.session = None
+            session.close()
+
+
+def bump_chat_version(chat_id):
+    """Mark everything cached from a chat's settings as stale. Writers call this after committing a change."""
+    chat_id = str(chat_id)
+    with _VERSION_LOCK:
+        CHAT_VERSIONS[chat_id] = CHAT_VERSIONS.get(chat_id, 0) + 1
+
+
+def get_chat_version(chat_id):
+    return CHAT_VERSIONS.get(str(chat_id), 0)
@@ -2,6 +2,7 @@ import threading
 
 from sqlalchemy import Column, UnicodeText, Boolean, Integer
 
+from tg_bot.modules.helper_funcs.cache_bus import publish, subscribe
 from tg_bot.modules.sql import BASE, SESSION
 
 
@@ -24,6 +25,17 @@ class AFK(BASE):
 AFK.__table__.create(checkfirst=True)
 INSERTION_LOCK = threading.RLock()
 
+AFK_USERS = {}  # user_id -> reason, for every user currently afk
+
+
+def is_afk(user_id):
+    return user_id in AFK_USERS
+
+
+def get_afk_reason(user_id):
+    """:return: the user's afk reason ("" if none given), or None if they aren't afk"""
+    return AFK_USERS.get(user_id)
+
 
 def check_afk_status(user_id):
     try:
@@ -39,16 +51,24 @@ def set_afk(user_id, reason=""):
             curr = AFK(user_id, reason, True)
         else:
             curr.is_afk = True
+        AFK_USERS[user_id] = curr.reason or ""
         SESSION.add(curr)
         SESSION.commit()
+    publish("afk", user_id)
 
 
 def rm_afk(user_id):
+    # runs on every group message - the usual case of a user that isn't afk never touches the database
+    if user_id not in AFK_USERS:
+        return False
+
     with INSERTION_LOCK:
         curr = SESSION.query(AFK).get(user_id)
+        AFK_USERS.pop(user_id, None)
         if curr:
             SESSION.delete(curr)
             SESSION.commit()
+            publish("afk", user_id)
             return True
         SESSION.close()
         return False
@@ -63,5 +83,37 @@ def toggle_afk(user_id, reason=""):
             curr.is_afk = False
         elif not curr.is_afk:
             curr.is_afk = True
+
+        if curr.is_afk:
+            AFK_USERS[user_id] = curr.reason or ""
+        else:
+            AFK_USERS.pop(user_id, None)
         SESSION.add(curr)
         SESSION.commit()
+    publish("afk", user_id)
+
+
+def __load_afk_users():
+    try:
+        AFK_USERS.clear()
+        for user_id, reason in SESSION.query(AFK.user_id, AFK.reason).filter(AFK.is_afk.is_(True)):
+            AFK_USERS[user_id] = reason or ""
+    finally:
+        SESSION.close()
+
+
+def __reload_afk_user(user_id):
+    # the user went (or came back from being) afk in a chat handled by another shard
+    with INSERTION_LOCK:
+        try:
+            curr = SESSION.query(AFK).get(user_id)
+            if curr and curr.is_afk:
+                AFK_USERS[user_id] = curr.reason or ""
+            else:
+                AFK_USERS.pop(user_id, None)
+        finally:
+            SESSION.close()
+
+
+__load_afk_users()
+subscribe("afk", __reload_afk_user)
@@ -1,8 +1,10 @@
 import threading
+import time
+from collections import deque
 
 from sqlalchemy import String, Column, Integer
 
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql import SESSION, BASE, bump_chat_version
 
 
 class FloodControl(BASE):
@@ -23,6 +25,22 @@ FloodControl.__table__.create(checkfirst=True)
 
 INSERTION_LOCK = threading.RLock()
 
+# Only the per-chat limit is persisted. Message counts are transient, so they live in memory: a user is flooding
+# when they send more than `limit` messages within FLOOD_WINDOW seconds.
+FLOOD_WINDOW = 10
+# Counters are guarded by a fixed set of locks, picked by chat, so unrelated chats don't wait on each other.
+FLOOD_LOCK_STRIPES = 64
+# Once a chat tracks this many users, drop the ones which haven't spoken within the window.
+FLOOD_PRUNE_SIZE = 50
+
+CHAT_FLOOD = {}
+FLOOD_COUNTERS = {}
+FLOOD_LOCKS = [threading.Lock() for _ in range(FLOOD_LOCK_STRIPES)]
+
+
+def __flood_lock(chat_id):
+    return FLOOD_LOCKS[hash(chat_id) % FLOOD_LOCK_STRIPES]
+
 
 def set_flood(chat_id, amount):
     with INSERTION_LOCK:
@@ -35,34 +53,38 @@ def set_flood(chat_id, amount):
 
         SESSION.add(flood)
         SESSION.commit()
+        CHAT_FLOOD[str(chat_id)] = amount
+        bump_chat_version(chat_id)
 
+    with __flood_lock(str(chat_id)):
+        FLOOD_COUNTERS.pop(str(chat_id), None)
 
-def update_flood(chat_id, user_id):
-    with INSERTION_LOCK:
-        flood = SESSION.query(FloodControl).get(str(chat_id))
-
-        if flood and flood.limit != 0:
-            if flood.user_id != user_id:
-                flood.user_id = user_id
-                flood.count = 0
 
-            if not user_id:
-                SESSION.commit()
-                return False
+def update_flood(chat_id, user_id):
+    if not user_id:
+        return False
 
-            flood.count += 1
+    limit = get_flood_limit(chat_id)
+    if not limit:
+        return False
 
-            if flood.count > flood.limit:
-                flood.user_id = None
-                flood.count = 0
+    chat_id = str(chat_id)
+    now = time.monotonic()
+    with __flood_lock(chat_id):
+        chat_users = FLOOD_COUNTERS.setdefault(chat_id, {})
+        timestamps = chat_users.get(user_id)
+        if timestamps is None or timestamps.maxlen != limit + 1:
+            timestamps = chat_users[user_id] = deque(maxlen=limit + 1)
 
-                SESSION.commit()
-                return True
+        timestamps.append(now)
+        if len(timestamps) > limit and now - timestamps[0] <= FLOOD_WINDOW:
+            del chat_users[user_id]
+            return True
 
-            SESSION.commit()
-            return False
+        if len(chat_users) > FLOOD_PRUNE_SIZE:
+            for stale_user in [u_id for u_id, times in chat_users.items() if now - times[-1] > FLOOD_WINDOW]:
+                del chat_users[stale_user]
 
-        SESSION.close()
         return False
 
 
@@ -73,6 +95,20 @@ def get_flood(chat_id):
         SESSION.close()
 
 
+def get_flood_limit(chat_id):
+    limit = CHAT_FLOOD.get(str(chat_id))
+    if limit is None:
+        with INSERTION_LOCK:
+            try:
+                flood = SESSION.query(FloodControl).get(str(chat_id))
+                limit = (flood.limit or 0) if flood else 0
+                CHAT_FLOOD[str(chat_id)] = limit
+            finally:
+                SESSION.close()
+
+    return limit
+
+
 def migrate_chat(old_chat_id, new_chat_id):
     with INSERTION_LOCK:
         flood = SESSION.query(FloodControl).get(str(old_chat_id))
@@ -81,3 +117,7 @@ def migrate_chat(old_chat_id, new_chat_id):
             SESSION.commit()
 
         SESSION.close()
+        CHAT_FLOOD.pop(str(old_chat_id), None)
+        CHAT_FLOOD.pop(str(new_chat_id), None)
+        bump_chat_version(old_chat_id)
+        bump_chat_version(new_chat_id)
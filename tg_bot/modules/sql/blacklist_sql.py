@@ -2,6 +2,7 @@ import threading
 
 from sqlalchemy import func, distinct, Column, String, UnicodeText
 
+from tg_bot.modules.helper_funcs.keyword_matcher import KeywordMatcher
 from tg_bot.modules.sql import SESSION, BASE
 
 
@@ -27,6 +28,8 @@ BlackListFilters.__table__.create(checkfirst=True)
 
 BLACKLIST_FILTER_INSERTION_LOCK = threading.RLock()
 
+CHAT_BLACKLISTS = {}  # chat_id -> KeywordMatcher, built lazily on first use
+
 
 def add_to_blacklist(chat_id, trigger):
     with BLACKLIST_FILTER_INSERTION_LOCK:
@@ -34,6 +37,7 @@ def add_to_blacklist(chat_id, trigger):
 
         SESSION.merge(blacklist_filt)  # merge to avoid duplicate key issues
         SESSION.commit()
+        CHAT_BLACKLISTS.pop(str(chat_id), None)
 
 
 def rm_from_blacklist(chat_id, trigger):
@@ -42,6 +46,7 @@ def rm_from_blacklist(chat_id, trigger):
         if blacklist_filt:
             SESSION.delete(blacklist_filt)
             SESSION.commit()
+            CHAT_BLACKLISTS.pop(str(chat_id), None)
             return True
         SESSION.close()
         return False
@@ -54,6 +59,24 @@ def get_chat_blacklist(chat_id):
         SESSION.close()
 
 
+def get_chat_blacklist_matcher(chat_id):
+    matcher = CHAT_BLACKLISTS.get(str(chat_id))
+    if matcher is not None:
+        return matcher
+
+    # built under the insertion lock so a concurrent add/rm can't be overwritten by a stale matcher
+    with BLACKLIST_FILTER_INSERTION_LOCK:
+        matcher = CHAT_BLACKLISTS.get(str(chat_id))
+        if matcher is None:
+            try:
+                triggers = SESSION.query(BlackListFilters.trigger).filter(BlackListFilters.chat_id == str(chat_id))
+                matcher = KeywordMatcher(trigger for trigger, in triggers)
+            finally:
+                SESSION.close()
+            CHAT_BLACKLISTS[str(chat_id)] = matcher
+        return matcher
+
+
 def num_blacklist_filters():
     try:
         return SESSION.query(BlackListFilters).count()
@@ -81,3 +104,5 @@ def migrate_chat(old_chat_id, new_chat_id):
         for filt in chat_filters:
             filt.chat_id = str(new_chat_id)
         SESSION.commit()
+        CHAT_BLACKLISTS.pop(str(old_chat_id), None)
+        CHAT_BLACKLISTS.pop(str(new_chat_id), None)
@@ -0,0 +1,93 @@
+import json
+import threading
+
+from sqlalchemy import Column, Integer, String, UnicodeText
+
+from tg_bot.modules.sql import BASE, SESSION
+
+
+class Broadcasts(BASE):
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message = Column(UnicodeText, nullable=False)
+    # every chat with an id up to and including this one has been handled; chats are walked in chat_id order
+    last_chat_id = Column(String(14))
+    # json list of chats after last_chat_id that were handled anyway, as a chunk's chats are sent out of order
+    done_chat_ids = Column(UnicodeText, nullable=False, default="[]")
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    errors = Column(UnicodeText, nullable=False, default="{}")  # json: error class -> count
+    status = Column(String(10), nullable=False, default="running")
+
+    def __init__(self, message):
+        self.message = message
+        self.last_chat_id = None
+        self.done_chat_ids = "[]"
+        self.sent = 0
+        self.failed = 0
+        self.errors = "{}"
+        self.status = "running"
+
+    def __repr__(self):
+        return "<Broadcast {} ({}, {} sent)>".format(self.id, self.status, self.sent)
+
+    def get_done_chat_ids(self):
+        return json.loads(self.done_chat_ids or "[]")
+
+    def get_errors(self):
+        return json.loads(self.errors or "{}")
+
+
+Broadcasts.__table__.create(checkfirst=True)
+
+BROADCAST_LOCK = threading.RLock()
+
+
+def new_broadcast(message):
+    with BROADCAST_LOCK:
+        broadcast = Broadcasts(message)
+        SESSION.add(broadcast)
+        SESSION.commit()
+        broadcast_id = broadcast.id
+        SESSION.close()
+        return broadcast_id
+
+
+def get_broadcast(broadcast_id):
+    try:
+        return SESSION.query(Broadcasts).get(broadcast_id)
+    finally:
+        SESSION.close()
+
+
+def get_unfinished_broadcast():
+    try:
+        return SESSION.query(Broadcasts).filter(Broadcasts.status != "done").order_by(Broadcasts.id.desc()).first()
+    finally:
+        SESSION.close()
+
+
+def checkpoint(broadcast_id, last_chat_id, done_chat_ids, sent, failed, errors):
+    with BROADCAST_LOCK:
+        broadcast = SESSION.query(Broadcasts).get(broadcast_id)
+        if not broadcast:
+            SESSION.close()
+            return
+
+        broadcast.last_chat_id = str(last_chat_id) if last_chat_id is not None else None
+        broadcast.done_chat_ids = json.dumps(sorted(done_chat_ids))
+        broadcast.sent = sent
+        broadcast.failed = failed
+        broadcast.errors = json.dumps(errors)
+        SESSION.commit()
+
+
+def set_status(broadcast_id, status):
+    with BROADCAST_LOCK:
+        broadcast = SESSION.query(Broadcasts).get(broadcast_id)
+        if not broadcast:
+            SESSION.close()
+            return
+
+        broadcast.status = status
+        SESSION.commit()
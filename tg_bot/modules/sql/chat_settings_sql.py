@@ -0,0 +1,78 @@
+import importlib
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from tg_bot.modules.helper_funcs.misc import is_module_loaded
+from tg_bot.modules.sql import SESSION, get_chat_version
+
+# everything the per-message handlers need to know about a chat
+ChatSettings = namedtuple("ChatSettings", ["should_report", "log_channel", "flood_limit", "gbans_enabled",
+                                           "lock_mask", "disabled"])
+
+CHAT_SETTINGS = {}  # chat_id -> (chat version it was loaded at, ChatSettings)
+
+
+def __sql_module(name):
+    """
+    The sql module behind a bot module, imported on first use - so modules in NO_LOAD never get their tables, caches
+    or threads set up just for this.
+
+    :param name: bot module name, eg "locks"
+    :return: its sql module, or None if the bot module isn't loaded
+    """
+    if not is_module_loaded(name):
+        return None
+    return importlib.import_module("tg_bot.modules.sql.{}_sql".format(name))
+
+
+def __load_stored_settings(chat_id):
+    # one round trip for the settings that aren't already kept in memory by their own modules
+    reporting_sql = __sql_module("reporting")
+    log_channel_sql = __sql_module("log_channel")
+    columns = []
+    if reporting_sql:
+        columns.append(select([reporting_sql.ReportingChatSettings.should_report]).where(
+            reporting_sql.ReportingChatSettings.chat_id == chat_id).as_scalar())
+    if log_channel_sql:
+        columns.append(select([log_channel_sql.GroupLogs.log_channel]).where(
+            log_channel_sql.GroupLogs.chat_id == chat_id).as_scalar())
+    if not columns:
+        return None, None
+
+    try:
+        row = list(SESSION.execute(select(columns)).first())
+    finally:
+        SESSION.close()
+    return (row.pop(0) if reporting_sql else None), (row.pop(0) if log_channel_sql else None)
+
+
+def get_chat_settings(chat_id) -> ChatSettings:
+    """
+    Get a snapshot of a chat's settings, reloaded only after one of the sql modules bumped the chat's version.
+    Settings of modules that aren't loaded are left at their defaults.
+
+    :param chat_id: chat to get the settings of
+    :return: the chat's settings
+    """
+    chat_id = str(chat_id)
+    # read the version before loading: a write racing the load bumps it again, so the stale snapshot gets replaced
+    version = get_chat_version(chat_id)
+    cached = CHAT_SETTINGS.get(chat_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    antiflood_sql = __sql_module("antiflood")
+    global_bans_sql = __sql_module("global_bans")
+    locks_sql = __sql_module("locks")
+    disable_sql = __sql_module("disable")
+
+    should_report, log_channel = __load_stored_settings(chat_id)
+    settings = ChatSettings(should_report=bool(should_report),
+                            log_channel=log_channel,
+                            flood_limit=antiflood_sql.get_flood_limit(chat_id) if antiflood_sql else 0,
+                            gbans_enabled=global_bans_sql.does_chat_gban(chat_id) if global_bans_sql else False,
+                            lock_mask=locks_sql.get_lock_mask(chat_id) if locks_sql else 0,
+                            disabled=disable_sql.get_disabled_set(chat_id) if disable_sql else frozenset())
+    CHAT_SETTINGS[chat_id] = (version, settings)
+    return settings
@@ -1,7 +1,9 @@
 import threading
+from collections import namedtuple
 
 from sqlalchemy import Column, String, UnicodeText, Boolean, Integer, distinct, func
 
+from tg_bot.modules.helper_funcs.keyword_matcher import KeywordMatcher
 from tg_bot.modules.sql import BASE, SESSION
 
 
@@ -67,6 +69,10 @@ Buttons.__table__.create(checkfirst=True)
 CUST_FILT_LOCK = threading.RLock()
 BUTTON_LOCK = threading.RLock()
 
+# matcher over all keywords, keyword -> CustomFilters, keyword -> [Buttons]
+FilterIndex = namedtuple("FilterIndex", ["matcher", "filters", "buttons"])
+CHAT_FILTER_INDEX = {}  # chat_id -> FilterIndex, built lazily on first use
+
 
 def get_all_filters():
     try:
@@ -99,6 +105,10 @@ def add_filter(chat_id, keyword, reply, is_sticker=False, is_document=False, is_
     for b_name, url, same_line in buttons:
         add_note_button_to_db(chat_id, keyword, b_name, url, same_line)
 
+    # only drop the index once the buttons are in too, so it can't be rebuilt without them
+    with CUST_FILT_LOCK:
+        CHAT_FILTER_INDEX.pop(str(chat_id), None)
+
 
 def remove_filter(chat_id, keyword):
     with CUST_FILT_LOCK:
@@ -112,6 +122,7 @@ def remove_filter(chat_id, keyword):
 
             SESSION.delete(filt)
             SESSION.commit()
+            CHAT_FILTER_INDEX.pop(str(chat_id), None)
             return True
 
         SESSION.close()
@@ -126,6 +137,42 @@ def get_chat_filters(chat_id):
         SESSION.close()
 
 
+def get_chat_filter_index(chat_id):
+    index = CHAT_FILTER_INDEX.get(str(chat_id))
+    if index is not None:
+        return index
+
+    with CUST_FILT_LOCK:
+        index = CHAT_FILTER_INDEX.get(str(chat_id))
+        if index is None:
+            try:
+                filters = {filt.keyword: filt for filt in
+                           SESSION.query(CustomFilters).filter(CustomFilters.chat_id == str(chat_id))}
+                buttons = {}
+                for btn in SESSION.query(Buttons).filter(Buttons.chat_id == str(chat_id)).order_by(Buttons.id):
+                    buttons.setdefault(btn.keyword, []).append(btn)
+            finally:
+                SESSION.close()
+
+            index = FilterIndex(KeywordMatcher(filters), filters, buttons)
+            CHAT_FILTER_INDEX[str(chat_id)] = index
+        return index
+
+
+def match_filter(chat_id, text):
+    """Return the filter for the longest keyword found in text (alphabetical on ties), or None."""
+    index = get_chat_filter_index(chat_id)
+    if not index.matcher:
+        return None
+
+    found = index.matcher.matches(text)
+    if not found:
+        return None
+
+    keyword = min(found, key=lambda kw: (-len(kw), kw))
+    return index.filters.get(keyword)
+
+
 def add_note_button_to_db(chat_id, keyword, b_name, url, same_line):
     with BUTTON_LOCK:
         button = Buttons(chat_id, keyword, b_name, url, same_line)
@@ -134,6 +181,10 @@ def add_note_button_to_db(chat_id, keyword, b_name, url, same_line):
 
 
 def get_buttons(chat_id, keyword):
+    index = CHAT_FILTER_INDEX.get(str(chat_id))
+    if index is not None:
+        return index.buttons.get(keyword, [])
+
     try:
         return SESSION.query(Buttons).filter(Buttons.chat_id == str(chat_id), Buttons.keyword == keyword).order_by(
             Buttons.id).all()
@@ -167,3 +218,6 @@ def migrate_chat(old_chat_id, new_chat_id):
             for btn in chat_buttons:
                 btn.chat_id = str(new_chat_id)
             SESSION.commit()
+
+        CHAT_FILTER_INDEX.pop(str(old_chat_id), None)
+        CHAT_FILTER_INDEX.pop(str(new_chat_id), None)
@@ -2,7 +2,7 @@ import threading
 
 from sqlalchemy import Column, String, UnicodeText, func, distinct
 
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql import SESSION, BASE, bump_chat_version
 
 
 class Disable(BASE):
@@ -21,6 +21,8 @@ class Disable(BASE):
 Disable.__table__.create(checkfirst=True)
 DISABLE_INSERTION_LOCK = threading.RLock()
 
+DISABLED = {}  # chat_id -> frozenset of disabled commands, loaded lazily on first check
+
 
 def disable_command(chat_id, disable):
     with DISABLE_INSERTION_LOCK:
@@ -30,6 +32,8 @@ def disable_command(chat_id, disable):
             disabled = Disable(str(chat_id), disable)
             SESSION.add(disabled)
             SESSION.commit()
+            DISABLED.pop(str(chat_id), None)
+            bump_chat_version(chat_id)
             return True
 
         SESSION.close()
@@ -43,25 +47,38 @@ def enable_command(chat_id, enable):
         if disabled:
             SESSION.delete(disabled)
             SESSION.commit()
+            DISABLED.pop(str(chat_id), None)
+            bump_chat_version(chat_id)
             return True
 
         SESSION.close()
         return False
 
 
+def get_disabled_set(chat_id):
+    disabled = DISABLED.get(str(chat_id))
+    if disabled is not None:
+        return disabled
+
+    # loaded under the insertion lock so a concurrent disable/enable can't be overwritten by a stale set
+    with DISABLE_INSERTION_LOCK:
+        disabled = DISABLED.get(str(chat_id))
+        if disabled is None:
+            try:
+                disabled = frozenset(cmd for cmd, in SESSION.query(Disable.command).filter(
+                    Disable.chat_id == str(chat_id)))
+            finally:
+                SESSION.close()
+            DISABLED[str(chat_id)] = disabled
+        return disabled
+
+
 def is_command_disabled(chat_id, cmd):
-    try:
-        return bool(SESSION.query(Disable).get((str(chat_id), cmd)))
-    finally:
-        SESSION.close()
+    return cmd in get_disabled_set(chat_id)
 
 
 def are_commands_disabled(chat_id, cmds):
-    try:
-        return bool(SESSION.query(Disable).filter(Disable.chat_id == str(chat_id),
-                                                  Disable.command.in_(v for v in cmds)).first())
-    finally:
-        SESSION.close()
+    return not get_disabled_set(chat_id).isdisjoint(cmds)
 
 
 def get_all_disabled(chat_id):
@@ -94,3 +111,7 @@ def migrate_chat(old_chat_id, new_chat_id):
                 SESSION.add(chat)
 
         SESSION.commit()
+        DISABLED.pop(str(old_chat_id), None)
+        DISABLED.pop(str(new_chat_id), None)
+        bump_chat_version(old_chat_id)
+        bump_chat_version(new_chat_id)
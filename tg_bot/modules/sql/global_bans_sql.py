@@ -2,7 +2,9 @@ import threading
 
 from sqlalchemy import Column, UnicodeText, Integer, String, Boolean
 
-from tg_bot.modules.sql import BASE, SESSION
+from tg_bot import LOGGER
+from tg_bot.modules.helper_funcs.cache_bus import publish, subscribe
+from tg_bot.modules.sql import BASE, SESSION, session_scope, bump_chat_version
 
 
 class GloballyBannedUsers(BASE):
@@ -43,7 +45,13 @@ GbanSettings.__table__.create(checkfirst=True)
 
 GBANNED_USERS_LOCK = threading.RLock()
 GBAN_SETTING_LOCK = threading.RLock()
-GBANNED_LIST = []
+
+# Both sets are kept in step with every write below, and fully reloaded every RECONCILE_INTERVAL seconds in case
+# the database was changed from elsewhere.
+RECONCILE_INTERVAL = 15 * 60
+RECONCILE_STOP = threading.Event()
+GBANNED_IDS = set()
+GBAN_DISABLED_CHATS = set()  # chats with gbans turned off; every other chat enforces them
 
 
 def gban_user(user_id, name, reason=None):
@@ -57,19 +65,17 @@ def gban_user(user_id, name, reason=None):
 
         SESSION.merge(user)
         SESSION.commit()
-        __load_gbanned_userid_list()
+        GBANNED_IDS.add(user_id)
+    publish("gban", user_id)
 
 
 def update_gban_reason(user_id, name, reason=None):
-    with GBANNED_USERS_LOCK:
-        user = SESSION.query(GloballyBannedUsers).get(user_id)
+    with GBANNED_USERS_LOCK, session_scope() as session:
+        user = session.query(GloballyBannedUsers).get(user_id)
         if not user:
             return False
         user.name = name
         user.reason = reason
-
-        SESSION.merge(user)
-        SESSION.commit()
         return True
 
 
@@ -80,11 +86,12 @@ def ungban_user(user_id):
             SESSION.delete(user)
 
         SESSION.commit()
-        __load_gbanned_userid_list()
+        GBANNED_IDS.discard(user_id)
+    publish("gban", user_id)
 
 
 def is_user_gbanned(user_id):
-    return user_id in GBANNED_LIST
+    return user_id in GBANNED_IDS
 
 
 def get_gbanned_user(user_id):
@@ -110,6 +117,9 @@ def enable_gbans(chat_id):
         chat.setting = True
         SESSION.add(chat)
         SESSION.commit()
+        GBAN_DISABLED_CHATS.discard(str(chat_id))
+        bump_chat_version(chat_id)
+    publish("gban_setting", str(chat_id))
 
 
 def disable_gbans(chat_id):
@@ -121,26 +131,85 @@ def disable_gbans(chat_id):
         chat.setting = False
         SESSION.add(chat)
         SESSION.commit()
+        GBAN_DISABLED_CHATS.add(str(chat_id))
+        bump_chat_version(chat_id)
+    publish("gban_setting", str(chat_id))
 
 
 def does_chat_gban(chat_id):
-    try:
-        chat = SESSION.query(GbanSettings).get(str(chat_id))
-        return bool(not chat or chat.setting)
-    finally:
-        SESSION.close()
+    return str(chat_id) not in GBAN_DISABLED_CHATS
+
+
+def get_gban_disabled_chats():
+    """All chats which opted out of gbans - everyone else enforces them by default."""
+    return set(GBAN_DISABLED_CHATS)
 
 
 def num_gbanned_users():
-    return len(GBANNED_LIST)
+    return len(GBANNED_IDS)
 
 
 def __load_gbanned_userid_list():
-    global GBANNED_LIST
-    try:
-        GBANNED_LIST = [x.user_id for x in SESSION.query(GloballyBannedUsers).all()]
-    finally:
-        SESSION.close()
+    global GBANNED_IDS
+    with GBANNED_USERS_LOCK:
+        try:
+            GBANNED_IDS = {user_id for user_id, in SESSION.query(GloballyBannedUsers.user_id)}
+        finally:
+            SESSION.close()
+
+
+def __reload_gbanned_user(user_id):
+    # another shard (g)banned this user
+    with GBANNED_USERS_LOCK:
+        try:
+            banned = SESSION.query(GloballyBannedUsers.user_id).filter(GloballyBannedUsers.user_id == user_id).first()
+        finally:
+            SESSION.close()
+
+        if banned:
+            GBANNED_IDS.add(user_id)
+        else:
+            GBANNED_IDS.discard(user_id)
+
+
+def __reload_gban_setting(chat_id):
+    # another shard changed this chat's setting - it matters here too, as gbans are fanned out from any shard
+    with GBAN_SETTING_LOCK:
+        try:
+            chat = SESSION.query(GbanSettings).get(chat_id)
+            enabled = chat.setting if chat else True
+        finally:
+            SESSION.close()
+
+        if enabled:
+            GBAN_DISABLED_CHATS.discard(chat_id)
+        else:
+            GBAN_DISABLED_CHATS.add(chat_id)
+        bump_chat_version(chat_id)
+
+
+def __load_gban_disabled_chats():
+    global GBAN_DISABLED_CHATS
+    with GBAN_SETTING_LOCK:
+        try:
+            disabled = {chat_id for chat_id, in
+                        SESSION.query(GbanSettings.chat_id).filter(GbanSettings.setting.is_(False))}
+        finally:
+            SESSION.close()
+
+        # another process may have changed some chats' settings
+        for chat_id in disabled.symmetric_difference(GBAN_DISABLED_CHATS):
+            bump_chat_version(chat_id)
+        GBAN_DISABLED_CHATS = disabled
+
+
+def __reconcile_periodically():
+    while not RECONCILE_STOP.wait(RECONCILE_INTERVAL):
+        try:
+            __load_gbanned_userid_list()
+            __load_gban_disabled_chats()
+        except Exception:
+            LOGGER.exception("Error reconciling gban caches")
 
 
 def migrate_chat(old_chat_id, new_chat_id):
@@ -151,7 +220,18 @@ def migrate_chat(old_chat_id, new_chat_id):
             SESSION.add(chat)
 
         SESSION.commit()
+        if str(old_chat_id) in GBAN_DISABLED_CHATS:
+            GBAN_DISABLED_CHATS.discard(str(old_chat_id))
+            GBAN_DISABLED_CHATS.add(str(new_chat_id))
+        bump_chat_version(old_chat_id)
+        bump_chat_version(new_chat_id)
+    publish("gban_setting", str(old_chat_id))
+    publish("gban_setting", str(new_chat_id))
 
 
 # Create in memory userid to avoid disk access
 __load_gbanned_userid_list()
+__load_gban_disabled_chats()
+subscribe("gban", __reload_gbanned_user)
+subscribe("gban_setting", __reload_gban_setting)
+threading.Thread(target=__reconcile_periodically, name="gban_reconcile", daemon=True).start()
@@ -1,9 +1,10 @@
 # New chat added -> setup permissions
 import threading
+from collections import OrderedDict
 
 from sqlalchemy import Column, String, Boolean
 
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql import SESSION, BASE, bump_chat_version
 
 
 class Permissions(BASE):
@@ -68,6 +69,19 @@ Restrictions.__table__.create(checkfirst=True)
 
 PERM_LOCK = threading.RLock()
 RESTR_LOCK = threading.RLock()
+MASK_LOCK = threading.RLock()
+
+# one bit per lockable, so a chat's full lock state fits in a single int
+PERM_BITS = OrderedDict((lock_type, 1 << i) for i, lock_type in enumerate(
+    ['audio', 'voice', 'contact', 'video', 'document', 'photo', 'sticker', 'gif', 'url', 'bots', 'forward', 'game']))
+
+# restriction type -> (column, bit)
+RESTR_BITS = OrderedDict((restr_type, (column, 1 << (len(PERM_BITS) + i))) for i, (restr_type, column) in enumerate(
+    [('messages', 'messages'), ('media', 'media'), ('other', 'other'), ('previews', 'preview')]))
+RESTR_ALL = sum(bit for _, bit in RESTR_BITS.values())
+
+LOCK_MASK_CACHE_SIZE = 4096
+LOCK_MASKS = OrderedDict()  # chat_id -> int bitmask, least recently used first
 
 
 def init_permissions(chat_id, reset=False):
@@ -125,6 +139,7 @@ def update_lock(chat_id, lock_type, locked):
 
         SESSION.add(curr_perm)
         SESSION.commit()
+        __invalidate_mask(chat_id)
 
 
 def update_restriction(chat_id, restr_type, locked):
@@ -148,58 +163,60 @@ def update_restriction(chat_id, restr_type, locked):
             curr_restr.preview = locked
         SESSION.add(curr_restr)
         SESSION.commit()
+        __invalidate_mask(chat_id)
 
 
-def is_locked(chat_id, lock_type):
-    curr_perm = SESSION.query(Permissions).get(str(chat_id))
-    SESSION.close()
-
-    if not curr_perm:
-        return False
-
-    elif lock_type == "sticker":
-        return curr_perm.sticker
-    elif lock_type == "photo":
-        return curr_perm.photo
-    elif lock_type == "audio":
-        return curr_perm.audio
-    elif lock_type == "voice":
-        return curr_perm.voice
-    elif lock_type == "contact":
-        return curr_perm.contact
-    elif lock_type == "video":
-        return curr_perm.video
-    elif lock_type == "document":
-        return curr_perm.document
-    elif lock_type == "gif":
-        return curr_perm.gif
-    elif lock_type == "url":
-        return curr_perm.url
-    elif lock_type == "bots":
-        return curr_perm.bots
-    elif lock_type == "forward":
-        return curr_perm.forward
-    elif lock_type == "game":
-        return curr_perm.game
+def __compile_mask(perm, restr):
+    mask = 0
+    if perm:
+        for lock_type, bit in PERM_BITS.items():
+            if getattr(perm, lock_type):
+                mask |= bit
+    if restr:
+        for column, bit in RESTR_BITS.values():
+            if getattr(restr, column):
+                mask |= bit
+    return mask
 
 
-def is_restr_locked(chat_id, lock_type):
-    curr_restr = SESSION.query(Restrictions).get(str(chat_id))
-    SESSION.close()
+def __invalidate_mask(chat_id):
+    with MASK_LOCK:
+        LOCK_MASKS.pop(str(chat_id), None)
+    bump_chat_version(chat_id)
+
 
-    if not curr_restr:
-        return False
+def get_lock_mask(chat_id):
+    chat_id = str(chat_id)
+    with MASK_LOCK:
+        mask = LOCK_MASKS.get(chat_id)
+        if mask is not None:
+            LOCK_MASKS.move_to_end(chat_id)
+            return mask
 
-    if lock_type == "messages":
-        return curr_restr.messages
-    elif lock_type == "media":
-        return curr_restr.media
-    elif lock_type == "other":
-        return curr_restr.other
-    elif lock_type == "previews":
-        return curr_restr.preview
-    elif lock_type == "all":
-        return curr_restr.messages and curr_restr.media and curr_restr.other and curr_restr.preview
+    # hold both write locks so a concurrent update can't be overwritten by the stale mask we're about to cache
+    with PERM_LOCK, RESTR_LOCK:
+        try:
+            mask = __compile_mask(SESSION.query(Permissions).get(chat_id),
+                                  SESSION.query(Restrictions).get(chat_id))
+        finally:
+            SESSION.close()
+
+        with MASK_LOCK:
+            LOCK_MASKS[chat_id] = mask
+            if len(LOCK_MASKS) > LOCK_MASK_CACHE_SIZE:
+                LOCK_MASKS.popitem(last=False)
+
+    return mask
+
+
+def is_locked(chat_id, lock_type):
+    return bool(get_lock_mask(chat_id) & PERM_BITS.get(lock_type, 0))
+
+
+def is_restr_locked(chat_id, lock_type):
+    if lock_type == "all":
+        return get_lock_mask(chat_id) & RESTR_ALL == RESTR_ALL
+    return bool(get_lock_mask(chat_id) & RESTR_BITS.get(lock_type, (None, 0))[1])
 
 
 def get_locks(chat_id):
@@ -222,9 +239,13 @@ def migrate_chat(old_chat_id, new_chat_id):
         if perms:
             perms.chat_id = str(new_chat_id)
         SESSION.commit()
+        __invalidate_mask(old_chat_id)
+        __invalidate_mask(new_chat_id)
 
     with RESTR_LOCK:
         rest = SESSION.query(Restrictions).get(str(old_chat_id))
         if rest:
             rest.chat_id = str(new_chat_id)
         SESSION.commit()
+        __invalidate_mask(old_chat_id)
+        __invalidate_mask(new_chat_id)
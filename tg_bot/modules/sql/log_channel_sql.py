@@ -2,7 +2,7 @@ import threading
 
 from sqlalchemy import Column, String, func, distinct
 
-from tg_bot.modules.sql import BASE, SESSION
+from tg_bot.modules.sql import BASE, session_scope, bump_chat_version
 
 
 class GroupLogs(BASE):
@@ -21,49 +21,41 @@ LOGS_INSERTION_LOCK = threading.RLock()
 
 
 def set_chat_log_channel(chat_id, log_channel):
-    with LOGS_INSERTION_LOCK:
-        res = SESSION.query(GroupLogs).get(str(chat_id))
+    with LOGS_INSERTION_LOCK, session_scope() as session:
+        res = session.query(GroupLogs).get(str(chat_id))
         if res:
             res.log_channel = log_channel
         else:
-            res = GroupLogs(chat_id, log_channel)
-            SESSION.add(res)
-
-        SESSION.commit()
+            session.add(GroupLogs(chat_id, log_channel))
+    bump_chat_version(chat_id)
 
 
 def get_chat_log_group(chat_id):
-    try:
-        res = SESSION.query(GroupLogs).get(str(chat_id))
-        if res:
-            return res.log_channel
-        return None
-    finally:
-        SESSION.close()
+    with session_scope() as session:
+        res = session.query(GroupLogs).get(str(chat_id))
+        return res.log_channel if res else None
 
 
 def stop_chat_logging(chat_id):
-    with LOGS_INSERTION_LOCK:
-        res = SESSION.query(GroupLogs).get(str(chat_id))
+    with LOGS_INSERTION_LOCK, session_scope() as session:
+        res = session.query(GroupLogs).get(str(chat_id))
+        log_channel = None
         if res:
             log_channel = res.log_channel
-            SESSION.delete(res)
-            SESSION.commit()
-            return log_channel
+            session.delete(res)
+    bump_chat_version(chat_id)
+    return log_channel
 
 
 def migrate_chat(old_chat_id, new_chat_id):
-    with LOGS_INSERTION_LOCK:
-        chat = SESSION.query(GroupLogs).get(str(old_chat_id))
+    with LOGS_INSERTION_LOCK, session_scope() as session:
+        chat = session.query(GroupLogs).get(str(old_chat_id))
         if chat:
             chat.chat_id = str(new_chat_id)
-            SESSION.add(chat)
-
-        SESSION.commit()
+    bump_chat_version(old_chat_id)
+    bump_chat_version(new_chat_id)
 
 
 def num_logchannels():
-    try:
-        return SESSION.query(func.count(distinct(GroupLogs.chat_id))).scalar()
-    finally:
-        SESSION.close()
+    with session_scope() as session:
+        return session.query(func.count(distinct(GroupLogs.chat_id))).scalar()
@@ -1,5 +1,8 @@
 # Note: chat_id's are stored as strings because the int is too large to be stored in a PSQL database.
+import bisect
+import difflib
 import threading
+from collections import OrderedDict, namedtuple
 
 from sqlalchemy import Column, String, Boolean, UnicodeText, Integer, func, distinct
 
@@ -47,6 +50,56 @@ Buttons.__table__.create(checkfirst=True)
 
 NOTES_INSERTION_LOCK = threading.RLock()
 BUTTONS_INSERTION_LOCK = threading.RLock()
+CACHE_LOCK = threading.Lock()
+
+# detached copy of a note and its buttons, safe to share between threads
+CachedNote = namedtuple("CachedNote", ["name", "value", "is_reply", "has_buttons", "buttons"])
+Button = namedtuple("Button", ["name", "url", "same_line"])
+
+NOTE_CACHE_SIZE = 8192
+NOTE_CACHE = OrderedDict()  # (chat_id, note_name) -> CachedNote, or None for notes known not to exist
+
+
+NOTE_NAMES = {}  # chat_id -> sorted list of note names, loaded lazily
+
+
+def __load_note_names(chat_id):
+    with NOTES_INSERTION_LOCK:
+        names = NOTE_NAMES.get(chat_id)
+        if names is None:
+            try:
+                names = NOTE_NAMES[chat_id] = sorted(name for name, in SESSION.query(Notes.name).filter(
+                    Notes.chat_id == chat_id))
+            finally:
+                SESSION.close()
+        return names
+
+
+def __index_add(chat_id, note_name):
+    names = NOTE_NAMES.get(str(chat_id))
+    if names is not None:
+        idx = bisect.bisect_left(names, note_name)
+        if idx == len(names) or names[idx] != note_name:
+            names.insert(idx, note_name)
+
+
+def __index_remove(chat_id, note_name):
+    names = NOTE_NAMES.get(str(chat_id))
+    if names is not None:
+        idx = bisect.bisect_left(names, note_name)
+        if idx < len(names) and names[idx] == note_name:
+            del names[idx]
+
+
+def __invalidate_note(chat_id, note_name):
+    with CACHE_LOCK:
+        NOTE_CACHE.pop((str(chat_id), note_name), None)
+
+
+def __invalidate_chat(chat_id):
+    with CACHE_LOCK:
+        for key in [key for key in NOTE_CACHE if key[0] == str(chat_id)]:
+            del NOTE_CACHE[key]
 
 
 def add_note_to_db(chat_id, note_name, note_data, is_reply=False, buttons=None):
@@ -67,15 +120,40 @@ def add_note_to_db(chat_id, note_name, note_data, is_reply=False, buttons=None):
         SESSION.add(note)
         SESSION.commit()
 
-    for b_name, url, same_line in buttons:
-        add_note_button_to_db(chat_id, note_name, b_name, url, same_line)
+        for b_name, url, same_line in buttons:
+            add_note_button_to_db(chat_id, note_name, b_name, url, same_line)
+
+        __invalidate_note(chat_id, note_name)
+        __index_add(chat_id, note_name)
 
 
 def get_note(chat_id, note_name):
-    try:
-        return SESSION.query(Notes).get((str(chat_id), note_name))
-    finally:
-        SESSION.close()
+    key = (str(chat_id), note_name)
+    with CACHE_LOCK:
+        if key in NOTE_CACHE:
+            NOTE_CACHE.move_to_end(key)
+            return NOTE_CACHE[key]
+
+    # load under the insertion lock, so a concurrent save can't be cached over with the old note
+    with NOTES_INSERTION_LOCK:
+        try:
+            note = SESSION.query(Notes).get(key)
+            if note:
+                buttons = ()
+                if note.has_buttons:
+                    buttons = tuple(Button(btn.name, btn.url, btn.same_line) for btn in
+                                    SESSION.query(Buttons).filter(Buttons.chat_id == key[0],
+                                                                  Buttons.note_name == note_name).order_by(Buttons.id))
+                note = CachedNote(note.name, note.value, note.is_reply, note.has_buttons, buttons)
+        finally:
+            SESSION.close()
+
+        with CACHE_LOCK:
+            NOTE_CACHE[key] = note
+            if len(NOTE_CACHE) > NOTE_CACHE_SIZE:
+                NOTE_CACHE.popitem(last=False)
+
+    return note
 
 
 def rm_note(chat_id, note_name):
@@ -90,6 +168,8 @@ def rm_note(chat_id, note_name):
 
             SESSION.delete(note)
             SESSION.commit()
+            __invalidate_note(chat_id, note_name)
+            __index_remove(chat_id, note_name)
             return True
 
         else:
@@ -104,6 +184,49 @@ def get_all_chat_notes(chat_id):
         SESSION.close()
 
 
+def get_note_names(chat_id):
+    """Sorted names of all the chat's notes, without loading their contents."""
+    return list(__load_note_names(str(chat_id)))
+
+
+def find_notes_by_prefix(chat_id, prefix, limit=None):
+    """
+    Find notes whose name starts with the given prefix.
+
+    :param chat_id: chat to search
+    :param prefix: start of the note names
+    :param limit: max amount of names to return
+    :return: sorted list of matching note names
+    """
+    with NOTES_INSERTION_LOCK:
+        names = __load_note_names(str(chat_id))
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + "\U0010ffff") if prefix else len(names)
+        if limit is not None:
+            end = min(end, start + limit)
+        return names[start:end]
+
+
+def suggest_notes(chat_id, note_name, limit=3, cutoff=0.75):
+    """
+    Suggest existing notes for a name that doesn't exist: notes starting with it first, then similarly spelt ones.
+
+    :param chat_id: chat to search
+    :param note_name: the name that wasn't found
+    :param limit: max amount of suggestions
+    :param cutoff: how similar (0 to 1) a name has to be to be suggested
+    :return: list of note names
+    """
+    suggestions = find_notes_by_prefix(chat_id, note_name, limit) if note_name else []
+    if len(suggestions) < limit:
+        with NOTES_INSERTION_LOCK:
+            names = list(__load_note_names(str(chat_id)))
+        for name in difflib.get_close_matches(note_name, names, n=limit, cutoff=cutoff):
+            if name not in suggestions and len(suggestions) < limit:
+                suggestions.append(name)
+    return suggestions
+
+
 def add_note_button_to_db(chat_id, note_name, b_name, url, same_line):
     with BUTTONS_INSERTION_LOCK:
         button = Buttons(chat_id, note_name, b_name, url, same_line)
@@ -112,6 +235,10 @@ def add_note_button_to_db(chat_id, note_name, b_name, url, same_line):
 
 
 def get_buttons(chat_id, note_name):
+    note = get_note(chat_id, note_name)
+    if note is not None:
+        return list(note.buttons)
+
     try:
         return SESSION.query(Buttons).filter(Buttons.chat_id == str(chat_id), Buttons.note_name == note_name).order_by(
             Buttons.id).all()
@@ -145,3 +272,7 @@ def migrate_chat(old_chat_id, new_chat_id):
                 btn.chat_id = str(new_chat_id)
 
         SESSION.commit()
+        __invalidate_chat(old_chat_id)
+        __invalidate_chat(new_chat_id)
+        NOTE_NAMES.pop(str(old_chat_id), None)
+        NOTE_NAMES.pop(str(new_chat_id), None)
@@ -3,7 +3,7 @@ from typing import Union
 
 from sqlalchemy import Column, Integer, String, Boolean
 
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql import BASE, session_scope, bump_chat_version
 
 
 class ReportingUserSettings(BASE):
@@ -38,51 +38,43 @@ USER_LOCK = threading.RLock()
 
 
 def chat_should_report(chat_id: Union[str, int]) -> bool:
-    try:
-        chat_setting = SESSION.query(ReportingChatSettings).get(str(chat_id))
-        if chat_setting:
-            return chat_setting.should_report
-        return False
-    finally:
-        SESSION.close()
+    with session_scope() as session:
+        chat_setting = session.query(ReportingChatSettings).get(str(chat_id))
+        return chat_setting.should_report if chat_setting else False
 
 
 def user_should_report(user_id: int) -> bool:
-    try:
-        user_setting = SESSION.query(ReportingUserSettings).get(user_id)
-        if user_setting:
-            return user_setting.should_report
-        return True
-    finally:
-        SESSION.close()
+    with session_scope() as session:
+        user_setting = session.query(ReportingUserSettings).get(user_id)
+        return user_setting.should_report if user_setting else True
 
 
 def set_chat_setting(chat_id: Union[int, str], setting: bool):
-    with CHAT_LOCK:
-        chat_setting = SESSION.query(ReportingChatSettings).get(str(chat_id))
+    with CHAT_LOCK, session_scope() as session:
+        chat_setting = session.query(ReportingChatSettings).get(str(chat_id))
         if not chat_setting:
             chat_setting = ReportingChatSettings(chat_id)
 
         chat_setting.should_report = setting
-        SESSION.add(chat_setting)
-        SESSION.commit()
+        session.add(chat_setting)
+    bump_chat_version(chat_id)
 
 
 def set_user_setting(user_id: int, setting: bool):
-    with USER_LOCK:
-        user_setting = SESSION.query(ReportingUserSettings).get(user_id)
+    with USER_LOCK, session_scope() as session:
+        user_setting = session.query(ReportingUserSettings).get(user_id)
         if not user_setting:
             user_setting = ReportingUserSettings(user_id)
 
         user_setting.should_report = setting
-        SESSION.add(user_setting)
-        SESSION.commit()
+        session.add(user_setting)
 
 
 def migrate_chat(old_chat_id, new_chat_id):
-    with CHAT_LOCK:
-        chat_notes = SESSION.query(ReportingChatSettings).filter(
+    with CHAT_LOCK, session_scope() as session:
+        chat_notes = session.query(ReportingChatSettings).filter(
             ReportingChatSettings.chat_id == str(old_chat_id)).all()
         for note in chat_notes:
             note.chat_id = str(new_chat_id)
-        SESSION.commit()
+    bump_chat_version(old_chat_id)
+    bump_chat_version(new_chat_id)
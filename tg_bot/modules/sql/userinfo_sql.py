@@ -2,7 +2,7 @@ import threading
 
 from sqlalchemy import Column, Integer, UnicodeText
 
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql import BASE, session_scope
 
 
 class UserInfo(BASE):
@@ -38,39 +38,33 @@ INSERTION_LOCK = threading.RLock()
 
 
 def get_user_me_info(user_id):
-    userinfo = SESSION.query(UserInfo).get(user_id)
-    SESSION.close()
-    if userinfo:
-        return userinfo.info
-    return None
+    with session_scope() as session:
+        userinfo = session.query(UserInfo).get(user_id)
+        return userinfo.info if userinfo else None
 
 
 def set_user_me_info(user_id, info):
-    with INSERTION_LOCK:
-        userinfo = SESSION.query(UserInfo).get(user_id)
+    with INSERTION_LOCK, session_scope() as session:
+        userinfo = session.query(UserInfo).get(user_id)
         if userinfo:
             userinfo.info = info
         else:
             userinfo = UserInfo(user_id, info)
-        SESSION.add(userinfo)
-        SESSION.commit()
+        session.add(userinfo)
 
 
 def get_user_bio(user_id):
-    userbio = SESSION.query(UserBio).get(user_id)
-    SESSION.close()
-    if userbio:
-        return userbio.bio
-    return None
+    with session_scope() as session:
+        userbio = session.query(UserBio).get(user_id)
+        return userbio.bio if userbio else None
 
 
 def set_user_bio(user_id, bio):
-    with INSERTION_LOCK:
-        userbio = SESSION.query(UserBio).get(user_id)
+    with INSERTION_LOCK, session_scope() as session:
+        userbio = session.query(UserBio).get(user_id)
         if userbio:
             userbio.bio = bio
         else:
             userbio = UserBio(user_id, bio)
 
-        SESSION.add(userbio)
-        SESSION.commit()
+        session.add(userbio)
@@ -1,8 +1,10 @@
+import atexit
 import threading
+from collections import OrderedDict
 
 from sqlalchemy import Column, Integer, UnicodeText, String, ForeignKey, UniqueConstraint, func
 
-from tg_bot import dispatcher
+from tg_bot import dispatcher, LOGGER
 from tg_bot.modules.sql import BASE, SESSION
 
 
@@ -63,6 +65,22 @@ ChatMembers.__table__.create(checkfirst=True)
 
 INSERTION_LOCK = threading.RLock()
 
+# Write-behind buffer for update_user, which runs on every group message.
+# SEEN_MEMBERS remembers the last (username, chat_name) written for each (user_id, chat_id) pair - and, as usernames
+# are global, the last username under (user_id, None) - so unchanged users never touch the database; changed rows
+# are buffered in PENDING_UPDATES and written in a single transaction once FLUSH_THRESHOLD is reached, or every
+# FLUSH_INTERVAL seconds. FLUSH_LOCK is held from taking the buffer until it is committed, so a reader flushing
+# first always waits for rows already on their way to the database.
+FLUSH_INTERVAL = 5
+FLUSH_THRESHOLD = 200
+SEEN_CACHE_SIZE = 100000
+
+BUFFER_LOCK = threading.Lock()
+FLUSH_LOCK = threading.Lock()
+FLUSH_STOP = threading.Event()
+SEEN_MEMBERS = OrderedDict()
+PENDING_UPDATES = {}
+
 
 def ensure_bot_in_db():
     with INSERTION_LOCK:
@@ -72,38 +90,106 @@ def ensure_bot_in_db():
 
 
 def update_user(user_id, username, chat_id=None, chat_name=None):
-    with INSERTION_LOCK:
-        user = SESSION.query(Users).get(user_id)
-        if not user:
-            user = Users(user_id, username)
-            SESSION.add(user)
-            SESSION.flush()
-        else:
-            user.username = username
-
-        if not chat_id or not chat_name:
-            SESSION.commit()
-            return
-
-        chat = SESSION.query(Chats).get(str(chat_id))
-        if not chat:
-            chat = Chats(str(chat_id), chat_name)
-            SESSION.add(chat)
-            SESSION.flush()
-
-        else:
-            chat.chat_name = chat_name
-
-        member = SESSION.query(ChatMembers).filter(ChatMembers.chat == chat.chat_id,
-                                                   ChatMembers.user == user.user_id).first()
-        if not member:
-            chat_member = ChatMembers(chat.chat_id, user.user_id)
-            SESSION.add(chat_member)
-
-        SESSION.commit()
+    updates = [((user_id, None), (username, None))]
+    if chat_id and chat_name:
+        updates.append(((user_id, str(chat_id)), (username, chat_name)))
+
+    with BUFFER_LOCK:
+        for key, value in updates:
+            # Nothing changed since we last saw this user (in this chat); skip the database entirely.
+            if SEEN_MEMBERS.get(key) == value:
+                SEEN_MEMBERS.move_to_end(key)
+                continue
+
+            SEEN_MEMBERS[key] = value
+            if len(SEEN_MEMBERS) > SEEN_CACHE_SIZE:
+                SEEN_MEMBERS.popitem(last=False)
+
+            PENDING_UPDATES[key] = value
+        should_flush = len(PENDING_UPDATES) >= FLUSH_THRESHOLD
+
+    if should_flush:
+        flush_user_updates()
+
+
+def flush_user_updates():
+    with FLUSH_LOCK:
+        with BUFFER_LOCK:
+            if not PENDING_UPDATES:
+                return
+            pending = PENDING_UPDATES.copy()
+            PENDING_UPDATES.clear()
+
+        users = {}
+        chats = {}
+        members = set()
+        for (user_id, chat_id), (username, chat_name) in pending.items():
+            if chat_id:
+                users.setdefault(user_id, username)  # the (user_id, None) entry has the latest username
+                chats[chat_id] = chat_name
+                members.add((chat_id, user_id))
+            else:
+                users[user_id] = username
+
+        with INSERTION_LOCK:
+            try:
+                known_users = set()
+                for user in SESSION.query(Users).filter(Users.user_id.in_(list(users))).all():
+                    user.username = users[user.user_id]
+                    known_users.add(user.user_id)
+
+                for user_id, username in users.items():
+                    if user_id not in known_users:
+                        SESSION.add(Users(user_id, username))
+
+                if chats:
+                    known_chats = set()
+                    for chat in SESSION.query(Chats).filter(Chats.chat_id.in_(list(chats))).all():
+                        chat.chat_name = chats[chat.chat_id]
+                        known_chats.add(chat.chat_id)
+
+                    for chat_id, chat_name in chats.items():
+                        if chat_id not in known_chats:
+                            SESSION.add(Chats(chat_id, chat_name))
+
+                    SESSION.flush()
+
+                    known_members = set(SESSION.query(ChatMembers.chat, ChatMembers.user).filter(
+                        ChatMembers.chat.in_(list(chats)),
+                        ChatMembers.user.in_(list(users))))
+                    for chat_id, user_id in members - known_members:
+                        SESSION.add(ChatMembers(chat_id, user_id))
+
+                SESSION.commit()
+
+            except Exception:
+                SESSION.rollback()
+                LOGGER.exception("Could not flush %s buffered user updates", len(pending))
+                # Forget these so the next message from the same users is written again.
+                with BUFFER_LOCK:
+                    for key in pending:
+                        SEEN_MEMBERS.pop(key, None)
+
+            finally:
+                SESSION.close()
+
+
+def __flush_periodically():
+    while not FLUSH_STOP.wait(FLUSH_INTERVAL):
+        try:
+            flush_user_updates()
+        except Exception:
+            LOGGER.exception("Error in user update flush thread")
+
+
+def __start_flush_thread():
+    flush_thread = threading.Thread(target=__flush_periodically, name="users_sql_flush", daemon=True)
+    flush_thread.start()
+    atexit.register(flush_user_updates)
 
 
 def get_userid_by_name(username):
+    flush_user_updates()
     try:
         return SESSION.query(Users).filter(func.lower(Users.username) == username.lower()).all()
     finally:
@@ -118,6 +204,7 @@ def get_name_by_userid(user_id):
 
 
 def get_chat_members(chat_id):
+    flush_user_updates()
     try:
         return SESSION.query(ChatMembers).filter(ChatMembers.chat == str(chat_id)).all()
     finally:
@@ -125,13 +212,41 @@ def get_chat_members(chat_id):
 
 
 def get_all_chats():
+    flush_user_updates()
     try:
         return SESSION.query(Chats).all()
     finally:
         SESSION.close()
 
 
+def get_chats_after(last_chat_id, limit):
+    """Page through all chats in chat_id order, starting after last_chat_id (or from the start if None)."""
+    flush_user_updates()
+    try:
+        query = SESSION.query(Chats)
+        if last_chat_id is not None:
+            query = query.filter(Chats.chat_id > str(last_chat_id))
+        return query.order_by(Chats.chat_id).limit(limit).all()
+    finally:
+        SESSION.close()
+
+
+def rem_chat(chat_id):
+    flush_user_updates()
+    with BUFFER_LOCK:
+        for key in [key for key in SEEN_MEMBERS if key[1] == str(chat_id)]:
+            del SEEN_MEMBERS[key]
+
+    with INSERTION_LOCK:
+        SESSION.query(ChatMembers).filter(ChatMembers.chat == str(chat_id)).delete(synchronize_session=False)
+        chat = SESSION.query(Chats).get(str(chat_id))
+        if chat:
+            SESSION.delete(chat)
+        SESSION.commit()
+
+
 def get_user_num_chats(user_id):
+    flush_user_updates()
     try:
         return SESSION.query(ChatMembers).filter(ChatMembers.user == int(user_id)).count()
     finally:
@@ -139,6 +254,7 @@ def get_user_num_chats(user_id):
 
 
 def num_chats():
+    flush_user_updates()
     try:
         return SESSION.query(Chats).count()
     finally:
@@ -146,6 +262,7 @@ def num_chats():
 
 
 def num_users():
+    flush_user_updates()
     try:
         return SESSION.query(Users).count()
     finally:
@@ -153,6 +270,11 @@ def num_users():
 
 
 def migrate_chat(old_chat_id, new_chat_id):
+    flush_user_updates()
+    with BUFFER_LOCK:
+        for key in [key for key in SEEN_MEMBERS if key[1] == str(old_chat_id)]:
+            del SEEN_MEMBERS[key]
+
     with INSERTION_LOCK:
         chat = SESSION.query(Chats).get(str(old_chat_id))
         if chat:
@@ -170,3 +292,4 @@ def migrate_chat(old_chat_id, new_chat_id):
 
 
 ensure_bot_in_db()
+__start_flush_thread()
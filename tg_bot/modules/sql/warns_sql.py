@@ -1,9 +1,11 @@
 import threading
+from collections import namedtuple
 
 from sqlalchemy import Integer, Column, String, UnicodeText, func, distinct, Boolean
 from sqlalchemy.dialects import postgresql
 
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.helper_funcs.keyword_matcher import KeywordMatcher
+from tg_bot.modules.sql import SESSION, BASE, session_scope
 
 
 class Warns(BASE):
@@ -64,11 +66,33 @@ WarnFilters.__table__.create(checkfirst=True)
 WarnSettings.__table__.create(checkfirst=True)
 
 WARN_INSERTION_LOCK = threading.RLock()
+# postgres can count a warn in one atomic statement; other databases fall back to a locked read-modify-write
+ATOMIC_WARNS = BASE.metadata.bind.dialect.name == "postgresql"
 WARN_FILTER_INSERTION_LOCK = threading.RLock()
 WARN_SETTINGS_LOCK = threading.RLock()
 
+WarnFilterIndex = namedtuple("WarnFilterIndex", ["matcher", "replies"])
+CHAT_WARN_FILTERS = {}  # chat_id -> WarnFilterIndex, built lazily on first use
+WARN_SETTINGS = {}  # chat_id -> (warn_limit, soft_warn)
+
 
 def warn_user(user_id, chat_id, reason=None):
+    if not ATOMIC_WARNS:
+        return __warn_user_locked(user_id, chat_id, reason)
+
+    stmt = postgresql.insert(Warns.__table__).values(user_id=user_id, chat_id=str(chat_id), num_warns=1,
+                                                     reasons=[reason] if reason else [])
+    updated_reasons = func.array_append(Warns.reasons, reason) if reason else Warns.reasons
+    stmt = stmt.on_conflict_do_update(index_elements=[Warns.user_id, Warns.chat_id],
+                                      set_={"num_warns": func.coalesce(Warns.num_warns, 0) + 1,
+                                            "reasons": updated_reasons}
+                                      ).returning(Warns.num_warns, Warns.reasons)
+    with session_scope() as session:
+        num, reasons = session.execute(stmt).first()
+    return num, reasons or []
+
+
+def __warn_user_locked(user_id, chat_id, reason=None):
     with WARN_INSERTION_LOCK:
         warned_user = SESSION.query(Warns).get((user_id, str(chat_id)))
         if not warned_user:
@@ -87,32 +111,19 @@ def warn_user(user_id, chat_id, reason=None):
         return num, reasons
 
 
+# single conditional UPDATEs - atomic on every database, so no lock needed
 def remove_warn(user_id, chat_id):
-    with WARN_INSERTION_LOCK:
-        removed = False
-        warned_user = SESSION.query(Warns).get((user_id, str(chat_id)))
-
-        if warned_user and warned_user.num_warns > 0:
-            warned_user.num_warns -= 1
-
-            SESSION.add(warned_user)
-            SESSION.commit()
-            removed = True
-
-        SESSION.close()
-        return removed
+    with session_scope() as session:
+        removed = session.query(Warns).filter(Warns.user_id == user_id, Warns.chat_id == str(chat_id),
+                                              Warns.num_warns > 0).update(
+            {Warns.num_warns: Warns.num_warns - 1}, synchronize_session=False)
+    return bool(removed)
 
 
 def reset_warns(user_id, chat_id):
-    with WARN_INSERTION_LOCK:
-        warned_user = SESSION.query(Warns).get((user_id, str(chat_id)))
-        if warned_user:
-            warned_user.num_warns = 0
-            warned_user.reasons = []
-
-            SESSION.add(warned_user)
-            SESSION.commit()
-        SESSION.close()
+    with session_scope() as session:
+        session.query(Warns).filter(Warns.user_id == user_id, Warns.chat_id == str(chat_id)).update(
+            {Warns.num_warns: 0, Warns.reasons: []}, synchronize_session=False)
 
 
 def get_warns(user_id, chat_id):
@@ -133,6 +144,7 @@ def add_warn_filter(chat_id, keyword, reply):
 
         SESSION.merge(warn_filt)  # merge to avoid duplicate key issues
         SESSION.commit()
+        CHAT_WARN_FILTERS.pop(str(chat_id), None)
 
 
 def remove_warn_filter(chat_id, keyword):
@@ -141,6 +153,7 @@ def remove_warn_filter(chat_id, keyword):
         if warn_filt:
             SESSION.delete(warn_filt)
             SESSION.commit()
+            CHAT_WARN_FILTERS.pop(str(chat_id), None)
             return True
         SESSION.close()
         return False
@@ -153,6 +166,40 @@ def get_chat_warn_filters(chat_id):
         SESSION.close()
 
 
+def get_chat_warn_filter_index(chat_id):
+    index = CHAT_WARN_FILTERS.get(str(chat_id))
+    if index is not None:
+        return index
+
+    # built under the insertion lock so a concurrent add/rm can't be overwritten by a stale index
+    with WARN_FILTER_INSERTION_LOCK:
+        index = CHAT_WARN_FILTERS.get(str(chat_id))
+        if index is None:
+            try:
+                rows = SESSION.query(WarnFilters.keyword, WarnFilters.reply).filter(
+                    WarnFilters.chat_id == str(chat_id)).all()
+            finally:
+                SESSION.close()
+            replies = {keyword.lower(): reply for keyword, reply in rows}
+            index = CHAT_WARN_FILTERS[str(chat_id)] = WarnFilterIndex(KeywordMatcher(replies), replies)
+        return index
+
+
+def match_warn_filter(chat_id, text):
+    """
+    Find the warn filter triggered by a text.
+
+    :param chat_id: chat the text was sent in
+    :param text: text to check
+    :return: (keyword, reply) of the first filter found in the text, or None
+    """
+    index = get_chat_warn_filter_index(chat_id)
+    keyword = index.matcher.search(text)
+    if keyword is None:
+        return None
+    return keyword, index.replies[keyword]
+
+
 def set_warn_limit(chat_id, warn_limit):
     with WARN_SETTINGS_LOCK:
         curr_setting = SESSION.query(WarnSettings).get(str(chat_id))
@@ -163,6 +210,7 @@ def set_warn_limit(chat_id, warn_limit):
 
         SESSION.add(curr_setting)
         SESSION.commit()
+        WARN_SETTINGS.pop(str(chat_id), None)
 
 
 def set_warn_strength(chat_id, soft_warn):
@@ -175,18 +223,26 @@ def set_warn_strength(chat_id, soft_warn):
 
         SESSION.add(curr_setting)
         SESSION.commit()
+        WARN_SETTINGS.pop(str(chat_id), None)
 
 
 def get_warn_setting(chat_id):
-    try:
-        setting = SESSION.query(WarnSettings).get(str(chat_id))
-        if setting:
-            return setting.warn_limit, setting.soft_warn
-        else:
-            return 3, False
+    setting = WARN_SETTINGS.get(str(chat_id))
+    if setting is not None:
+        return setting
 
-    finally:
-        SESSION.close()
+    with WARN_SETTINGS_LOCK:
+        try:
+            curr_setting = SESSION.query(WarnSettings).get(str(chat_id))
+            if curr_setting:
+                setting = curr_setting.warn_limit, curr_setting.soft_warn
+            else:
+                setting = 3, False
+        finally:
+            SESSION.close()
+
+        WARN_SETTINGS[str(chat_id)] = setting
+        return setting
 
 
 def num_warns():
@@ -236,9 +292,13 @@ def migrate_chat(old_chat_id, new_chat_id):
         for filt in chat_filters:
             filt.chat_id = str(new_chat_id)
         SESSION.commit()
+        CHAT_WARN_FILTERS.pop(str(old_chat_id), None)
+        CHAT_WARN_FILTERS.pop(str(new_chat_id), None)
 
     with WARN_SETTINGS_LOCK:
         chat_settings = SESSION.query(WarnSettings).filter(WarnSettings.chat_id == str(old_chat_id)).all()
         for setting in chat_settings:
             setting.chat_id = str(new_chat_id)
         SESSION.commit()
+        WARN_SETTINGS.pop(str(old_chat_id), None)
+        WARN_SETTINGS.pop(str(new_chat_id), None)
@@ -1,4 +1,5 @@
 import threading
+from collections import namedtuple
 from enum import IntEnum, unique
 
 from sqlalchemy import Column, String, Boolean, UnicodeText, Integer, BigInteger
@@ -83,24 +84,60 @@ WELC_BTN_LOCK = threading.RLock()
 LEAVE_BTN_LOCK = threading.RLock()
 
 
+# immutable per chat snapshot of everything needed to greet someone, so a join costs no queries once cached.
+# clean_welcome is tracked separately as it changes on every welcome sent.
+WelcomeSettings = namedtuple("WelcomeSettings", ["should_welcome", "custom_welcome", "welcome_type", "welcome_buttons",
+                                                 "should_goodbye", "custom_leave", "leave_type", "goodbye_buttons"])
+Button = namedtuple("Button", ["name", "url", "same_line"])
+
+WELCOME_SETTINGS = {}  # chat_id -> WelcomeSettings
+CLEAN_WELCOME = {}  # chat_id -> id of the last welcome message, or False
+
+
+def __invalidate(chat_id):
+    WELCOME_SETTINGS.pop(str(chat_id), None)
+    CLEAN_WELCOME.pop(str(chat_id), None)
+
+
+def get_welcome_settings(chat_id) -> WelcomeSettings:
+    chat_id = str(chat_id)
+    settings = WELCOME_SETTINGS.get(chat_id)
+    if settings is not None:
+        return settings
+
+    with INSERTION_LOCK:
+        try:
+            welc = SESSION.query(Welcome).get(chat_id)
+            welc_buttons = tuple(Button(btn.name, btn.url, btn.same_line) for btn in
+                                 SESSION.query(WelcomeButtons).filter(WelcomeButtons.chat_id == chat_id).order_by(
+                                     WelcomeButtons.id))
+            gdbye_buttons = tuple(Button(btn.name, btn.url, btn.same_line) for btn in
+                                  SESSION.query(GoodbyeButtons).filter(GoodbyeButtons.chat_id == chat_id).order_by(
+                                      GoodbyeButtons.id))
+            if welc:
+                settings = WelcomeSettings(welc.should_welcome, welc.custom_welcome, welc.welcome_type, welc_buttons,
+                                           welc.should_goodbye, welc.custom_leave, welc.leave_type, gdbye_buttons)
+                CLEAN_WELCOME[chat_id] = welc.clean_welcome
+            else:
+                # Welcome by default.
+                settings = WelcomeSettings(True, DEFAULT_WELCOME, Types.TEXT, welc_buttons,
+                                           True, DEFAULT_GOODBYE, Types.TEXT, gdbye_buttons)
+                CLEAN_WELCOME[chat_id] = False
+        finally:
+            SESSION.close()
+
+        WELCOME_SETTINGS[chat_id] = settings
+        return settings
+
+
 def get_welc_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-    if welc:
-        return welc.should_welcome, welc.custom_welcome, welc.welcome_type
-    else:
-        # Welcome by default.
-        return True, DEFAULT_WELCOME, Types.TEXT
+    settings = get_welcome_settings(chat_id)
+    return settings.should_welcome, settings.custom_welcome, settings.welcome_type
 
 
 def get_gdbye_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-    if welc:
-        return welc.should_goodbye, welc.custom_leave, welc.leave_type
-    else:
-        # Welcome by default.
-        return True, DEFAULT_GOODBYE, Types.TEXT
+    settings = get_welcome_settings(chat_id)
+    return settings.should_goodbye, settings.custom_leave, settings.leave_type
 
 
 def set_clean_welcome(chat_id, clean_welcome):
@@ -113,16 +150,15 @@ def set_clean_welcome(chat_id, clean_welcome):
 
         SESSION.add(curr)
         SESSION.commit()
+        if str(chat_id) in WELCOME_SETTINGS:
+            CLEAN_WELCOME[str(chat_id)] = int(clean_welcome)
+        else:
+            __invalidate(chat_id)
 
 
 def get_clean_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-
-    if welc:
-        return welc.clean_welcome
-
-    return False
+    get_welcome_settings(chat_id)
+    return CLEAN_WELCOME.get(str(chat_id), False)
 
 
 def set_welc_preference(chat_id, should_welcome):
@@ -135,6 +171,7 @@ def set_welc_preference(chat_id, should_welcome):
 
         SESSION.add(curr)
         SESSION.commit()
+        __invalidate(chat_id)
 
 
 def set_gdbye_preference(chat_id, should_goodbye):
@@ -147,6 +184,7 @@ def set_gdbye_preference(chat_id, should_goodbye):
 
         SESSION.add(curr)
         SESSION.commit()
+        __invalidate(chat_id)
 
 
 def set_custom_welcome(chat_id, custom_welcome, welcome_type, buttons=None):
@@ -178,6 +216,7 @@ def set_custom_welcome(chat_id, custom_welcome, welcome_type, buttons=None):
                 SESSION.add(button)
 
         SESSION.commit()
+        __invalidate(chat_id)
 
 
 def get_custom_welcome(chat_id):
@@ -219,6 +258,7 @@ def set_custom_gdbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
                 SESSION.add(button)
 
         SESSION.commit()
+        __invalidate(chat_id)
 
 
 def get_custom_gdbye(chat_id):
@@ -232,19 +272,11 @@ def get_custom_gdbye(chat_id):
 
 
 def get_welc_buttons(chat_id):
-    try:
-        return SESSION.query(WelcomeButtons).filter(WelcomeButtons.chat_id == str(chat_id)).order_by(
-            WelcomeButtons.id).all()
-    finally:
-        SESSION.close()
+    return list(get_welcome_settings(chat_id).welcome_buttons)
 
 
 def get_gdbye_buttons(chat_id):
-    try:
-        return SESSION.query(GoodbyeButtons).filter(GoodbyeButtons.chat_id == str(chat_id)).order_by(
-            GoodbyeButtons.id).all()
-    finally:
-        SESSION.close()
+    return list(get_welcome_settings(chat_id).goodbye_buttons)
 
 
 def migrate_chat(old_chat_id, new_chat_id):
@@ -264,3 +296,5 @@ def migrate_chat(old_chat_id, new_chat_id):
                 btn.chat_id = str(new_chat_id)
 
         SESSION.commit()
+        __invalidate(old_chat_id)
+        __invalidate(new_chat_id)
@@ -1,19 +1,33 @@
+import threading
+from collections import OrderedDict
 from io import BytesIO
-from time import sleep
-from typing import Optional
+from typing import Callable, Optional, Tuple
 
-from telegram import TelegramError, Chat, Message
+from telegram import TelegramError, Chat, Message, User
 from telegram import Update, Bot
 from telegram.error import BadRequest
 from telegram.ext import MessageHandler, Filters, CommandHandler
 from telegram.ext.dispatcher import run_async
 
+import tg_bot.modules.sql.broadcast_sql as broadcast_sql
 import tg_bot.modules.sql.users_sql as sql
 from tg_bot import dispatcher, OWNER_ID, LOGGER
+from tg_bot.modules.helper_funcs.bulk_jobs import BulkJob, get_chat_limiter, is_chat_gone
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 
 USERS_GROUP = 4
 
+BROADCAST_CHUNK = 200  # chats per checkpoint; at most this many may get the message twice after a crash
+BROADCAST_WORKERS = 4
+
+ACTIVE_BROADCAST = None  # type: Optional[BulkJob]
+ACTIVE_BROADCAST_LOCK = threading.Lock()
+
+USERNAME_CACHE_SIZE = 10000
+# lowercase username -> (user_id, first_name), least recently used first; either may be None while unknown
+USERNAMES = OrderedDict()
+USERNAMES_LOCK = threading.Lock()
+
 
 def get_user_id(username):
     # ensure valid userid
@@ -47,22 +61,186 @@ def get_user_id(username):
     return None
 
 
+def __username_key(username: str) -> str:
+    return username[1:].lower() if username.startswith('@') else username.lower()
+
+
+def __cache_username(key: str, entry: Tuple[Optional[int], Optional[str]]):
+    with USERNAMES_LOCK:
+        USERNAMES[key] = entry
+        USERNAMES.move_to_end(key)
+        if len(USERNAMES) > USERNAME_CACHE_SIZE:
+            USERNAMES.popitem(last=False)
+
+
+def remember_user(user: User):
+    if user and user.username:
+        __cache_username(user.username.lower(), (user.id, user.first_name))
+
+
+def resolve_username(username: str) -> Optional[Tuple[int, Optional[str]]]:
+    """
+    Find the user behind an @username, preferring users recently seen talking over the database. Never calls the
+    api for a name - see `get_first_name`.
+
+    :param username: the username, with or without the @
+    :return: (user_id, first_name or None if not known yet), or None if unknown
+    """
+    key = __username_key(username)
+    with USERNAMES_LOCK:
+        if key in USERNAMES:
+            USERNAMES.move_to_end(key)
+            entry = USERNAMES[key]
+            return entry if entry[0] else None
+
+    user_id = get_user_id(username)
+    # unknown usernames are remembered too, until the user is seen talking
+    __cache_username(key, (user_id, None))
+    return (user_id, None) if user_id else None
+
+
+def get_first_name(username: str, user_id: int) -> Optional[str]:
+    """
+    The first name of a user found through `resolve_username`, fetched from the api once and then cached.
+
+    :return: the first name, or None if telegram doesn't know the user
+    """
+    try:
+        first_name = dispatcher.bot.get_chat(user_id).first_name
+    except TelegramError:
+        return None
+
+    __cache_username(__username_key(username), (user_id, first_name))
+    return first_name
+
+
+def __broadcast_report(job: BulkJob, removed: int, finished: bool) -> str:
+    text = "Broadcast {}: sent to {} chats, {} failed.".format("complete" if finished else "stopped",
+                                                               job.succeeded, job.failed)
+    if removed:
+        text += "\nRemoved {} chats I'm no longer in.".format(removed)
+    for error, count in job.errors.most_common():
+        text += "\n - {}: {}".format(error, count)
+    if not finished:
+        text += "\nUse /resumebroadcast to carry on."
+    return text
+
+
+def __run_broadcast(bot: Bot, broadcast_id: int, status_msg: Message):
+    global ACTIVE_BROADCAST
+    state = broadcast_sql.get_broadcast(broadcast_id)
+    handled = set()
+    removed = []
+
+    def send(chat):
+        handled.add(chat.chat_id)
+        bot.send_message(int(chat.chat_id), state.message)
+
+    def on_error(chat, excp):
+        if is_chat_gone(excp):
+            sql.rem_chat(chat.chat_id)
+            removed.append(chat.chat_id)
+        else:
+            LOGGER.warning("Couldn't send broadcast to %s, group name %s: %s", str(chat.chat_id), str(chat.chat_name),
+                           excp.message)
+
+    job = ACTIVE_BROADCAST
+    job.action = send
+    job.on_error = on_error
+    job.succeeded = state.sent
+    job.failed = state.failed
+    job.errors.update(state.get_errors())
+
+    cursor = state.last_chat_id
+    done = set(state.get_done_chat_ids())  # chats past the cursor which a stopped chunk already got to
+    finished = False
+    try:
+        while not job.cancelled.is_set():
+            chats = sql.get_chats_after(cursor, BROADCAST_CHUNK)
+            if not chats:
+                finished = True
+                break
+
+            job.run([chat for chat in chats if chat.chat_id not in done])
+            done |= handled
+            handled.clear()
+            # the workers finish a chunk out of order: move the cursor past the chats handled so far, and remember
+            # the rest that were, so a stop halfway through a chunk resumes without sending to anyone twice
+            for chat in chats:
+                if chat.chat_id not in done:
+                    break
+                cursor = chat.chat_id
+                done.discard(chat.chat_id)
+            broadcast_sql.checkpoint(broadcast_id, cursor, done, job.succeeded, job.failed, dict(job.errors))
+
+            try:
+                status_msg.edit_text("Broadcasting... sent to {} chats, {} failed.".format(job.succeeded, job.failed))
+            except TelegramError:
+                pass
+
+        broadcast_sql.set_status(broadcast_id, "done" if finished else "stopped")
+        status_msg.reply_text(__broadcast_report(job, len(removed), finished))
+
+    except Exception:
+        LOGGER.exception("Broadcast %s crashed", broadcast_id)
+        status_msg.reply_text("Broadcast crashed - check the logs, then use /resumebroadcast.")
+
+    finally:
+        with ACTIVE_BROADCAST_LOCK:
+            ACTIVE_BROADCAST = None
+
+
+def __start_broadcast(bot: Bot, update: Update, get_broadcast_id: Callable[[], int], text: str) -> None:
+    """
+    :param get_broadcast_id: returns the stored broadcast to run; only called once no other broadcast is running, so
+        a new one isn't written down unless it actually starts
+    """
+    global ACTIVE_BROADCAST
+    with ACTIVE_BROADCAST_LOCK:
+        if ACTIVE_BROADCAST:
+            update.effective_message.reply_text("A broadcast is already running - use /stopbroadcast first.")
+            return
+
+        broadcast_id = get_broadcast_id()
+        ACTIVE_BROADCAST = BulkJob(None, workers=BROADCAST_WORKERS,
+                                   item_limiter=lambda chat: get_chat_limiter(chat.chat_id))
+
+    # runs in its own thread, as tying up a dispatcher worker for the whole broadcast would starve other updates
+    status_msg = update.effective_message.reply_text(text)
+    threading.Thread(target=__run_broadcast, args=(bot, broadcast_id, status_msg), daemon=True).start()
+
+
 @run_async
 def broadcast(bot: Bot, update: Update):
     to_send = update.effective_message.text.split(None, 1)
     if len(to_send) >= 2:
-        chats = sql.get_all_chats() or []
-        failed = 0
-        for chat in chats:
-            try:
-                bot.sendMessage(int(chat.chat_id), to_send[1])
-                sleep(0.1)
-            except TelegramError:
-                failed += 1
-                LOGGER.warning("Couldn't send broadcast to %s, group name %s", str(chat.chat_id), str(chat.chat_name))
+        if ACTIVE_BROADCAST:
+            update.effective_message.reply_text("A broadcast is already running - use /stopbroadcast first.")
+            return
+
+        __start_broadcast(bot, update, lambda: broadcast_sql.new_broadcast(to_send[1]), "Broadcast started.")
+
+
+@run_async
+def resume_broadcast(bot: Bot, update: Update):
+    unfinished = broadcast_sql.get_unfinished_broadcast()
+    if not unfinished:
+        update.effective_message.reply_text("There's no unfinished broadcast to resume.")
+        return
+
+    __start_broadcast(bot, update, lambda: unfinished.id,
+                      "Resuming broadcast {} ({} sent so far).".format(unfinished.id, unfinished.sent))
+
+
+@run_async
+def stop_broadcast(bot: Bot, update: Update):
+    job = ACTIVE_BROADCAST
+    if not job:
+        update.effective_message.reply_text("No broadcast is running.")
+        return
 
-        update.effective_message.reply_text("Broadcast complete. {} groups failed to receive the message, probably "
-                                            "due to being kicked.".format(failed))
+    job.cancel()
+    update.effective_message.reply_text("Stopping the broadcast, I'll report once the current messages are out.")
 
 
 @run_async
@@ -74,16 +252,19 @@ def log_user(bot: Bot, update: Update):
                     msg.from_user.username,
                     chat.id,
                     chat.title)
+    remember_user(msg.from_user)
 
     if msg.reply_to_message:
         sql.update_user(msg.reply_to_message.from_user.id,
                         msg.reply_to_message.from_user.username,
                         chat.id,
                         chat.title)
+        remember_user(msg.reply_to_message.from_user)
 
     if msg.forward_from:
         sql.update_user(msg.forward_from.id,
                         msg.forward_from.username)
+        remember_user(msg.forward_from)
 
 
 @run_async
@@ -119,9 +300,13 @@ __help__ = ""  # no help string
 __mod_name__ = "Kullanıcılar"
 
 BROADCAST_HANDLER = CommandHandler("broadcast", broadcast, filters=Filters.user(OWNER_ID))
+RESUME_BROADCAST_HANDLER = CommandHandler("resumebroadcast", resume_broadcast, filters=Filters.user(OWNER_ID))
+STOP_BROADCAST_HANDLER = CommandHandler("stopbroadcast", stop_broadcast, filters=Filters.user(OWNER_ID))
 USER_HANDLER = MessageHandler(Filters.all & Filters.group, log_user)
 CHATLIST_HANDLER = CommandHandler("chatlist", chats, filters=CustomFilters.sudo_filter)
 
 dispatcher.add_handler(USER_HANDLER, USERS_GROUP)
 dispatcher.add_handler(BROADCAST_HANDLER)
+dispatcher.add_handler(RESUME_BROADCAST_HANDLER)
+dispatcher.add_handler(STOP_BROADCAST_HANDLER)
 dispatcher.add_handler(CHATLIST_HANDLER)
@@ -13,7 +13,8 @@ from tg_bot import dispatcher, BAN_STICKER
 from tg_bot.modules.disable import DisableAbleCommandHandler
 from tg_bot.modules.helper_funcs.chat_status import is_user_admin, bot_admin, user_admin_no_reply, user_admin, \
     can_restrict
-from tg_bot.modules.helper_funcs.extraction import extract_text, extract_user_and_text, extract_user
+from tg_bot.modules.helper_funcs.extraction import extract_user_and_text, extract_user
+from tg_bot.modules.helper_funcs.message_context import get_message_context
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.helper_funcs.misc import split_message
 from tg_bot.modules.helper_funcs.string_handling import split_quotes
@@ -268,18 +269,17 @@ def list_warn_filters(bot: Bot, update: Update):
 @run_async
 @loggable
 def reply_filter(bot: Bot, update: Update) -> str:
-    chat_warn_filters = sql.get_chat_warn_filters(update.effective_chat.id)
     message = update.effective_message  # type: Optional[Message]
-    to_match = extract_text(message)
+    to_match = get_message_context(update).text
     if not to_match:
         return ""
 
-    for warn_filter in chat_warn_filters:
-        pattern = r"( |^|[^\w])" + re.escape(warn_filter.keyword) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            user = update.effective_user  # type: Optional[User]
-            chat = update.effective_chat  # type: Optional[Chat]
-            return warn(user, chat, warn_filter.reply, message)
+    # one pass over the text for all of the chat's filters, using the cached matcher
+    match = sql.match_warn_filter(update.effective_chat.id, to_match)
+    if match:
+        user = update.effective_user  # type: Optional[User]
+        chat = update.effective_chat  # type: Optional[Chat]
+        return warn(user, chat, match[1], message)
     return ""
 
 
@@ -1,14 +1,18 @@
 import html
+import threading
+import time
+from collections import namedtuple
+from string import Formatter
 from typing import Optional, List
 
 from telegram import Message, Chat, Update, Bot, User
-from telegram import ParseMode, InlineKeyboardMarkup
+from telegram import ParseMode, InlineKeyboardMarkup, MAX_MESSAGE_LENGTH
 from telegram.error import BadRequest
 from telegram.ext import MessageHandler, Filters, CommandHandler, run_async
 from telegram.utils.helpers import mention_markdown, mention_html, escape_markdown
 
 import tg_bot.modules.sql.welcome_sql as sql
-from tg_bot import dispatcher, OWNER_ID, LOGGER
+from tg_bot import dispatcher, OWNER_ID, LOGGER, WELCOME_BATCH_WINDOW
 from tg_bot.modules.helper_funcs.chat_status import user_admin
 from tg_bot.modules.helper_funcs.misc import build_keyboard, revert_buttons
 from tg_bot.modules.helper_funcs.string_handling import button_markdown_parser, markdown_parser, \
@@ -28,6 +32,112 @@ ENUM_FUNC_MAP = {
     sql.Types.VIDEO.value: dispatcher.bot.send_video
 }
 
+# a welcome/goodbye message compiled once per settings snapshot: curly brackets already escaped, the format fields
+# it uses, its keyboard and the function to send it with
+Template = namedtuple("Template", ["type", "content", "fields", "keyboard", "send_func"])
+
+TEMPLATES = {}  # (chat_id, goodbye) -> (WelcomeSettings it was built from, Template)
+
+MEMBER_COUNT_TTL = 60
+MEMBER_COUNTS = {}  # chat_id -> (expiry, member count)
+
+PENDING_JOINS = {}  # chat_id -> (latest join update, members waiting to be welcomed)
+# a batched welcome names at most this many members, then says how many more joined - a raid sized list of names
+# won't fit in one message
+WELCOME_NAMES_SHOWN = 20
+PENDING_JOINS_LOCK = threading.Lock()
+
+
+def get_template(chat_id, goodbye=False) -> Template:
+    settings = sql.get_welcome_settings(chat_id)
+    cached = TEMPLATES.get((chat_id, goodbye))
+    # the sql writers swap the settings snapshot out on any change, which makes the compiled template stale too
+    if cached and cached[0] is settings:
+        return cached[1]
+
+    if goodbye:
+        content, msg_type, buttons = settings.custom_leave, settings.leave_type, settings.goodbye_buttons
+    else:
+        content, msg_type, buttons = settings.custom_welcome, settings.welcome_type, settings.welcome_buttons
+
+    fields = frozenset()
+    if msg_type in (sql.Types.TEXT, sql.Types.BUTTON_TEXT) and content:
+        content = escape_invalid_curly_brackets(content, VALID_WELCOME_FORMATTERS)
+        fields = frozenset(field for _, field, _, _ in Formatter().parse(content) if field)
+
+    template = Template(msg_type, content, fields, InlineKeyboardMarkup(build_keyboard(buttons)),
+                        ENUM_FUNC_MAP[msg_type])
+    TEMPLATES[(chat_id, goodbye)] = (settings, template)
+    return template
+
+
+def get_member_count(chat: Chat, delta: int = 0) -> int:
+    """
+    Get a chat's member count, only asking telegram once every MEMBER_COUNT_TTL seconds.
+
+    :param chat: chat to count the members of
+    :param delta: members joined (or left, if negative) since the last call, applied to a cached count
+    :return: the member count
+    """
+    entry = MEMBER_COUNTS.get(chat.id)
+    if entry and entry[0] > time.monotonic():
+        count = entry[1] + delta
+        MEMBER_COUNTS[chat.id] = (entry[0], count)
+        return count
+
+    count = chat.get_members_count()
+    MEMBER_COUNTS[chat.id] = (time.monotonic() + MEMBER_COUNT_TTL, count)
+    return count
+
+
+def join_names(names: List[str], total: int) -> str:
+    """List the names shown, plus how many members were left out of a batched welcome."""
+    joined = ", ".join(names)
+    if total > len(names):
+        joined += " ve {} kişi daha".format(total - len(names))
+    return joined
+
+
+def format_template(template: Template, chat: Chat, users: List[User], count_delta: int,
+                    shown: int = WELCOME_NAMES_SHOWN) -> str:
+    """
+    Fill in a text template for one or more users; with several users, each field lists them.
+
+    :param template: the compiled template
+    :param chat: chat the users joined or left
+    :param users: users to greet
+    :param count_delta: members joined (or left) since the member count was last checked
+    :param shown: how many users to name at most; the rest are only counted
+    :return: the message text
+    """
+    first_names, last_names, fullnames, usernames, mentions = [], [], [], [], []
+    for user in users[:shown]:
+        first_name = user.first_name or "PersonWithNoName"  # edge case of empty name - occurs for some bugs.
+        if user.last_name:
+            fullname = "{} {}".format(first_name, user.last_name)
+        else:
+            fullname = first_name
+        mention = mention_markdown(user.id, first_name)
+        if user.username:
+            username = "@" + escape_markdown(user.username)
+        else:
+            username = mention
+
+        first_names.append(escape_markdown(first_name))
+        last_names.append(escape_markdown(user.last_name or first_name))
+        fullnames.append(escape_markdown(fullname))
+        usernames.append(username)
+        mentions.append(mention)
+
+    total = len(users)
+    # counting members is an API call; only make it for templates that show the count
+    count = get_member_count(chat, count_delta) if "count" in template.fields else None
+    return template.content.format(first=join_names(first_names, total), last=join_names(last_names, total),
+                                   fullname=join_names(fullnames, total), username=join_names(usernames, total),
+                                   mention=join_names(mentions, total), count=count,
+                                   chatname=escape_markdown(chat.title),
+                                   id=join_names([str(user.id) for user in users[:shown]], total))
+
 
 # do not async
 def send(update, message, keyboard, backup_message):
@@ -75,13 +185,79 @@ def send(update, message, keyboard, backup_message):
     return msg
 
 
+def clean_previous_welcome(bot: Bot, chat: Chat, sent: Optional[Message]):
+    prev_welc = sql.get_clean_pref(chat.id)
+    if prev_welc:
+        try:
+            bot.delete_message(chat.id, prev_welc)
+        except BadRequest as excp:
+            pass
+
+        if sent:
+            sql.set_clean_welcome(chat.id, sent.message_id)
+
+
+def welcome_members(bot: Bot, update: Update, members: List[User]):
+    """Greet the members in one message, and replace the previous welcome if clean welcome is on."""
+    chat = update.effective_chat  # type: Optional[Chat]
+    template = get_template(chat.id)
+
+    # If welcome message is media, send with appropriate function
+    if template.type != sql.Types.TEXT and template.type != sql.Types.BUTTON_TEXT:
+        template.send_func(chat.id, template.content)
+        return
+
+    first_names = join_names([new_mem.first_name or "PersonWithNoName" for new_mem in members[:WELCOME_NAMES_SHOWN]],
+                             len(members))
+    if template.content:
+        shown = WELCOME_NAMES_SHOWN
+        res = format_template(template, chat, members, len(members), shown)
+        # long names, or a template using several fields, can still overflow - name fewer members until it fits
+        while len(res) > MAX_MESSAGE_LENGTH and shown > 1:
+            shown //= 2
+            res = format_template(template, chat, members, 0, shown)
+        keyboard = template.keyboard
+    else:
+        res = sql.DEFAULT_WELCOME.format(first=first_names)
+        keyboard = InlineKeyboardMarkup([])
+
+    sent = send(update, res, keyboard, sql.DEFAULT_WELCOME.format(first=first_names))  # type: Optional[Message]
+    clean_previous_welcome(bot, chat, sent)
+
+
+def flush_joins(bot: Bot, chat_id):
+    with PENDING_JOINS_LOCK:
+        update, members = PENDING_JOINS.pop(chat_id)
+
+    try:
+        welcome_members(bot, update, members)
+    except Exception:
+        LOGGER.exception("Error while welcoming %s batched members in %s", len(members), chat_id)
+
+
+def queue_joins(bot: Bot, update: Update, members: List[User]):
+    chat_id = update.effective_chat.id
+    with PENDING_JOINS_LOCK:
+        pending = PENDING_JOINS.get(chat_id)
+        if pending:
+            # reply to the newest join; the timer already running will pick these members up
+            PENDING_JOINS[chat_id] = (update, pending[1] + members)
+            return
+
+        PENDING_JOINS[chat_id] = (update, list(members))
+
+    timer = threading.Timer(WELCOME_BATCH_WINDOW, flush_joins, args=(bot, chat_id))
+    timer.daemon = True
+    timer.start()
+
+
 @run_async
 def new_member(bot: Bot, update: Update):
     chat = update.effective_chat  # type: Optional[Chat]
 
-    should_welc, cust_welcome, welc_type = sql.get_welc_pref(chat.id)
+    should_welc, _, _ = sql.get_welc_pref(chat.id)
     if should_welc:
-        sent = None
+        members = []
         new_members = update.effective_message.new_chat_members
         for new_mem in new_members:
             # Give the owner a special welcome
@@ -93,57 +269,45 @@ def new_member(bot: Bot, update: Update):
             elif new_mem.id == bot.id:
                 continue
 
-            else:
-                # If welcome message is media, send with appropriate function
-                if welc_type != sql.Types.TEXT and welc_type != sql.Types.BUTTON_TEXT:
-                    ENUM_FUNC_MAP[welc_type](chat.id, cust_welcome)
-                    return
-                # else, move on
-                first_name = new_mem.first_name or "PersonWithNoName"  # edge case of empty name - occurs for some bugs.
-
-                if cust_welcome:
-                    if new_mem.last_name:
-                        fullname = "{} {}".format(first_name, new_mem.last_name)
-                    else:
-                        fullname = first_name
-                    count = chat.get_members_count()
-                    mention = mention_markdown(new_mem.id, first_name)
-                    if new_mem.username:
-                        username = "@" + escape_markdown(new_mem.username)
-                    else:
-                        username = mention
-
-                    valid_format = escape_invalid_curly_brackets(cust_welcome, VALID_WELCOME_FORMATTERS)
-                    res = valid_format.format(first=escape_markdown(first_name),
-                                              last=escape_markdown(new_mem.last_name or first_name),
-                                              fullname=escape_markdown(fullname), username=username, mention=mention,
-                                              count=count, chatname=escape_markdown(chat.title), id=new_mem.id)
-                    buttons = sql.get_welc_buttons(chat.id)
-                    keyb = build_keyboard(buttons)
-                else:
-                    res = sql.DEFAULT_WELCOME.format(first=first_name)
-                    keyb = []
+            members.append(new_mem)
 
-                keyboard = InlineKeyboardMarkup(keyb)
+        if not members:
+            return
+
+        # during join bursts, gather everyone joining in the window into a single welcome
+        if WELCOME_BATCH_WINDOW:
+            queue_joins(bot, update, members)
+            return
 
-                sent = send(update, res, keyboard,
-                            sql.DEFAULT_WELCOME.format(first=first_name))  # type: Optional[Message]
+        template = get_template(chat.id)
+        if template.type != sql.Types.TEXT and template.type != sql.Types.BUTTON_TEXT:
+            template.send_func(chat.id, template.content)
+            return
 
-        prev_welc = sql.get_clean_pref(chat.id)
-        if prev_welc:
-            try:
-                bot.delete_message(chat.id, prev_welc)
-            except BadRequest as excp:
-                pass
+        sent = None
+        # everyone in this update joined at once, so a cached member count goes up by all of them, once
+        count_delta = len(new_members)
+        for new_mem in members:
+            first_name = new_mem.first_name or "PersonWithNoName"  # edge case of empty name - occurs for some bugs.
+
+            if template.content:
+                res = format_template(template, chat, [new_mem], count_delta)
+                count_delta = 0
+                keyboard = template.keyboard
+            else:
+                res = sql.DEFAULT_WELCOME.format(first=first_name)
+                keyboard = InlineKeyboardMarkup([])
 
-            if sent:
-                sql.set_clean_welcome(chat.id, sent.message_id)
+            sent = send(update, res, keyboard,
+                        sql.DEFAULT_WELCOME.format(first=first_name))  # type: Optional[Message]
+
+        clean_previous_welcome(bot, chat, sent)
 
 
 @run_async
 def left_member(bot: Bot, update: Update):
     chat = update.effective_chat  # type: Optional[Chat]
-    should_goodbye, cust_goodbye, goodbye_type = sql.get_gdbye_pref(chat.id)
+    should_goodbye, _, _ = sql.get_gdbye_pref(chat.id)
     if should_goodbye:
         left_mem = update.effective_message.left_chat_member
         if left_mem:
@@ -156,37 +320,19 @@ def left_member(bot: Bot, update: Update):
                 update.effective_message.reply_text("Görüşürüz patron")
                 return
 
+            template = get_template(chat.id, goodbye=True)
             # if media goodbye, use appropriate function for it
-            if goodbye_type != sql.Types.TEXT and goodbye_type != sql.Types.BUTTON_TEXT:
-                ENUM_FUNC_MAP[goodbye_type](chat.id, cust_goodbye)
+            if template.type != sql.Types.TEXT and template.type != sql.Types.BUTTON_TEXT:
+                template.send_func(chat.id, template.content)
                 return
 
-            first_name = left_mem.first_name or "PersonWithNoName"  # edge case of empty name - occurs for some bugs.
-            if cust_goodbye:
-                if left_mem.last_name:
-                    fullname = "{} {}".format(first_name, left_mem.last_name)
-                else:
-                    fullname = first_name
-                count = chat.get_members_count()
-                mention = mention_markdown(left_mem.id, first_name)
-                if left_mem.username:
-                    username = "@" + escape_markdown(left_mem.username)
-                else:
-                    username = mention
-
-                valid_format = escape_invalid_curly_brackets(cust_goodbye, VALID_WELCOME_FORMATTERS)
-                res = valid_format.format(first=escape_markdown(first_name),
-                                          last=escape_markdown(left_mem.last_name or first_name),
-                                          fullname=escape_markdown(fullname), username=username, mention=mention,
-                                          count=count, chatname=escape_markdown(chat.title), id=left_mem.id)
-                buttons = sql.get_gdbye_buttons(chat.id)
-                keyb = build_keyboard(buttons)
+            if template.content:
+                res = format_template(template, chat, [left_mem], -1)
+                keyboard = template.keyboard
 
             else:
                 res = sql.DEFAULT_GOODBYE
-                keyb = []
-
-            keyboard = InlineKeyboardMarkup(keyb)
+                keyboard = InlineKeyboardMarkup([])
 
             send(update, res, keyboard, sql.DEFAULT_GOODBYE)
 
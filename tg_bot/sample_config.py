@@ -34,6 +34,21 @@ class Config(object):
     WORKERS = 8  # Number of subthreads to use. This is the recommended amount - see for yourself what works best!
     BAN_STICKER = 'CAADAgADOwADPPEcAXkko5EB3YGYAg'  # banhammer marie sticker
     ALLOW_EXCL = False  # Allow ! commands as well as /
+    ADMIN_CACHE_TTL = 300  # Seconds to trust a chat's cached admin list before asking telegram again
+    WELCOME_BATCH_WINDOW = 0  # Seconds to gather joins for one combined welcome. 0 welcomes everyone separately
+    DB_POOL_SIZE = None  # Database connections kept open. None means WORKERS + 4, enough for every worker thread
+    DB_MAX_OVERFLOW = 10  # Extra connections allowed on top of DB_POOL_SIZE during bursts
+    DB_POOL_TIMEOUT = 30  # Seconds to wait for a free connection before giving up
+    DB_POOL_RECYCLE = 1800  # Reconnect connections older than this many seconds
+    DB_POOL_PRE_PING = True  # Check connections are alive before using them
+    ASYNC_MODE = False  # Run handlers on an asyncio event loop instead of WORKERS threads
+    ASYNC_MAX_UPDATES = 256  # Handlers allowed in flight at once in async mode
+    ORDERED_UPDATES = False  # Run each chat's handlers one at a time, in update order. Chats still run in parallel
+    # Worker processes behind the webhook when started with `python3 -m tg_bot.sharding`. Each worker gets 1/SHARDS
+    # of the bot's overall sending rate for broadcasts, gbans, purges and other bulk jobs.
+    SHARDS = 0
+    SHARD_BUS = "unix"  # How shards tell each other about cache changes: "unix" sockets, or "postgres" LISTEN/NOTIFY
+    SHARD_SOCKET_DIR = "/tmp/tg_bot_shards"  # Where the shards' unix sockets are created
 
 
 class Production(Config):
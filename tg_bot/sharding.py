@@ -0,0 +1,227 @@
+"""
+Sharded webhook deployment, for spreading the bot over several CPU cores.
+
+Run `python3 -m tg_bot.sharding` instead of `python3 -m tg_bot`. This front process only receives telegram's webhook
+POSTs and forwards each update to one of SHARDS worker processes, picked by chat id, so a chat always lands on the
+same worker. Every worker is a normal `python3 -m tg_bot` (told its index through the SHARD_INDEX environment
+variable) with the full dispatcher and its own database pool; in-memory caches are kept in step across them by
+helper_funcs/cache_bus.py.
+"""
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Optional
+
+from telegram import Update
+
+from tg_bot import LOGGER, TOKEN, URL, PORT, CERT_PATH, SHARDS, SHARD_SOCKET_DIR, updater
+
+FRAME_HEADER = struct.Struct("!I")  # updates are sent to workers as length prefixed frames
+ACK = b"\x01"  # a worker's reply once the update is queued
+POLL_INTERVAL = 1  # seconds between checks for shutdown / dead workers
+
+# update fields carrying a message, whose chat the update belongs to
+MESSAGE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post")
+# update fields where only the sender is known
+USER_FIELDS = ("callback_query", "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query")
+
+
+def worker_socket(index: int) -> str:
+    return os.path.join(SHARD_SOCKET_DIR, "shard-{}.sock".format(index))
+
+
+def update_shard(update: dict, shards: int) -> int:
+    """
+    Pick the worker for a raw update: by chat where there is one, otherwise by user, so all of a chat's updates (and
+    its cached settings) stay on one worker.
+    """
+    for field in MESSAGE_FIELDS:
+        if field in update:
+            return update[field]["chat"]["id"] % shards
+
+    for field in USER_FIELDS:
+        if field in update:
+            query = update[field]
+            if query.get("message"):  # buttons belong to the chat of the message they're on
+                return query["message"]["chat"]["id"] % shards
+            return query["from"]["id"] % shards
+
+    return 0
+
+
+def recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_frame(sock: socket.socket) -> Optional[bytes]:
+    """:return: the next frame, or None once the other side closed the connection"""
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    return recv_exactly(sock, FRAME_HEADER.unpack(header)[0])
+
+
+class ShardLink(object):
+    """The front's connection to one worker; reconnects whenever the worker restarted."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def send(self, body: bytes) -> bool:
+        """:return: whether the worker accepted the update"""
+        with self._lock:
+            for _ in range(2):  # once more on a fresh connection, in case the worker restarted since the last update
+                try:
+                    if self._sock is None:
+                        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        self._sock.settimeout(10)
+                        self._sock.connect(worker_socket(self.index))
+                    self._sock.sendall(FRAME_HEADER.pack(len(body)) + body)
+                    if recv_exactly(self._sock, len(ACK)) == ACK:
+                        return True
+                    self._close()
+                except OSError as excp:
+                    LOGGER.warning("Couldn't pass update to shard %s: %s", self.index, excp)
+                    self._close()
+            return False
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/" + TOKEN:
+            self.send_error(403)
+            return
+
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        try:
+            update = json.loads(body.decode("utf-8"))
+            shard = update_shard(update, len(self.server.links))
+        except (ValueError, KeyError, TypeError):
+            LOGGER.warning("Dropping malformed webhook update: %r", body)
+            self.send_error(400)
+            return
+
+        # a non 200 answer makes telegram deliver the update again later
+        self.send_response(200 if self.server.links[shard].send(body) else 503)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        LOGGER.debug("webhook: " + format, *args)
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def __start_worker(index: int) -> subprocess.Popen:
+    LOGGER.info("Starting shard %s", index)
+    return subprocess.Popen([sys.executable, "-m", "tg_bot"], env=dict(os.environ, SHARD_INDEX=str(index)))
+
+
+def run_front():
+    if SHARDS < 1:
+        LOGGER.error("Set SHARDS to the number of worker processes to run. Bot quitting.")
+        quit(1)
+
+    os.makedirs(SHARD_SOCKET_DIR, exist_ok=True)
+    workers = [__start_worker(index) for index in range(SHARDS)]
+
+    server = WebhookServer(("127.0.0.1", PORT), WebhookHandler)
+    server.links = [ShardLink(index) for index in range(SHARDS)]
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+
+    if CERT_PATH:
+        updater.bot.set_webhook(url=URL + TOKEN, certificate=open(CERT_PATH, 'rb'))
+    else:
+        updater.bot.set_webhook(url=URL + TOKEN)
+    LOGGER.info("Routing webhook updates to %s shards.", SHARDS)
+
+    stopping = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stopping.set())
+
+    while not stopping.wait(POLL_INTERVAL):
+        for index, worker in enumerate(workers):
+            if worker.poll() is not None:
+                LOGGER.warning("Shard %s exited with code %s, restarting it", index, worker.returncode)
+                workers[index] = __start_worker(index)
+
+    server.shutdown()
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.wait()
+
+
+def __serve_connection(conn: socket.socket):
+    conn.settimeout(10)
+    with conn:
+        while updater.running:
+            # only start reading once a frame is arriving, so a timeout can't leave half of one behind
+            if not select.select([conn], [], [], POLL_INTERVAL)[0]:
+                continue
+            try:
+                body = recv_frame(conn)
+            except OSError:
+                return
+            if body is None:
+                return
+
+            updater.update_queue.put(Update.de_json(json.loads(body.decode("utf-8")), updater.bot))
+            conn.sendall(ACK)
+
+
+def __accept_updates(listener: socket.socket):
+    listener.settimeout(POLL_INTERVAL)
+    with listener:
+        while updater.running:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(target=__serve_connection, args=(conn,), name="shard_link", daemon=True).start()
+
+
+def run_worker(index: int):
+    """Start the dispatcher on updates passed on by the front, in place of start_webhook/start_polling."""
+    from tg_bot.modules.helper_funcs.cache_bus import start_bus
+
+    start_bus(index)
+
+    path = worker_socket(index)
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(8)
+
+    # the same steps start_webhook takes, minus its http server
+    updater.running = True
+    updater.job_queue.start()
+    updater._init_thread(updater.dispatcher.start, "dispatcher")
+    updater._init_thread(__accept_updates, "updater", listener)
+
+
+if __name__ == '__main__':
+    run_front()